@@ -125,11 +125,15 @@ private:
 static void runClient() {
     // Instantiate the client. It requires a channel, out of which the actual RPCs
     // are created. This channel models a connection to an endpoint (in this case,
-    // localhost at port 50051). We indicate that the channel isn't authenticated
-    // (use of InsecureChannelCredentials()).
+    // the server's local Unix domain socket, or localhost at port 33333 on Android).
+    // We indicate that the channel isn't authenticated (use of InsecureChannelCredentials()).
     std::this_thread::sleep_for(std::chrono::milliseconds(500));
-    BugaClient bugaClient(grpc::CreateChannel(
-            "localhost:33333", grpc::InsecureChannelCredentials()));
+#ifndef __ANDROID__
+    const std::string server_address = "unix:///tmp/buga_rpc_33333.sock";
+#else
+    const std::string server_address = "localhost:33333";
+#endif
+    BugaClient bugaClient(grpc::CreateChannel(server_address, grpc::InsecureChannelCredentials()));
     std::string reply = bugaClient.callGRpcEcho();
     std::cout << "Server replied: " << reply << std::endl;
     reply = bugaClient.callBugaRpcEcho();
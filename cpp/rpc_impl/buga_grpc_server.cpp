@@ -3,7 +3,13 @@
 
 #include <iostream>
 #include <cstdio>
+#include <cstdlib>
+#include <condition_variable>
 #include <grpcpp/grpcpp.h>
+#include <map>
+#include <mutex>
+#include <sstream>
+#include <stdexcept>
 #include <thread>
 #include "buga_rpc.pb.h"
 
@@ -20,6 +26,124 @@ using buga_rpc::DeviceRpc;
 using buga_rpc::DeviceRpcStreaming;
 using buga_rpc::GBuffer;
 
+// Max size of received and sent messages, and of the params of a chunked call
+static const int kMaxMessageSize = 1024 * 1024 * 1024;
+
+
+// region Admission control
+
+struct ResourceExhaustedError : std::runtime_error {
+    explicit ResourceExhaustedError(const std::string &what) : std::runtime_error(what) {}
+};
+
+/**
+ * Per procedure concurrency limits, same as pydcomm/rpc/admission.py. Configured from the environment:
+ *   BUGA_RPC_PROCEDURE_LIMITS - maximum concurrent invocations of procedures, e.g. "get_recorded_data=2,process=4".
+ *   BUGA_RPC_MAX_WAITING - maximum number of calls of a procedure waiting for it to be under its limit, default 0.
+ *   BUGA_RPC_MAX_ACTIVE - maximum number of calls of all procedures but control ones, running or waiting.
+ * Calls over these are rejected with RESOURCE_EXHAUSTED. The "_rpc_*" control procedures are never limited, so a
+ * burst of slow calls can't starve health checks.
+ */
+class AdmissionControl {
+public:
+    AdmissionControl() : maxWaiting(readIntFromEnvironment("BUGA_RPC_MAX_WAITING", 0)),
+                         maxActive(readIntFromEnvironment("BUGA_RPC_MAX_ACTIVE", -1)) {
+        const char *limitsString = std::getenv("BUGA_RPC_PROCEDURE_LIMITS");
+        if (limitsString) {
+            std::stringstream stream(limitsString);
+            std::string entry;
+            while (std::getline(stream, entry, ',')) {
+                const size_t separator = entry.find('=');
+                if (separator == std::string::npos) {
+                    throw RpcError("Bad BUGA_RPC_PROCEDURE_LIMITS entry: " + entry);
+                }
+                limits[entry.substr(0, separator)] = std::stoi(entry.substr(separator + 1));
+            }
+        }
+    }
+
+    /**
+     * Holds a call's admission while in scope. Waits for the call's turn when its procedure is at its limit, and
+     * throws ResourceExhaustedError if the call is rejected.
+     */
+    class Admission {
+    public:
+        Admission(AdmissionControl &control, const std::string &name) : control(control), name(name),
+                                                                         admitted(control.admit(name)) {}
+
+        ~Admission() {
+            if (admitted) {
+                control.release(name);
+            }
+        }
+
+        Admission(const Admission &) = delete;
+
+        Admission &operator=(const Admission &) = delete;
+
+    private:
+        AdmissionControl &control;
+        const std::string name;
+        const bool admitted;
+    };
+
+private:
+    std::mutex mutex;
+    std::condition_variable released;
+    std::map<std::string, int> limits;
+    const int maxWaiting;
+    const int maxActive;
+    std::map<std::string, int> running;
+    std::map<std::string, int> waiting;
+    int active = 0;
+
+    static int readIntFromEnvironment(const char *name, int defaultValue) {
+        const char *value = std::getenv(name);
+        return value ? std::stoi(value) : defaultValue;
+    }
+
+    /**
+     * @return Whether the call was counted, and needs releasing.
+     */
+    bool admit(const std::string &name) {
+        if (name.compare(0, 5, "_rpc_") == 0 || (limits.empty() && maxActive < 0)) {
+            return false;
+        }
+        std::unique_lock<std::mutex> lock(mutex);
+        if (maxActive >= 0 && active >= maxActive) {
+            throw ResourceExhaustedError("Call of " + name + " rejected, " + std::to_string(active) +
+                                         " calls already active");
+        }
+        const auto limit = limits.find(name);
+        if (limit != limits.end() && running[name] >= limit->second) {
+            if (waiting[name] >= maxWaiting) {
+                throw ResourceExhaustedError("Call of " + name + " rejected, " + std::to_string(running[name]) +
+                                             " calls already running and " + std::to_string(waiting[name]) +
+                                             " waiting");
+            }
+            ++waiting[name];
+            ++active;
+            released.wait(lock, [&] { return running[name] < limit->second; });
+            --waiting[name];
+        } else {
+            ++active;
+        }
+        ++running[name];
+        return true;
+    }
+
+    void release(const std::string &name) {
+        {
+            std::lock_guard<std::mutex> lock(mutex);
+            --running[name];
+            --active;
+        }
+        released.notify_all();
+    }
+};
+
+// endregion
+
 
 // region Server declaration
 
@@ -50,6 +174,10 @@ protected:
     int_between_30000_and_50000 rpcId = -1;
 
     void buildAndStart(bool wait);
+
+public:
+    // Per procedure concurrency limits, configured from the environment
+    AdmissionControl admission;
 };
 
 struct GRemoteProcedureStreamingServer : public GRemoteProcedureServer, public IRemoteProcedureStreamingServer {
@@ -60,10 +188,193 @@ struct GRemoteProcedureStreamingServer : public GRemoteProcedureServer, public I
 // endregion
 
 
+// region Batch framing
+
+/**
+ * Framing of the reserved "_rpc_batch" procedure, same as pydcomm/rpc/common.py.
+ * Request: uint32 count, then count times (uint32 name length, name, uint32 params length, params).
+ * Response: uint32 count, then count times (uint8 status, uint32 buffer length, buffer), where buffer is the return
+ * value if status is 0 or the error message otherwise. All integers are little endian.
+ */
+static void appendUint32(Buffer &out, uint32_t value) {
+    for (int i = 0; i < 4; ++i) {
+        out.push_back(static_cast<char>((value >> (8 * i)) & 0xff));
+    }
+}
+
+// "what" names the message being read, for errors
+static uint32_t readUint32(const Buffer &in, size_t &offset, const char *what = "batch message") {
+    if (offset + 4 > in.size()) {
+        throw RpcError(std::string("Truncated ") + what);
+    }
+    uint32_t value = 0;
+    for (int i = 0; i < 4; ++i) {
+        value |= static_cast<uint32_t>(static_cast<unsigned char>(in[offset + i])) << (8 * i);
+    }
+    offset += 4;
+    return value;
+}
+
+static Buffer readSizedBuffer(const Buffer &in, size_t &offset, const char *what = "batch message") {
+    const uint32_t size = readUint32(in, offset, what);
+    if (offset + size > in.size()) {
+        throw RpcError(std::string("Truncated ") + what);
+    }
+    Buffer out = in.substr(offset, size);
+    offset += size;
+    return out;
+}
+
+static void appendBatchResult(Buffer &out, bool ok, const Buffer &buf) {
+    out.push_back(static_cast<char>(ok ? 0 : 1));
+    appendUint32(out, static_cast<uint32_t>(buf.size()));
+    out.append(buf);
+}
+
+static void appendUint64(Buffer &out, uint64_t value) {
+    for (int i = 0; i < 8; ++i) {
+        out.push_back(static_cast<char>((value >> (8 * i)) & 0xff));
+    }
+}
+
+static uint64_t readUint64(const Buffer &in, size_t &offset, const char *what = "batch message") {
+    const uint64_t low = readUint32(in, offset, what);
+    const uint64_t high = readUint32(in, offset, what);
+    return low | (high << 32);
+}
+
+// endregion
+
+
+// region Chunked call framing
+
+/**
+ * Framing of the reserved streaming procedure "_rpc_chunked_call", same as pydcomm/rpc/common.py.
+ * Params: uint64 total params size, uint32 chunk size, procedure name. The params follow in chunks.
+ * Return: uint64 total return value size, followed by the return value in chunks.
+ */
+static Status callChunked(IRemoteProcedureExecutor &listener, AdmissionControl &admissionControl, const Buffer &header,
+                          grpc::ServerReaderWriter<GBuffer, GBuffer> *stream) {
+    size_t offset = 0;
+    const uint64_t totalSize = readUint64(header, offset);
+    const uint32_t chunkSize = readUint32(header, offset);
+    const std::string name = header.substr(offset);
+    if (chunkSize == 0) {
+        return Status(grpc::INVALID_ARGUMENT, "Chunk size must be positive");
+    }
+
+    if (totalSize > static_cast<uint64_t>(kMaxMessageSize)) {
+        throw RpcError("Chunked params size " + std::to_string(totalSize) + " exceeds the max message size " +
+                       std::to_string(kMaxMessageSize));
+    }
+
+    Buffer params;
+    params.reserve(totalSize);
+    GBuffer chunk;
+    while (stream->Read(&chunk)) {
+        params.append(chunk.buf());
+    }
+    if (params.size() != totalSize) {
+        return Status(grpc::INVALID_ARGUMENT, "Chunked params size doesn't match header");
+    }
+
+    Buffer ret;
+    {
+        AdmissionControl::Admission admission(admissionControl, name);
+        ret = listener.executeProcedure(name, params);
+    }
+    Buffer().swap(params);
+
+    Buffer sizeBuf;
+    appendUint64(sizeBuf, ret.size());
+    chunk.set_buf(sizeBuf);
+    if (!stream->Write(chunk)) {
+        return Status(grpc::UNAVAILABLE, "Client stopped reading");
+    }
+    for (size_t retOffset = 0; retOffset < ret.size(); retOffset += chunkSize) {
+        chunk.set_buf(ret.substr(retOffset, chunkSize));
+        if (!stream->Write(chunk)) {
+            return Status(grpc::UNAVAILABLE, "Client stopped reading");
+        }
+    }
+    return Status::OK;
+}
+
+// endregion
+
+
+// region Coalesced streaming framing
+
+/**
+ * Framing of the reserved streaming procedure "_rpc_coalesced_streaming", same as pydcomm/rpc/common.py.
+ * Params: frame of the real procedure name and params. Each following message is a frame of values written by the
+ * client. A frame is any number of (uint32 length, value).
+ */
+struct CoalescedBufferStreamReaderWriter : IBufferStreamReaderWriter {
+    std::unique_ptr<IBufferStreamReaderWriter> inner;
+    std::unique_ptr<Buffer> frame;
+    size_t offset = 0;
+
+    explicit CoalescedBufferStreamReaderWriter(std::unique_ptr<IBufferStreamReaderWriter> inner_)
+            : inner(std::move(inner_)) {}
+
+    std::unique_ptr<Buffer> read() override {
+        while (!frame || offset >= frame->size()) {
+            frame = inner->read();
+            offset = 0;
+            if (!frame) {
+                return std::unique_ptr<Buffer>(nullptr);
+            }
+        }
+        return std::make_unique<Buffer>(readSizedBuffer(*frame, offset, "coalesced frame"));
+    }
+
+    bool write(const Buffer &buffer) override {
+        return inner->write(buffer);
+    }
+};
+
+// endregion
+
+
 // region Service
 
+bool handleServerRpc(GRemoteProcedureServer *const parentServer, IRemoteProcedureExecutor &listener, const std::string &name, const Buffer &params, Buffer &ret);
+
+static Buffer executeBatch(GRemoteProcedureServer *const parentServer, IRemoteProcedureExecutor &listener, const Buffer &params) {
+    size_t offset = 0;
+    const uint32_t count = readUint32(params, offset);
+    Buffer ret;
+    appendUint32(ret, count);
+    for (uint32_t i = 0; i < count; ++i) {
+        const std::string name = readSizedBuffer(params, offset);
+        const Buffer callParams = readSizedBuffer(params, offset);
+        Buffer callRet;
+        try {
+            if (name == "_rpc_batch") {
+                throw RpcError("Nested batches are not supported");
+            }
+            if (!handleServerRpc(parentServer, listener, name, callParams, callRet)) {
+                AdmissionControl::Admission admission(parentServer->admission, name);
+                callRet = listener.executeProcedure(name, callParams);
+            }
+        } catch (std::exception &ex) {
+            appendBatchResult(ret, false, std::string("Error in executeProcedure: ") + ex.what());
+            continue;
+        } catch (...) {
+            appendBatchResult(ret, false, "Exception in executeProcedure");
+            continue;
+        }
+        appendBatchResult(ret, true, callRet);
+    }
+    return ret;
+}
+
 bool handleServerRpc(GRemoteProcedureServer *const parentServer, IRemoteProcedureExecutor &listener, const std::string &name, const Buffer &params, Buffer &ret) {
-    if (name == "_rpc_get_version") {
+    if (name == "_rpc_batch") {
+        ret = executeBatch(parentServer, listener, params);
+        return true;
+    } else if (name == "_rpc_get_version") {
         ret = listener.getVersion();
         return true;
     } else if (name == "_rpc_device_time_usec") {
@@ -82,16 +393,19 @@ Status call_impl(GRemoteProcedureServer *const parentServer, IRemoteProcedureExe
     const Buffer &params = req->buf();
 
     Buffer ret;
-    if (!handleServerRpc(parentServer, listener, name, params, ret)) {
-        try {
+    try {
+        if (!handleServerRpc(parentServer, listener, name, params, ret)) {
+            AdmissionControl::Admission admission(parentServer->admission, name);
             ret = listener.executeProcedure(name, params);
-        } catch (RpcError &ex) {
-            return Status(grpc::UNKNOWN, std::string("RPC error in executeProcedure: ") + ex.what());
-        } catch (std::runtime_error &ex) {
-            return Status(grpc::UNKNOWN, std::string("Runtime error in executeProcedure: ") + ex.what());
-        } catch (...) {
-            return Status(grpc::UNKNOWN, std::string("Exception in executeProcedure"));
         }
+    } catch (ResourceExhaustedError &ex) {
+        return Status(grpc::RESOURCE_EXHAUSTED, ex.what());
+    } catch (RpcError &ex) {
+        return Status(grpc::UNKNOWN, std::string("RPC error in executeProcedure: ") + ex.what());
+    } catch (std::runtime_error &ex) {
+        return Status(grpc::UNKNOWN, std::string("Runtime error in executeProcedure: ") + ex.what());
+    } catch (...) {
+        return Status(grpc::UNKNOWN, std::string("Exception in executeProcedure"));
     }
     res->set_buf(ret);
     return Status::OK;
@@ -181,17 +495,32 @@ Status BugaGRpcStreamingServiceImpl::call_streaming(::grpc::ServerContext *conte
             return Status(grpc::INVALID_ARGUMENT,
                           "callStreaming must start with procedureName and params sent from client");
         }
-        const std::string name = res.buf();
+        std::string name = res.buf();
 
         if (!stream->Read(&res)) {
             return Status(grpc::INVALID_ARGUMENT,
                           "callStreaming must start with procedureName and params sent from client");
         }
-        const std::string params = res.buf();
+        std::string params = res.buf();
 
-        auto writer = std::make_unique<GRpcBufferStreamWriter>(stream);
+        if (name == "_rpc_chunked_call") {
+            return callChunked(this->listener, this->parentServer->admission, params, stream);
+        }
+
+        std::unique_ptr<IBufferStreamReaderWriter> writer = std::make_unique<GRpcBufferStreamWriter>(stream);
+        if (name == "_rpc_coalesced_streaming") {
+            const Buffer header = params;
+            size_t offset = 0;
+            name = readSizedBuffer(header, offset, "coalesced streaming header");
+            params = readSizedBuffer(header, offset, "coalesced streaming header");
+            writer = std::make_unique<CoalescedBufferStreamReaderWriter>(std::move(writer));
+        }
+        // Held until the stream ends
+        AdmissionControl::Admission admission(this->parentServer->admission, name);
         static_cast<IRemoteProcedureStreamingExecutor *>(&this->listener)->executeProcedureStreaming(name, params,
                                                                                                      std::move(writer));
+    } catch (ResourceExhaustedError &ex) {
+        return Status(grpc::RESOURCE_EXHAUSTED, ex.what());
     } catch (RpcError &ex) {
         return Status(grpc::UNKNOWN, std::string("RPC error in executeProcedure: ") + ex.what());
     } catch (std::runtime_error &ex) {
@@ -240,6 +569,12 @@ void GRemoteProcedureServer::buildAndStart(bool wait) {
     // Listen on the given address without any authentication mechanism.
     std::string server_address = "0.0.0.0:" + std::to_string(this->rpcId);
     builder.AddListeningPort(server_address, grpc::InsecureServerCredentials());
+#ifndef __ANDROID__
+    // Also listen on a Unix domain socket, so clients on the same machine can skip TCP
+    // (must match LOCAL_SOCKET_PATH of the Python client)
+    std::string local_address = "unix:///tmp/buga_rpc_" + std::to_string(this->rpcId) + ".sock";
+    builder.AddListeningPort(local_address, grpc::InsecureServerCredentials());
+#endif
     // Register "service" as the instance through which we'll communicate with
     // clients. In this case it corresponds to an *synchronous* service.
 
@@ -248,13 +583,21 @@ void GRemoteProcedureServer::buildAndStart(bool wait) {
     }
 
     // Set max message size to 1Gb
-    const int max_message_size = 1024 * 1024 * 1024;
-    builder.SetMaxReceiveMessageSize(max_message_size);
-    builder.SetMaxSendMessageSize(max_message_size);
-    buga_rpc_log("Server max message size is " + std::to_string(max_message_size) + " bytes");
+    builder.SetMaxReceiveMessageSize(kMaxMessageSize);
+    builder.SetMaxSendMessageSize(kMaxMessageSize);
+    buga_rpc_log("Server max message size is " + std::to_string(kMaxMessageSize) + " bytes");
+
+    // Accept keepalive pings from clients also when there are no calls, as long as they're not too frequent
+    // (must match GRemoteProcedureServer.MIN_PING_INTERVAL of the Python server)
+    const int min_ping_interval_ms = 10 * 1000;
+    builder.AddChannelArgument(GRPC_ARG_KEEPALIVE_PERMIT_WITHOUT_CALLS, 1);
+    builder.AddChannelArgument(GRPC_ARG_HTTP2_MIN_RECV_PING_INTERVAL_WITHOUT_DATA_MS, min_ping_interval_ms);
     // Finally assemble the server.
     this->server = builder.BuildAndStart();
     buga_rpc_log("Server listening on " + server_address);
+#ifndef __ANDROID__
+    buga_rpc_log("Server listening on " + local_address);
+#endif
 
     if (!this->server)
         throw RpcError("Server object is null (1)");
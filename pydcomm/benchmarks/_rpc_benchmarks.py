@@ -5,7 +5,8 @@ from collections import OrderedDict
 import time
 from tqdm import tqdm
 import os
-from pydcomm.rpc._marshallers import cbor_marshal, cbor_unmarshal, nparray_marshal, nparray_unmarshal
+from pydcomm.rpc._marshallers import (cbor_marshal, cbor_unmarshal, nparray_marshal, nparray_unmarshal,
+                                      nparray_binary_marshal, nparray_binary_unmarshal)
 
 """
 Format:
@@ -98,6 +99,7 @@ def call_benchmark(rpc, repeats=None, compare_to_adb=False):
     name_to_stuff['float'] = (1000, cbor_marshal, cbor_unmarshal, 8.2)
     name_to_stuff['string'] = (1000, None, None, 'Test TEST test!')
     name_to_stuff['ndarray'] = (500, nparray_marshal, nparray_unmarshal, np.random.rand(2 ** 8))
+    name_to_stuff['ndarray_binary'] = (500, nparray_binary_marshal, nparray_binary_unmarshal, np.random.rand(2 ** 8))
     name_to_stuff['1k'] = (500, None, None, os.urandom(2 ** 10))
     name_to_stuff['100k'] = (100, None, None, os.urandom(100 * 2 ** 10))
     name_to_stuff['1M'] = (50, None, None, os.urandom(2 ** 20))
@@ -129,6 +131,47 @@ def call_benchmark(rpc, repeats=None, compare_to_adb=False):
         create_summary(benchmark_result_adb_pull)
 
 
+def local_transport_benchmark(rpc_id=29990, repeats=None):
+    """
+    Compares the shared memory transport with gRPC over TCP, for echo calls to an executor running on this machine.
+    """
+    from pydcomm.rpc.buga_grpc_server import GRemoteProcedureServer, BugaEchoExecutor
+    from pydcomm.rpc.buga_grpc_client import GRemoteProcedureClient
+    from pydcomm.rpc.shm_server import SharedMemoryRemoteProcedureServer
+    from pydcomm.rpc.shm_client import SharedMemoryRemoteProcedureClient
+
+    grpc_server, shm_server = GRemoteProcedureServer(local_socket=False), SharedMemoryRemoteProcedureServer()
+    grpc_server.listen(BugaEchoExecutor(), rpc_id, False)
+    shm_server.listen(BugaEchoExecutor(), rpc_id, False)
+    clients = OrderedDict()
+    clients['gRPC'] = GRemoteProcedureClient('localhost:{}'.format(rpc_id))
+    clients['Shared memory'] = SharedMemoryRemoteProcedureClient(rpc_id)
+
+    name_to_stuff = OrderedDict()
+    name_to_stuff['1k'] = (500, os.urandom(2 ** 10))
+    name_to_stuff['100k'] = (100, os.urandom(100 * 2 ** 10))
+    name_to_stuff['1M'] = (50, os.urandom(2 ** 20))
+    name_to_stuff['10M'] = (10, os.urandom(10 * 2 ** 20))
+    name_to_stuff['100M'] = (3, os.urandom(100 * 2 ** 20))
+
+    benchmark_results = OrderedDict((transport, OrderedDict()) for transport in clients)
+    try:
+        for name, (reps, params) in tqdm(name_to_stuff.items(), desc='Test', position=0):
+            if type(repeats) in (int, float):
+                reps = repeats
+            for transport, client in clients.items():
+                benchmark_results[transport][name] = [time_it(client, "call", ("echo", params), expected=(params,))
+                                                      for _ in tqdm(range(reps), desc=transport, position=1)]
+    finally:
+        grpc_server.stop()
+        shm_server.stop()
+
+    pandas_config_for_bench()
+    for transport, benchmark_result in benchmark_results.items():
+        print("\n{} echo:".format(transport))
+        create_summary(benchmark_result)
+
+
 if __name__ == "__main__":
     import re, subprocess
     ifconfig = subprocess.check_output("adb shell ifconfig", shell=True)
@@ -1,5 +1,8 @@
 import datetime
 import re
+import uuid
+from collections import namedtuple
+
 import numpy as np
 import subprocess
 
@@ -31,6 +34,24 @@ class OperationUnsupported(AndroidDeviceUtilsError):
     pass
 
 
+# A shell command of AndroidDeviceUtils: its args, a function of its stdout returning the method's return value, and a
+# function of the CommandFailedError it failed with raising the matching AndroidDeviceUtilsError (if any).
+ShellCommand = namedtuple("ShellCommand", "args parse_output check_error")
+
+# Runs a command of a ShellBatch, and prints its marker, exit code, stderr and marker again to stdout
+BATCH_COMMAND_TEMPLATE = ("{{ __e=$( ( {command}\n) </dev/null 2>&1 1>&3; printf x%d $? ); }} 3>&1\n"
+                          "printf '\\n%s %s\\n%s\\n%s\\n' {marker} \"${{__e##*x}}\" \"${{__e%x*}}\" {marker}\n")
+
+
+def _expect_no_output(output):
+    if output.strip() != '':
+        raise AndroidDeviceUtilsError('Unknown problem occurred')
+
+
+def _ignore_error(err):
+    pass
+
+
 class AndroidDeviceUtils:
     """
     Class exposing basic operations on an android device.
@@ -140,6 +161,24 @@ class AndroidDeviceUtils:
         # log.info("_shell params:", *args)
         return self.connection.adb(["shell"] + list(args))
 
+    def _run_shell_command(self, command):
+        """
+        :type command: ShellCommand
+        """
+        try:
+            output = self._shell(*command.args)
+        except CommandFailedError as err:
+            command.check_error(err)
+            raise
+        return command.parse_output(output)
+
+    def batch(self):
+        """
+        :return: Builder of commands to run in a single shell call.
+        :rtype: ShellBatch
+        """
+        return ShellBatch(self)
+
     def mkdir(self, path_on_device):
         """
         Create a folder on the device
@@ -147,19 +186,18 @@ class AndroidDeviceUtils:
         :raises FileAlreadyExists
         :raises WrongPermissions
         """
-        try:
-            output = self._shell("mkdir", path_on_device)
-        except CommandFailedError as err:
+        return self._run_shell_command(self._mkdir_command(path_on_device))
+
+    @staticmethod
+    def _mkdir_command(path_on_device):
+        def check_error(err):
             if 'No such file or directory' in err.stderr:
                 raise RemoteFileNotFound()
             if 'File exists' in err.stderr:
                 raise FileAlreadyExists()
             if 'Read-only file system' in err.stderr:
                 raise WrongPermissions()
-            raise
-
-        if output.strip() != '':
-            raise AndroidDeviceUtilsError('Unknown problem occurred')
+        return ShellCommand(["mkdir", path_on_device], _expect_no_output, check_error)
 
     def rmdir(self, path_on_device):
         """
@@ -167,33 +205,23 @@ class AndroidDeviceUtils:
         :type path_on_device: str
         :raises WrongPermissions
         """
-        try:
-            output = self._shell("rm", "-rf", path_on_device)
-        except CommandFailedError as err:
-            if 'Read-only file system' in err.stderr or 'No such file or directory' in err.stderr:
-                # Trying to remove a read-only file resulted in 'No such file or directory', so not sure how to distinguish these two.
-                raise WrongPermissions()
-            raise
-
-        if output.strip() != '':
-            raise AndroidDeviceUtilsError('Unknown problem occurred')
+        return self._run_shell_command(self._remove_command(["rm", "-rf", path_on_device]))
 
     def touch_file(self, path_on_device):
         """
         touch a file on the device
         :type path_on_device: str
         """
-        try:
-            output = self._shell("touch", path_on_device)
-        except CommandFailedError as err:
+        return self._run_shell_command(self._touch_file_command(path_on_device))
+
+    @staticmethod
+    def _touch_file_command(path_on_device):
+        def check_error(err):
             if 'No such file or directory' in err.stderr:
                 raise RemoteFileNotFound()
             if 'Read-only file system' in err.stderr:
                 raise WrongPermissions()
-            raise
-
-        if output.strip() != '':
-            raise AndroidDeviceUtilsError('Unknown problem occurred')
+        return ShellCommand(["touch", path_on_device], _expect_no_output, check_error)
 
     def remove(self, path_on_device):
         """
@@ -201,16 +229,15 @@ class AndroidDeviceUtils:
         :type path_on_device: str
         :raises WrongPermissions
         """
-        try:
-            output = self._shell("rm", "-f", path_on_device)
-        except CommandFailedError as err:
+        return self._run_shell_command(self._remove_command(["rm", "-f", path_on_device]))
+
+    @staticmethod
+    def _remove_command(args):
+        def check_error(err):
             if 'Read-only file system' in err.stderr or 'No such file or directory' in err.stderr:
                 # Trying to remove a read-only file resulted in 'No such file or directory', so not sure how to distinguish these two.
                 raise WrongPermissions()
-            raise
-
-        if output.strip() != '':
-            raise AndroidDeviceUtilsError('Unknown problem occurred')
+        return ShellCommand(args, _expect_no_output, check_error)
 
     def ls(self, path_on_device):
         """
@@ -291,7 +318,11 @@ class AndroidDeviceUtils:
         :type prop_name: str
         :rtype: str
         """
-        return self._shell("getprop", prop_name).rstrip('\n')
+        return self._run_shell_command(self._get_prop_command(prop_name))
+
+    @staticmethod
+    def _get_prop_command(prop_name):
+        return ShellCommand(["getprop", prop_name], lambda output: output.rstrip('\n'), _ignore_error)
 
     def set_prop(self, prop_name, value):
         """
@@ -300,7 +331,11 @@ class AndroidDeviceUtils:
         :type prop_name: str
         :type value: str
         """
-        self._shell("setprop", prop_name, '"' + value + '"')
+        self._run_shell_command(self._set_prop_command(prop_name, value))
+
+    @staticmethod
+    def _set_prop_command(prop_name, value):
+        return ShellCommand(["setprop", prop_name, '"' + value + '"'], lambda output: None, _ignore_error)
 
     def reboot(self):
         """
@@ -380,3 +415,127 @@ class AndroidDeviceUtils:
         :rtype: int
         """
         return self._parse_dumpsys_volume()['max']
+
+
+class ShellBatchResult(object):
+    """Result of a command of a ShellBatch"""
+    def __init__(self, args, stdout, stderr, returncode, value=None, error=None):
+        """
+        :param list[str] args: The command's args.
+        :param str stdout: The command's stdout.
+        :param str stderr: The command's stderr.
+        :param int returncode: The command's exit code.
+        :param value: What the matching AndroidDeviceUtils method would have returned.
+        :param Exception error: What the matching AndroidDeviceUtils method would have raised, None if it succeeded.
+        """
+        self.args = args
+        self.stdout = stdout
+        self.stderr = stderr
+        self.returncode = returncode
+        self.value = value
+        self.error = error
+
+    def get(self):
+        """
+        :return: The command's value.
+        :raises: The command's error, if it failed.
+        """
+        if self.error is not None:
+            raise self.error
+        return self.value
+
+
+class ShellBatch(object):
+    """
+    Queues shell commands and runs them in a single shell call, instead of a call for each:
+        >>> batch = device_utils.batch()  # doctest: +SKIP
+        >>> batch.mkdir("/sdcard/tmp/a").touch_file("/sdcard/tmp/a/b").get_prop("ro.product.model")  # doctest: +SKIP
+        >>> mkdir_result, touch_result, model_result = batch.execute()  # doctest: +SKIP
+        >>> model = model_result.get()  # doctest: +SKIP
+
+    Commands run one after the other, also when previous ones failed. Each command's result has its stdout, stderr
+    and exit code, and the value or error of the matching AndroidDeviceUtils method.
+    """
+    def __init__(self, device_utils):
+        """
+        :type device_utils: AndroidDeviceUtils
+        """
+        self.device_utils = device_utils
+        self._commands = []
+
+    def __len__(self):
+        return len(self._commands)
+
+    def shell(self, *args):
+        """Queue a shell command, whose value is its stdout."""
+        return self._add(ShellCommand(list(args), lambda output: output.strip("\r\n"), _ignore_error))
+
+    def mkdir(self, path_on_device):
+        return self._add(self.device_utils._mkdir_command(path_on_device))
+
+    def rmdir(self, path_on_device):
+        return self._add(self.device_utils._remove_command(["rm", "-rf", path_on_device]))
+
+    def touch_file(self, path_on_device):
+        return self._add(self.device_utils._touch_file_command(path_on_device))
+
+    def remove(self, path_on_device):
+        return self._add(self.device_utils._remove_command(["rm", "-f", path_on_device]))
+
+    def get_prop(self, prop_name):
+        return self._add(self.device_utils._get_prop_command(prop_name))
+
+    def set_prop(self, prop_name, value):
+        return self._add(self.device_utils._set_prop_command(prop_name, value))
+
+    def execute(self, timeout=None):
+        """
+        Run the queued commands, and clear the queue.
+
+        :param float | None timeout: Timeout of the whole batch in seconds.
+        :return: Result of each command, in the order they were queued.
+        :rtype: list[ShellBatchResult]
+        :raises AndroidDeviceUtilsError: If the output of the batch couldn't be parsed.
+        """
+        commands, self._commands = self._commands, []
+        if not commands:
+            return []
+        batch_marker = "__pydcomm_batch_{}__".format(uuid.uuid4().hex)
+        markers = ["{}{}".format(batch_marker, i) for i in range(len(commands))]
+        # The output begins with the batch marker, so it isn't changed by stripping the output's newlines
+        script = "echo {}\n".format(batch_marker) + "".join(
+            BATCH_COMMAND_TEMPLATE.format(command=" ".join(command.args), marker=marker)
+            for command, marker in zip(commands, markers))
+        output = self.device_utils.connection.adb(["shell", script], timeout=timeout)
+
+        results = []
+        position = output.find(batch_marker + "\n")
+        if position < 0:
+            raise AndroidDeviceUtilsError("Couldn't parse the output of the batch")
+        position += len(batch_marker) + 1
+        for command, marker in zip(commands, markers):
+            match = re.compile(r"(.*?)\r?\n{0} (\d+)\r?\n(.*?)\r?\n{0}(?:\r?\n|$)".format(marker), re.S).match(
+                output, position)
+            if match is None:
+                raise AndroidDeviceUtilsError("Couldn't parse the output of {}".format(" ".join(command.args)))
+            position = match.end()
+            results.append(self._result(command, *match.groups()))
+        return results
+
+    def _add(self, command):
+        self._commands.append(command)
+        return self
+
+    @staticmethod
+    def _result(command, stdout, returncode, stderr):
+        result = ShellBatchResult(command.args, stdout, stderr, int(returncode))
+        try:
+            if result.returncode != 0:
+                err = CommandFailedError("adb returned with non-zero error code", stdout=stdout, stderr=stderr,
+                                         returncode=result.returncode)
+                command.check_error(err)
+                raise err
+            result.value = command.parse_output(stdout)
+        except (AndroidDeviceUtilsError, CommandFailedError) as ex:
+            result.error = ex
+        return result
@@ -0,0 +1,429 @@
+"""
+Client of the adb server's "smart socket" protocol, for running adb commands without starting an adb process each time.
+
+The adb server (started by any adb command) listens on localhost:5037. Each request is sent on a new connection as a
+4 hex digits length followed by the request, and is answered with "OKAY", or "FAIL" followed by a length prefixed
+message. "host:*" requests are handled by the server itself. After "host:transport:<serial>", the connection is
+attached to the device, and the next request is a device service, e.g. "shell:<command>" or "sync:".
+See SERVICES.TXT, SYNC.TXT and shell_protocol.h in the adb sources for the full protocol.
+"""
+import os
+import socket
+import stat
+import struct
+import time
+
+import subprocess32 as subprocess
+
+from pydcomm.public.iconnection import CommandFailedError
+
+ADB_SERVER_PORT = 5037
+
+# Shell protocol packet: id, data length (little endian), data
+SHELL_PACKET_HEADER = struct.Struct("<BI")
+SHELL_ID_STDIN = 0
+SHELL_ID_STDOUT = 1
+SHELL_ID_STDERR = 2
+SHELL_ID_EXIT = 3
+SHELL_ID_CLOSE_STDIN = 4
+
+# Sync protocol message: id, length or value (little endian)
+SYNC_HEADER = struct.Struct("<4sI")
+SYNC_STAT = struct.Struct("<4sIII")  # "STAT", mode, size, mtime
+SYNC_MAX_DATA = 64 * 1024
+DEFAULT_PUSH_MODE = 0644
+
+
+class AdbHostProtocolUnsupported(Exception):
+    """The command can't be run through the adb server's protocol, and should be run with the adb binary"""
+
+
+class AdbRequestFailedError(CommandFailedError):
+    """The adb server answered a request with FAIL"""
+    def __init__(self, fail_message):
+        """
+        :param str fail_message: Message following the FAIL, e.g. "device 'serial' not found".
+        """
+        super(AdbRequestFailedError, self).__init__("adb returned with non-zero error code", stdout="",
+                                                    stderr="error: " + fail_message, returncode=1)
+        self.fail_message = fail_message
+
+
+class AdbHostClient(object):
+    """
+    Runs adb commands through the adb server's protocol, see the module's documentation.
+
+    Supports the commands pydcomm uses most: shell (with arguments), push and pull of single files, devices, connect,
+    disconnect and kill-server. `run` raises `AdbHostProtocolUnsupported` for anything else, or when the adb server
+    isn't running, so the caller can run the adb binary instead, which also starts the server.
+    """
+    def __init__(self, host="localhost", port=ADB_SERVER_PORT):
+        """
+        :param str host: Host of the adb server.
+        :param int port: Port of the adb server.
+        """
+        self.host = host
+        self.port = port
+        self._shell_v2_unsupported = set()  # Serials of devices whose adbd doesn't know the shell protocol
+
+    def run(self, params, timeout=None):
+        """
+        Run an adb command, like the adb binary would.
+
+        :param list[str] params: adb params, without "adb" in the beginning.
+        :param float timeout: Seconds to wait for the command, None to wait forever.
+        :return: Output of the command.
+        :rtype: str
+        :raises AdbHostProtocolUnsupported: If the command should be run with the adb binary, also when the connection
+            to the adb server failed before the command started.
+        :raises CommandFailedError: If the command failed, or the connection to the adb server failed while it ran.
+        :raises subprocess.TimeoutExpired: If the command timed out.
+        """
+        serial = None
+        args = list(params)
+        if args[:1] == ["-s"]:
+            serial, args = args[1], args[2:]
+        if not args:
+            raise AdbHostProtocolUnsupported()
+        command, args = args[0], args[1:]
+
+        deadline = None if timeout is None else time.time() + timeout
+        try:
+            if command == "shell" and args:
+                return self.shell(serial, " ".join(args), deadline)
+            elif command == "push" and len(args) == 2:
+                return self.push(serial, args[0], args[1], deadline)
+            elif command == "pull" and len(args) == 2:
+                return self.pull(serial, args[0], args[1], deadline)
+            elif command == "devices" and not args:
+                return "List of devices attached\n" + self._host_request("host:devices", deadline)
+            elif command in ("connect", "disconnect") and len(args) == 1:
+                return self._host_request("host:{}:{}".format(command, args[0]), deadline)
+            elif command == "kill-server" and not args:
+                self._open(deadline, "host:kill").close()
+                return ""
+        except socket.timeout:
+            raise subprocess.TimeoutExpired(["adb"] + list(params), timeout)
+        except socket.error as ex:
+            # Errors before the command started are raised as AdbHostProtocolUnsupported by `_open`
+            raise CommandFailedError("adb server connection failed: {}".format(ex), stdout="", stderr=str(ex),
+                                     returncode=1)
+        raise AdbHostProtocolUnsupported()
+
+    # region Services
+
+    def shell(self, serial, command, deadline=None):
+        """
+        :param str serial: Device serial, None for the only device.
+        :param str command: Shell command line.
+        :param float deadline: time.time() to give up at, None to wait forever.
+        :return: Standard output of the command.
+        :rtype: str
+        :raises CommandFailedError: If the command exited with a non-zero code, with its output and exit code.
+        """
+        try:
+            stream = self.open_shell(serial, command, deadline)
+        except AdbHostProtocolUnsupported:
+            # Old adbd, which only has the legacy shell
+            with _closing(self._open_device_service(serial, "shell:" + command, deadline)) as sock:
+                return self._read_until_closed(sock, deadline)
+
+        with _closing(stream):
+            return self._read_shell_v2(stream, deadline)
+
+    def open_shell(self, serial, command="", deadline=None):
+        """
+        Start a shell command through the shell protocol, without waiting for it to end.
+
+        :param str serial: Device serial, None for the only device.
+        :param str command: Shell command line, "" for a shell reading commands written to the stream.
+        :param float deadline: time.time() to give up starting the command at, None to wait forever.
+        :rtype: ShellStream
+        :raises AdbHostProtocolUnsupported: If the device doesn't support the shell protocol.
+        """
+        if serial in self._shell_v2_unsupported:
+            raise AdbHostProtocolUnsupported()
+        try:
+            return ShellStream(self._open_device_service(serial, "shell,v2,raw:" + command, deadline))
+        except AdbRequestFailedError as ex:
+            # An adbd without the shell protocol closes the service, which the server answers with FAIL "closed"
+            if ex.fail_message != "closed":
+                raise
+            self._shell_v2_unsupported.add(serial)
+            raise AdbHostProtocolUnsupported()
+        except CommandFailedError:
+            # The connection was lost without an answer, which says nothing about the device, so it's not remembered
+            raise AdbHostProtocolUnsupported()
+
+    def push(self, serial, local_path, path_on_device, deadline=None):
+        """
+        Push a file to the device.
+
+        :return: Summary like the adb binary's.
+        :rtype: str
+        :raises AdbHostProtocolUnsupported: If `local_path` is a directory.
+        """
+        if os.path.isdir(local_path):
+            raise AdbHostProtocolUnsupported()
+        if not os.path.exists(local_path):
+            raise CommandFailedError("adb returned with non-zero error code", stdout="",
+                                     stderr="adb: error: cannot stat '{}': No such file or directory".format(
+                                         local_path), returncode=1)
+
+        start = time.time()
+        size = 0
+        with _closing(self._open_device_service(serial, "sync:", deadline)) as sock:
+            # Like the adb binary, pushing to a directory pushes into it
+            if path_on_device.endswith("/") or stat.S_ISDIR(self._stat(sock, path_on_device, deadline)):
+                path_on_device = path_on_device.rstrip("/") + "/" + os.path.basename(local_path)
+            mode = stat.S_IMODE(os.stat(local_path).st_mode) or DEFAULT_PUSH_MODE
+            self._send_sync(sock, "SEND", "{},{}".format(path_on_device, mode))
+            with open(local_path, "rb") as f:
+                while True:
+                    data = f.read(SYNC_MAX_DATA)
+                    if not data:
+                        break
+                    self._send_sync(sock, "DATA", data)
+                    size += len(data)
+            sock.sendall(SYNC_HEADER.pack("DONE", int(os.path.getmtime(local_path))))
+            response_id, length = SYNC_HEADER.unpack(self._recv_exactly(sock, SYNC_HEADER.size, deadline))
+            if response_id == "FAIL":
+                self._sync_failed(self._recv_exactly(sock, length, deadline))
+            self._send_sync(sock, "QUIT", "")
+        return "{}: 1 file pushed. ({} bytes in {:.3f}s)".format(local_path, size, time.time() - start)
+
+    def pull(self, serial, path_on_device, local_path, deadline=None):
+        """
+        Pull a file from the device.
+
+        :return: Summary like the adb binary's.
+        :rtype: str
+        :raises AdbHostProtocolUnsupported: If `path_on_device` is a directory.
+        """
+        start = time.time()
+        size = 0
+        with _closing(self._open_device_service(serial, "sync:", deadline)) as sock:
+            mode = self._stat(sock, path_on_device, deadline)
+            if stat.S_ISDIR(mode):
+                raise AdbHostProtocolUnsupported()
+            if mode == 0:
+                self._sync_failed("failed to stat remote object '{}': No such file or directory".format(
+                    path_on_device))
+            if os.path.isdir(local_path):
+                local_path = os.path.join(local_path, os.path.basename(path_on_device))
+
+            try:
+                f = open(local_path, "wb")
+            except IOError as ex:
+                raise CommandFailedError("adb returned with non-zero error code", stdout="",
+                                         stderr="adb: error: cannot create '{}': {}".format(local_path, ex.strerror),
+                                         returncode=1)
+            # Written as received, so large files aren't held in memory
+            try:
+                with f:
+                    self._send_sync(sock, "RECV", path_on_device)
+                    while True:
+                        response_id, length = SYNC_HEADER.unpack(self._recv_exactly(sock, SYNC_HEADER.size,
+                                                                                    deadline))
+                        if response_id == "DONE":
+                            break
+                        buf = self._recv_exactly(sock, length, deadline)
+                        if response_id == "FAIL":
+                            self._sync_failed(buf)
+                        f.write(buf)
+                        size += len(buf)
+            except BaseException:
+                os.unlink(local_path)  # Like the adb binary, don't leave a partial file
+                raise
+            self._send_sync(sock, "QUIT", "")
+        return "{}: 1 file pulled. ({} bytes in {:.3f}s)".format(path_on_device, size, time.time() - start)
+
+    # endregion
+
+    # region Protocol
+
+    def _host_request(self, request, deadline):
+        with _closing(self._open(deadline, request)) as sock:
+            return self._recv_exactly(sock, int(self._recv_exactly(sock, 4, deadline), 16), deadline)
+
+    def _open_device_service(self, serial, service, deadline):
+        transport = "host:transport:" + serial if serial else "host:transport-any"
+        sock = self._open(deadline, transport)
+        self._request_or_close(sock, service, deadline)
+        return sock
+
+    def _open(self, deadline, request):
+        """:return: Connection to the adb server, on which the request was accepted."""
+        try:
+            sock = socket.create_connection((self.host, self.port), timeout=self._time_left(deadline))
+        except socket.timeout:
+            raise
+        except socket.error:
+            raise AdbHostProtocolUnsupported()  # Server isn't running, the adb binary starts it
+        self._request_or_close(sock, request, deadline)
+        return sock
+
+    def _request_or_close(self, sock, request, deadline):
+        try:
+            self._request(sock, request, deadline)
+        except socket.timeout:
+            sock.close()
+            raise
+        except socket.error:
+            # E.g. the server restarted, nothing ran yet, so the adb binary can run the command instead
+            sock.close()
+            raise AdbHostProtocolUnsupported()
+        except BaseException:
+            sock.close()
+            raise
+
+    def _request(self, sock, request, deadline):
+        sock.sendall("{:04x}{}".format(len(request), request))
+        status = self._recv_exactly(sock, 4, deadline)
+        if status == "FAIL":
+            raise AdbRequestFailedError(self._recv_exactly(sock, int(self._recv_exactly(sock, 4, deadline), 16),
+                                                           deadline))
+        if status != "OKAY":
+            raise CommandFailedError("Unexpected adb server response {!r}".format(status), stdout="", stderr="",
+                                     returncode=1)
+
+    def _read_shell_v2(self, stream, deadline):
+        stdout = []
+        stderr = []
+        while True:
+            packet = stream.read(self._time_left(deadline))
+            if packet is None:
+                raise socket.timeout()
+            packet_id, data = packet
+            if packet_id == SHELL_ID_STDOUT:
+                stdout.append(data)
+            elif packet_id == SHELL_ID_STDERR:
+                stderr.append(data)
+            elif packet_id == SHELL_ID_EXIT:
+                exit_code = ord(data) if data else 1  # Connection lost before the exit code, like the adb binary
+                break
+        stdout, stderr = "".join(stdout), "".join(stderr)
+        if exit_code != 0:
+            raise CommandFailedError("adb returned with non-zero error code", stdout=stdout, stderr=stderr,
+                                     returncode=exit_code)
+        return stdout
+
+    def _read_until_closed(self, sock, deadline):
+        data = []
+        while True:
+            sock.settimeout(self._time_left(deadline))
+            buf = sock.recv(SYNC_MAX_DATA)
+            if not buf:
+                return "".join(data)
+            data.append(buf)
+
+    def _stat(self, sock, path, deadline):
+        """:return: Mode of the path on the device, 0 if it doesn't exist."""
+        self._send_sync(sock, "STAT", path)
+        _, mode, _, _ = SYNC_STAT.unpack(self._recv_exactly(sock, SYNC_STAT.size, deadline))
+        return mode
+
+    @staticmethod
+    def _send_sync(sock, message_id, data):
+        sock.sendall(SYNC_HEADER.pack(message_id, len(data)) + data)
+
+    @staticmethod
+    def _sync_failed(message):
+        raise CommandFailedError("adb returned with non-zero error code", stdout="", stderr="adb: error: " + message,
+                                 returncode=1)
+
+    def _recv_exactly(self, sock, size, deadline, allow_eof=False):
+        """
+        :param bool allow_eof: Whether to return an empty string if the connection was closed before any data.
+        """
+        data = []
+        left = size
+        while left:
+            sock.settimeout(self._time_left(deadline))
+            buf = sock.recv(left)
+            if not buf:
+                if allow_eof and left == size:
+                    return ""
+                raise CommandFailedError("adb server closed the connection", stdout="", stderr="closed", returncode=1)
+            data.append(buf)
+            left -= len(buf)
+        return "".join(data)
+
+    @staticmethod
+    def _time_left(deadline):
+        if deadline is None:
+            return None
+        time_left = deadline - time.time()
+        if time_left <= 0:
+            raise socket.timeout()
+        return time_left
+
+    # endregion
+
+
+class ShellStream(object):
+    """
+    Running shell command, whose stdin, stdout, stderr and exit code are multiplexed on a connection to the adb server.
+    """
+    def __init__(self, sock):
+        self._sock = sock
+        self._buf = ""
+
+    def write(self, data):
+        """Write to the command's stdin."""
+        self._sock.sendall(SHELL_PACKET_HEADER.pack(SHELL_ID_STDIN, len(data)) + data)
+
+    def close_stdin(self):
+        self._sock.sendall(SHELL_PACKET_HEADER.pack(SHELL_ID_CLOSE_STDIN, 0))
+
+    def read(self, timeout=None):
+        """
+        :param float timeout: Seconds to wait for output, None to wait forever.
+        :return: Next packet from the command: SHELL_ID_STDOUT or SHELL_ID_STDERR and output, or SHELL_ID_EXIT and
+            the exit code byte, which is "" if the connection was lost. None if nothing was received in time.
+        :rtype: (int, str)
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while True:
+            if len(self._buf) >= SHELL_PACKET_HEADER.size:
+                packet_id, length = SHELL_PACKET_HEADER.unpack_from(self._buf)
+                end = SHELL_PACKET_HEADER.size + length
+                if len(self._buf) >= end:
+                    data, self._buf = self._buf[SHELL_PACKET_HEADER.size:end], self._buf[end:]
+                    if packet_id in (SHELL_ID_STDOUT, SHELL_ID_STDERR, SHELL_ID_EXIT):
+                        return packet_id, data
+                    continue  # E.g. window size changes
+
+            time_left = None if deadline is None else deadline - time.time()
+            if time_left is not None and time_left <= 0:
+                return None
+            self._sock.settimeout(time_left)
+            try:
+                buf = self._sock.recv(SYNC_MAX_DATA)
+            except socket.timeout:
+                return None
+            except socket.error:
+                buf = ""
+            if not buf:
+                return SHELL_ID_EXIT, ""
+            self._buf += buf
+
+    def close(self):
+        """Close the connection, which kills the command. Unblocks a `read` waiting in another thread."""
+        try:
+            self._sock.shutdown(socket.SHUT_RDWR)
+        except socket.error:
+            pass  # Already closed
+        self._sock.close()
+
+
+class _closing(object):
+    """Like `contextlib.closing`, for sockets and streams"""
+    def __init__(self, sock):
+        self.sock = sock
+
+    def __enter__(self):
+        return self.sock
+
+    def __exit__(self, *args):
+        self.sock.close()
@@ -0,0 +1,93 @@
+import time
+from threading import Lock
+
+# Commands that restart the adb server or adbd, or change the devices it knows. Running them too close to each other
+# races the restart, e.g. "connect" right after "disconnect" may fail.
+RACY_ADB_COMMANDS = frozenset(["kill-server", "start-server", "connect", "disconnect", "reconnect", "tcpip", "usb",
+                               "root", "unroot"])
+DEFAULT_MIN_INTERVAL = 0.5
+# Token fractions below this are float rounding of the refill, not a reason to wait again
+_TOKEN_EPSILON = 1e-9
+
+
+class TokenBucket(object):
+    """
+    Allows `burst` calls at once, and refills at one call per `interval` seconds.
+
+    Calls that `release` the bucket when they end are spaced from their end rather than from their start: the time a
+    call runs doesn't refill the bucket.
+    """
+    def __init__(self, interval, burst=1):
+        """
+        :param float interval: Seconds it takes to refill a call.
+        :param int burst: Maximum number of calls allowed without waiting.
+        """
+        self.interval = interval
+        self.burst = burst
+        self._tokens = float(burst)
+        self._last_refill = time.time()
+        self._lock = Lock()
+
+    def acquire(self):
+        """Wait until a call is allowed, and take it."""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1 - _TOKEN_EPSILON:
+                    self._tokens = max(self._tokens - 1, 0.)
+                    return
+                wait = (1 - self._tokens) * self.interval
+            # Not holding the lock, so calls ending meanwhile can release
+            time.sleep(wait)
+
+    def release(self):
+        """Tell that a call ended, refilling restarts from now."""
+        with self._lock:
+            self._last_refill = time.time()
+
+    def _refill(self):
+        now = time.time()
+        if self.interval > 0:
+            self._tokens = min(self.burst, self._tokens + (now - self._last_refill) / self.interval)
+        else:
+            self._tokens = self.burst
+        self._last_refill = now
+
+
+class AdbRateLimiter(object):
+    """
+    Spaces out adb commands known to race, other commands (e.g. shell) are not limited.
+    """
+    def __init__(self, min_interval=DEFAULT_MIN_INTERVAL, burst=1, racy_commands=RACY_ADB_COMMANDS):
+        """
+        :param float min_interval: Average seconds between racy commands, 0 to not limit them.
+        :param int burst: Number of racy commands allowed without waiting.
+        :param set[str] racy_commands: adb commands to limit, None to limit all commands.
+        """
+        self.racy_commands = racy_commands
+        self._bucket = TokenBucket(min_interval, burst)
+
+    def wait(self, params):
+        """
+        Wait until the adb command is allowed to run. Call `release` once it ended.
+
+        :param list[str] params: adb params, without "adb" in the beginning.
+        """
+        if self.is_racy(params):
+            self._bucket.acquire()
+
+    def release(self, params):
+        """
+        Tell that the adb command ended, so the next racy command is spaced from its end.
+
+        :param list[str] params: adb params, without "adb" in the beginning.
+        """
+        if self.is_racy(params):
+            self._bucket.release()
+
+    def is_racy(self, params):
+        if self.racy_commands is None:
+            return True
+        if params[:1] == ["-s"]:
+            params = params[2:]
+        return bool(params) and params[0] in self.racy_commands
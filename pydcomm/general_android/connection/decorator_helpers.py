@@ -52,7 +52,7 @@ def add_init_decorator(function, run_before=False):
         class TempClass(connection):
             pass
 
-        def new_init(self, device_id=None, filter_wireless_devices=False):
+        def new_init(self, device_id=None, filter_wireless_devices=False, **kwargs):
             def run():
                 try:
                     function(self, device_id)
@@ -62,7 +62,7 @@ def add_init_decorator(function, run_before=False):
 
             if run_before:
                 run()
-            original_init(self, device_id, filter_wireless_devices)
+            original_init(self, device_id, filter_wireless_devices, **kwargs)
             if not run_before:
                 run()
 
@@ -6,23 +6,41 @@ import os
 import subprocess32 as subprocess
 
 from pydcomm.public.iconnection import ConnectionClosedError, CommandFailedError, ConnectingError
+from pydcomm.general_android.connection.adb_host_client import AdbHostClient, AdbHostProtocolUnsupported
 from pydcomm.general_android.connection.adb_monitor_wrapping_echo_hi import AdbMonitorWrappingEchoHi, NullMonitor
+from pydcomm.general_android.connection.adb_rate_limiter import AdbRateLimiter
+from pydcomm.general_android.connection.shell_session import ShellSession, AdbProcessShell
+from pydcomm.general_android.connection.streaming_shell import StreamingShell, DEFAULT_MAX_BUFFERED_LINES
 
 TEST_CONNECTION_ATTEMPTS = 3
 TEST_CONNECTION_TIMEOUT = 0.3
-ADB_CALL_MINIMAL_INTERVAL = 0.5
 
 
 class InternalAdbConnection(object):
-    def __init__(self, device_id=None, filter_wireless_devices=False):
+    def __init__(self, device_id=None, filter_wireless_devices=False, adb_client=None, rate_limiter=None,
+                 persistent_shell=False):
+        """
+        :param str device_id: Device to connect to, None to choose one.
+        :param bool filter_wireless_devices: Whether to choose only from wired devices.
+        :param AdbHostClient adb_client: Client to run adb commands through the adb server's protocol instead of the
+            adb binary, commands it doesn't support still run with the binary. If None, it's used only if the
+            BUGA_ADB_HOST_PROTOCOL env variable is set.
+        :param AdbRateLimiter rate_limiter: Spaces out adb commands that race, None for the default limiter.
+        :param bool persistent_shell: Whether to run shell commands in a shell kept open on the device, instead of
+            a new adb shell for each command, see ShellSession.
+        """
         # Print adb commands only if env variable is set
         self.debug = os.environ.has_key("BUGA_ADB_DEBUG")
+        if adb_client is None and os.environ.has_key("BUGA_ADB_HOST_PROTOCOL"):
+            adb_client = AdbHostClient()
+        self.adb_client = adb_client
+        self.rate_limiter = rate_limiter or AdbRateLimiter()
+        self.persistent_shell = persistent_shell
+        self._shell_session = None
+        self._shell_session_device_id = None
         # TODO: test adb version
         self.log = logging.getLogger(__name__)
 
-        # Initially set the last call to be "old" enough to allow the next call
-        self.last_adb_call_time = time.time() - ADB_CALL_MINIMAL_INTERVAL
-
         self.wired = True
 
         if not device_id:
@@ -46,6 +64,9 @@ class InternalAdbConnection(object):
         In wired connection does nothing
         """
         self.device_id = None
+        if self._shell_session is not None:
+            self._shell_session.close()
+            self._shell_session = None
 
     def adb(self, command, timeout=None, specific_device=True, disable_fixers=False):
         """
@@ -94,27 +115,70 @@ class InternalAdbConnection(object):
         :raises TimeoutExpired is case the ADB command was timed out
         :raises AdbConnectionError is case of ADB connection error
         """
-        # Make sure enough time passed since the last ASB call
-        time_since_last_adb_call = time.time() - self.last_adb_call_time
-        if time_since_last_adb_call < ADB_CALL_MINIMAL_INTERVAL:
-            time.sleep(ADB_CALL_MINIMAL_INTERVAL - time_since_last_adb_call)
-
-        if self.debug:
-            print(time.time(), end=" - ")
-            print(["adb"] + params)
-
-        p = subprocess.Popen(["adb"] + params, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self.rate_limiter.wait(params)
         try:
+            if self.debug:
+                print(time.time(), end=" - ")
+                print(["adb"] + params)
+
             if timeout is None:
                 timeout = 60
-            output, error = p.communicate(timeout=timeout)
+            output = None
+            if self.persistent_shell and len(params) > 3 and params[0] == "-s" and params[2] == "shell":
+                output = self._get_shell_session(params[1]).run(" ".join(params[3:]), timeout)
+            elif self.adb_client is not None:
+                try:
+                    output = self.adb_client.run(params, timeout)
+                except AdbHostProtocolUnsupported:
+                    pass
+            if output is None:
+                output = self._run_adb_binary(params, timeout)
+            return output.strip("\r\n")
         finally:
-            self.last_adb_call_time = time.time()
+            self.rate_limiter.release(params)
 
+    def streaming_shell(self, command, timeout=None, max_buffered_lines=DEFAULT_MAX_BUFFERED_LINES):
+        """
+        Start a shell command, and stream its output lines while it runs.
+        :param str command: Shell command line.
+        :param float | None timeout: Seconds to allow the command to run, None for no limit
+        :param int max_buffered_lines: Maximum number of lines read from the command and not consumed yet
+        :rtype: StreamingShell
+        :raises ConnectionClosedError is case the connection was closed
+        """
+        if self.device_id is None:
+            raise ConnectionClosedError()
+        if self.debug:
+            print(time.time(), end=" - ")
+            print(["adb", "-s", self.device_id, "shell", command])
+        return StreamingShell(self._open_shell(self.device_id, command), timeout=timeout,
+                              max_buffered_lines=max_buffered_lines)
+
+    def _get_shell_session(self, device_id):
+        if self._shell_session is not None and self._shell_session_device_id != device_id:
+            self._shell_session.close()
+            self._shell_session = None
+        if self._shell_session is None:
+            self._shell_session = ShellSession(lambda: self._open_shell(device_id))
+            self._shell_session_device_id = device_id
+        return self._shell_session
+
+    def _open_shell(self, device_id, command=""):
+        if self.adb_client is not None:
+            try:
+                return self.adb_client.open_shell(device_id, command)
+            except AdbHostProtocolUnsupported:
+                pass
+        return AdbProcessShell(["adb", "-s", device_id, "shell"] + ([command] if command else []))
+
+    # noinspection PyMethodMayBeStatic
+    def _run_adb_binary(self, params, timeout):
+        p = subprocess.Popen(["adb"] + params, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        output, error = p.communicate(timeout=timeout)
         if p.returncode != 0:
             raise CommandFailedError("adb returned with non-zero error code",
                                      stdout=output, stderr=error, returncode=p.returncode)
-        return output.strip("\r\n")
+        return output
 
     def test_connection(self):
         attempts = TEST_CONNECTION_ATTEMPTS
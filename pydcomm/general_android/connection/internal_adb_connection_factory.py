@@ -12,13 +12,19 @@ from pydcomm.general_android.connection.wireless_adb_connection import add_conne
 
 class InternalAdbConnectionFactory(object):
     @staticmethod
-    def create_connection(wired=False, ip=None, device=None, fixers=None):
+    def create_connection(wired=False, ip=None, device=None, fixers=None, adb_client=None, rate_limiter=None,
+                          persistent_shell=False):
         """
         Create a connection to the given ip or device, add the given fixers
         :param wired: Connect wired or wireless
         :param ip: If given and connecting wireless, connect to this IP
         :param device: If given, connect to this USB device
         :param list[(connection) -> None] fixers: A list of fixer functions
+        :param pydcomm.general_android.connection.adb_host_client.AdbHostClient adb_client: Client to run adb commands
+            through the adb server's protocol, see InternalAdbConnection.
+        :param pydcomm.general_android.connection.adb_rate_limiter.AdbRateLimiter rate_limiter: Spaces out adb
+            commands that race, None for the default limiter.
+        :param bool persistent_shell: Whether to run shell commands in a shell kept open on the device.
         :return
         """
         fixers = fixers or []
@@ -30,7 +36,8 @@ class InternalAdbConnectionFactory(object):
 
         con_cls = add_fixers(con_cls, "adb", fixers)
 
-        con = con_cls(ip or device, filter_wireless_devices=wired)
+        con = con_cls(ip or device, filter_wireless_devices=wired, adb_client=adb_client,
+                      rate_limiter=rate_limiter, persistent_shell=persistent_shell)
         return con
 
     @staticmethod
@@ -0,0 +1,179 @@
+"""
+Persistent shell on the device, running shell commands without starting a new adb process and device shell for each.
+
+Each command is written to the shell followed by printing a marker unique to the command to stderr, and then with
+its exit code to stdout. The command's output is what the shell prints until the markers. Shells without a separate
+stderr print both markers to stdout, the stderr marker first, and their output is all stdout.
+"""
+import os
+import re
+import time
+import uuid
+from itertools import count
+from Queue import Queue, Empty, Full
+from threading import Event, Lock, Thread
+
+import subprocess32 as subprocess
+
+from pydcomm.general_android.connection.adb_host_client import SHELL_ID_STDOUT, SHELL_ID_STDERR, SHELL_ID_EXIT
+from pydcomm.public.iconnection import CommandFailedError
+
+MAX_BUFFERED_PACKETS = 16  # Of up to 64KB, read from the adb process and not consumed yet
+
+# Runs the command in a subshell, so commands don't change each other's environment or read the shell's input
+COMMAND_TEMPLATE = ("( {command}\n) </dev/null\n__pydcomm_exit=$?\nprintf '\\n%s\\n' {marker} >&2\n"
+                    "printf '\\n%s %d\\n' {marker} $__pydcomm_exit\n")
+
+
+class ShellSessionClosedError(CommandFailedError):
+    """The session's shell exited, e.g. because the device disconnected"""
+
+
+class AdbProcessShell(object):
+    """
+    Shell running in an adb process, with the same interface as `adb_host_client.ShellStream`.
+
+    The adb binary runs the shell without a terminal when its stdin isn't one, on devices supporting the shell
+    protocol (Android 7 and later). Older devices echo the commands written to the shell into its output, and merge
+    its stderr into stdout.
+
+    When `MAX_BUFFERED_PACKETS` packets are waiting to be read, the output isn't read from the adb process until they
+    are, so the process blocks on writing it.
+    """
+    def __init__(self, args):
+        """
+        :param list[str] args: Command line of the shell, e.g. ["adb", "-s", serial, "shell"], or of a shell
+            command, e.g. ["adb", "-s", serial, "shell", "logcat"].
+        """
+        self._process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        self._packets = Queue(maxsize=MAX_BUFFERED_PACKETS)
+        self._closed = Event()
+        self._stderr_reader = Thread(target=self._read_stream, args=(SHELL_ID_STDERR, self._process.stderr))
+        stdout_reader = Thread(target=self._read_stream, args=(SHELL_ID_STDOUT, self._process.stdout))
+        for reader in (self._stderr_reader, stdout_reader):
+            reader.daemon = True
+            reader.start()
+
+    def _read_stream(self, stream_id, stream):
+        for data in iter(lambda: os.read(stream.fileno(), 64 * 1024), ""):
+            self._put((stream_id, data))
+        if stream_id == SHELL_ID_STDOUT:
+            self._stderr_reader.join()  # The exit code is the last packet, like in the shell protocol
+            self._put((SHELL_ID_EXIT, chr(self._process.wait() & 0xff)))
+
+    def _put(self, packet):
+        # Waits for the packets to be read while the buffer is full, unless closed
+        while not self._closed.is_set():
+            try:
+                self._packets.put(packet, timeout=0.1)
+                return
+            except Full:
+                pass
+
+    def write(self, data):
+        self._process.stdin.write(data)
+        self._process.stdin.flush()
+
+    def read(self, timeout=None):
+        try:
+            return self._packets.get(timeout=timeout)
+        except Empty:
+            return None
+
+    def close(self):
+        """Kill the shell. Unblocks a `read` waiting in another thread, which returns SHELL_ID_EXIT and ""."""
+        self._closed.set()
+        if self._process.poll() is None:
+            self._process.kill()
+        self._process.wait()
+        # The readers don't put more than the packet each may be putting, so the queue has room for the exit packet
+        while True:
+            try:
+                self._packets.get_nowait()
+            except Empty:
+                break
+        self._packets.put_nowait((SHELL_ID_EXIT, ""))
+
+
+class ShellSession(object):
+    """
+    Runs shell commands one after another in the same shell, see the module's documentation.
+
+    The shell is started on the first command. If a command times out or the shell exits, the shell is closed, and
+    the next command starts a new one.
+    """
+    def __init__(self, open_shell):
+        """
+        :param () -> AdbProcessShell open_shell: Starts a shell. May return any object with the interface of
+            `AdbProcessShell`, e.g. `adb_host_client.ShellStream`.
+        """
+        self._open_shell = open_shell
+        self._shell = None
+        self._session_id = uuid.uuid4().hex
+        self._command_ids = count()
+        self._lock = Lock()
+
+    def run(self, command, timeout=None):
+        """
+        Run a shell command.
+
+        :param str command: Shell command line.
+        :param float timeout: Seconds to wait for the command, None to wait forever.
+        :return: Standard output of the command.
+        :rtype: str
+        :raises CommandFailedError: If the command exited with a non-zero code, with its output and exit code.
+        :raises ShellSessionClosedError: If the shell exited before the command ended.
+        :raises subprocess.TimeoutExpired: If the command timed out.
+        """
+        with self._lock:
+            if self._shell is None:
+                self._shell = self._open_shell()
+            marker = "__pydcomm_{}_{}__".format(self._session_id, next(self._command_ids))
+            try:
+                self._shell.write(COMMAND_TEMPLATE.format(command=command, marker=marker))
+                exit_code, stdout, stderr = self._read_command_output(marker, command, timeout)
+            except BaseException:
+                self._close_shell()
+                raise
+
+        if exit_code != 0:
+            raise CommandFailedError("adb returned with non-zero error code", stdout=stdout, stderr=stderr,
+                                     returncode=exit_code)
+        return stdout
+
+    def close(self):
+        with self._lock:
+            self._close_shell()
+
+    def _read_command_output(self, marker, command, timeout):
+        stdout_end = re.compile(r"\r?\n{} (\d+)\r?\n".format(marker))
+        stderr_end = re.compile(r"\r?\n{}\r?\n".format(marker))
+        stdout = stderr = ""
+        stdout_match = stderr_match = None
+        deadline = None if timeout is None else time.time() + timeout
+        while stdout_match is None or stderr_match is None:
+            packet = self._shell.read(None if deadline is None else max(deadline - time.time(), 0))
+            if packet is None:
+                raise subprocess.TimeoutExpired(command, timeout)
+            packet_id, data = packet
+            if packet_id == SHELL_ID_STDOUT:
+                stdout += data
+                if stdout_match is None:
+                    stdout_match = stdout_end.search(stdout, max(len(stdout) - len(data) - len(marker) - 16, 0))
+                    merged_match = None if stdout_match is None else stderr_end.search(stdout, 0, stdout_match.start())
+                    if merged_match is not None:
+                        # The shell has no separate stderr, so stderr is part of stdout
+                        return int(stdout_match.group(1)), stdout[:merged_match.start()], ""
+            elif packet_id == SHELL_ID_STDERR:
+                stderr += data
+                if stderr_match is None:
+                    stderr_match = stderr_end.search(stderr, max(len(stderr) - len(data) - len(marker) - 4, 0))
+            else:
+                raise ShellSessionClosedError("Shell exited", stdout=stdout, stderr=stderr,
+                                              returncode=ord(data) if data else None)
+        return int(stdout_match.group(1)), stdout[:stdout_match.start()], stderr[:stderr_match.start()]
+
+    def _close_shell(self):
+        if self._shell is not None:
+            shell, self._shell = self._shell, None
+            shell.close()
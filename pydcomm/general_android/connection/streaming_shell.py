@@ -0,0 +1,134 @@
+import time
+from Queue import Queue, Full
+from threading import Thread, Event
+
+import subprocess32 as subprocess
+
+from pydcomm.general_android.connection.adb_host_client import SHELL_ID_STDOUT, SHELL_ID_STDERR, SHELL_ID_EXIT
+
+DEFAULT_MAX_BUFFERED_LINES = 10000
+MAX_STDERR_SIZE = 64 * 1024
+_END = object()
+
+
+class StreamingShell(object):
+    """
+    Stoppable iterator of the stdout lines of a running shell command, without their line endings:
+        >>> with connection.streaming_shell("logcat -v time") as lines:  # doctest: +SKIP
+        ...     for line in lines:
+        ...         if "Boot is finished" in line:
+        ...             break
+
+    A reader thread reads the output while the command runs, so lines are available as soon as the command prints
+    them. When `max_buffered_lines` lines are waiting to be consumed, the reader stops reading, and the command blocks
+    on writing its output until they are.
+
+    Iterating ends when the command exits, or when `stop` is called. If the command runs longer than the timeout, it
+    is killed, and iterating raises `subprocess.TimeoutExpired` after the lines read before.
+    """
+    def __init__(self, shell, timeout=None, max_buffered_lines=DEFAULT_MAX_BUFFERED_LINES):
+        """
+        :param pydcomm.general_android.connection.shell_session.AdbProcessShell shell: The running command. May be any
+            object with its interface, e.g. `adb_host_client.ShellStream`.
+        :param float timeout: Seconds to allow the command to run, None for no limit.
+        :param int max_buffered_lines: Maximum number of lines read and not consumed yet.
+        """
+        self.timeout = timeout
+        self.returncode = None  # Exit code of the command once it exited, if known
+        self.stderr = ""  # Beginning of the command's stderr
+        self.timed_out = False
+        self._shell = shell
+        self._lines = Queue(maxsize=max_buffered_lines)
+        self._stopped = Event()
+        self._reader = Thread(target=self._read)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        if self._stopped.is_set():
+            raise StopIteration()
+        line = self._lines.get()
+        if line is _END:
+            self._lines.put(_END)  # For the next call
+            if self.timed_out:
+                raise subprocess.TimeoutExpired("shell", self.timeout)
+            raise StopIteration()
+        return line
+
+    __next__ = next
+
+    def stop(self):
+        """Kill the command, and end iterating."""
+        self._stopped.set()
+        self._shell.close()
+        try:
+            self._lines.put_nowait(_END)  # In case the consumer is waiting for a line
+        except Full:
+            pass
+
+    def wait(self, timeout=None):
+        """
+        Wait for the command to end.
+
+        :param float timeout: Seconds to wait, None to wait forever.
+        :return: Whether the command ended.
+        :rtype: bool
+        """
+        self._reader.join(timeout)
+        return not self._reader.is_alive()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.stop()
+
+    def _read(self):
+        deadline = None if self.timeout is None else time.time() + self.timeout
+        partial_line = ""
+        try:
+            while not self._stopped.is_set():
+                packet = self._shell.read(None if deadline is None else max(deadline - time.time(), 0))
+                if packet is None:
+                    self.timed_out = True
+                    break
+                packet_id, data = packet
+                if packet_id == SHELL_ID_STDOUT:
+                    lines = (partial_line + data).split("\n")
+                    partial_line = lines.pop()
+                    for line in lines:
+                        if not self._put(line.rstrip("\r"), deadline):
+                            break
+                    if self.timed_out:
+                        break
+                elif packet_id == SHELL_ID_STDERR:
+                    self.stderr = (self.stderr + data)[:MAX_STDERR_SIZE]
+                elif packet_id == SHELL_ID_EXIT:
+                    self.returncode = ord(data) if data else None
+                    break
+            if partial_line and not self._stopped.is_set() and not self.timed_out:
+                self._put(partial_line.rstrip("\r"), deadline)
+        finally:
+            self._shell.close()
+            self._put(_END)
+
+    def _put(self, item, deadline=None):
+        # Waits for the consumer while the buffer is full, unless stopped or timed out. Returns whether it was put.
+        while not self._stopped.is_set():
+            if deadline is not None and time.time() >= deadline:
+                self.timed_out = True
+                return False
+            try:
+                self._lines.put(item, timeout=0.1)
+                return True
+            except Full:
+                pass
+        # Stopped, the consumer ends iterating on its next call, but may already be waiting for a line
+        try:
+            self._lines.put_nowait(_END)
+        except Full:
+            pass
+        return False
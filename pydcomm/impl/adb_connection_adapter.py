@@ -53,18 +53,28 @@ class AdbConnection(IConnection):
         full_command = ["shell", command] if type(command) is str else ["shell"] + command
         return self.adb_connection.adb(full_command, timeout=self._get_timeout_seconds(timeout_ms))
 
+    def shell_batch(self):
+        """
+        Builder of shell commands to run in a single shell call, see ShellBatch.
+
+        :rtype: pydcomm.general_android.android_device_utils.ShellBatch
+        """
+        return self.device_utils.batch()
+
     def streaming_shell(self, command, timeout_ms=None):
         """
         Calls the shell command and returns an iterator of line from the stdout.
         The return object must have a method to stop the stream.
-        TODO: Define this "stoppable" iterator thing.
 
-        :param str command: Command to run.
-        :param int|None timeout_ms: Maximum time to allow the command to run.
-        :return: Stoppable iterator of lines from output.
+        :param str|list[str] command: Command to run.
+        :param int|None timeout_ms: Maximum time to allow the command to run, None for no limit.
+        :return: Stoppable iterator of lines from output, see StreamingShell.
+        :rtype: pydcomm.general_android.connection.streaming_shell.StreamingShell
         """
-        # TODO: implement
-        raise NotImplementedError
+        if type(command) is not str:
+            command = " ".join(command)
+        timeout = None if timeout_ms is None else timeout_ms / 1000.
+        return self.adb_connection.streaming_shell(command, timeout=timeout)
 
     def logcat(self, timeout_ms=None, dump=False, clear=False):
         """
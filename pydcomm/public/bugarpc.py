@@ -27,6 +27,23 @@ class IRemoteProcedureClient(object):
         """
         raise NotImplementedError
 
+    def call_batch(self, calls):
+        """
+        Calls many procedures on device, in order. Implementations may send all calls in a single round trip.
+        A failing call doesn't stop the calls after it.
+
+        :param list[(str, str)] calls: Pairs of procedure name and params.
+        :return: For each call, the string sent from device, or the `RpcError` describing why it failed.
+        :rtype: list[str|RpcError]
+        """
+        results = []
+        for procedure_name, params in calls:
+            try:
+                results.append(self.call(procedure_name, params))
+            except Exception as ex:
+                results.append(ex if isinstance(ex, RpcError) else RpcError(str(ex)))
+        return results
+
     def get_version(self):
         """
         Returns the version string of this class.
@@ -92,8 +92,7 @@ class IConnection(object):
     def streaming_shell(self, command, timeout_ms=None):
         """
         Calls the shell command and returns an iterator of line from the stdout.
-        The return object must have a method to stop the stream.
-        TODO: Define this "stoppable" iterator thing.
+        The return object must have a method to stop the stream, `stop()`.
 
         :param str command: Command to run.
         :param int|None timeout_ms: Maximum time to allow the command to run.
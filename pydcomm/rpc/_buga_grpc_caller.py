@@ -7,8 +7,15 @@ from pydcomm.rpc.gen.buga_rpc_pb2 import GRequest
 class BugaGRpcCaller(StandardRemoteProcedureCaller):
     MAX_MESSAGE_SIZE = 1024*1024*1024  # 1Gb
 
-    def __init__(self, ip_port):
+    def __init__(self, ip_port, marshaller_registry=None):
+        """
+        :param str ip_port: Address of the executor's server.
+        :param pydcomm.rpc._marshallers.MarshallerRegistry|None marshaller_registry: Registry for marshalling calls
+            without explicit marshallers, e.g. `default_marshaller_registry`. The executor must unpack and answer with
+            the same registry.
+        """
         self.host_port = ip_port or 'localhost:50051'  # TODO remove this default
+        self.marshaller_registry = marshaller_registry
         self.channel = None  # This needs to remain an instance variable (according to https://blog.jeffli.me/blog/2017/08/02/keep-python-grpc-client-connection-truly-alive/)
         self.stub = None
 
@@ -43,9 +43,19 @@ class IRemoteProcedureCaller:
 
 
 class StandardRemoteProcedureCaller(IRemoteProcedureCaller):
+    # If set, calls without explicit marshallers are sent in a content type envelope of this registry, and the return
+    # value is unpacked according to the content type the executor chose.
+    marshaller_registry = None  # type: pydcomm.rpc._marshallers.MarshallerRegistry or None
+
     def call(self, procedure_name, params, marshaller=None, unmarshaller=None):
-        marshalled_params = marshaller(params) if marshaller else str(params)
+        registry = self.marshaller_registry if marshaller is None and unmarshaller is None else None
+        if registry:
+            marshalled_params = registry.pack(params)
+        else:
+            marshalled_params = marshaller(params) if marshaller else str(params)
         ret = self._send_and_wait_for_return(procedure_name, marshalled_params)
+        if registry:
+            return registry.unpack(ret)[0]
         return unmarshaller(ret) if unmarshaller else ret
 
     def get_executor_version(self):
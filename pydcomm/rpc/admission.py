@@ -0,0 +1,114 @@
+from collections import Counter
+from contextlib import contextmanager
+from threading import Lock, Condition
+
+# Procedures with this prefix are the server's own control procedures, e.g. health checks
+CONTROL_PROCEDURE_PREFIX = "_rpc_"
+
+
+class ResourceExhaustedError(RuntimeError):
+    """A call was rejected because too many calls are already running or waiting"""
+
+
+class AdmissionControl(object):
+    """
+    Limits how many invocations of each procedure run at once on a server.
+
+    A call over its procedure's limit waits for a running one to return. If `max_waiting` calls of the procedure are
+    already waiting, it's rejected with `ResourceExhaustedError`, which gRPC servers return as RESOURCE_EXHAUSTED.
+
+    Control procedures ("_rpc_*") are never limited, and `max_active` caps the number of other calls holding a server
+    thread, running or waiting. Keeping it below the server's number of threads reserves a fast lane for control
+    procedures, so a burst of slow calls can't starve health checks:
+        >>> admission = AdmissionControl({"get_recorded_data": 2}, max_waiting=4, max_active=8)
+        >>> server = GRemoteProcedureServer(max_workers=10, admission_control=admission)  # doctest: +SKIP
+
+    Batched and chunked calls are admitted per procedure they contain. Streaming calls hold their slot until the
+    stream ends.
+    """
+    def __init__(self, limits=None, default_limit=None, max_waiting=0, max_active=None):
+        """
+        @param dict[str, int] limits: Maximum number of concurrent invocations of each procedure.
+        @param int default_limit: Maximum number of concurrent invocations of procedures not in `limits`, None for no
+            limit.
+        @param int max_waiting: Maximum number of calls of a procedure waiting for it to be under its limit.
+        @param int max_active: Maximum number of calls of all procedures but control ones, running or waiting. None
+            for no limit.
+        """
+        self.limits = dict(limits or {})
+        self.default_limit = default_limit
+        self.max_waiting = max_waiting
+        self.max_active = max_active
+        self.rejected = Counter()
+        self._lock = Lock()
+        self._conditions = {}  # Procedure name to the condition its waiting calls wait on
+        self._running = Counter()
+        self._waiting = Counter()
+        self._active = 0
+
+    @property
+    def unlimited(self):
+        return not self.limits and self.default_limit is None and self.max_active is None
+
+    @contextmanager
+    def admit(self, procedure_name):
+        """
+        Context of running a call, waits for the call's turn when its procedure is at its limit.
+
+        @param str procedure_name: Procedure called.
+        @raise ResourceExhaustedError: If the call is rejected.
+        """
+        if self.unlimited or procedure_name.startswith(CONTROL_PROCEDURE_PREFIX):
+            yield
+            return
+
+        limit = self.limits.get(procedure_name, self.default_limit)
+        with self._lock:
+            if self.max_active is not None and self._active >= self.max_active:
+                self._reject(procedure_name, "{} calls already active".format(self._active))
+            if limit is not None and self._running[procedure_name] >= limit:
+                if self._waiting[procedure_name] >= self.max_waiting:
+                    self._reject(procedure_name, "{} calls already running and {} waiting".format(
+                        self._running[procedure_name], self._waiting[procedure_name]))
+                self._wait_for_turn(procedure_name, limit)
+            else:
+                self._active += 1
+            self._running[procedure_name] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._running[procedure_name] -= 1
+                self._active -= 1
+                condition = self._conditions.get(procedure_name)
+                if condition is not None:
+                    condition.notify()
+
+    def stats(self):
+        """
+        @return: Number of active calls, and the number of running, waiting and rejected calls of each procedure.
+        @rtype: dict
+        """
+        with self._lock:
+            stats = {"admission_active": self._active}
+            for name, counter in (("running", self._running), ("waiting", self._waiting), ("rejected", self.rejected)):
+                stats.update(("admission_{}_{}".format(procedure_name, name), count)
+                             for procedure_name, count in counter.items())
+            return stats
+
+    def _wait_for_turn(self, procedure_name, limit):
+        # Called with the lock held
+        condition = self._conditions.get(procedure_name)
+        if condition is None:
+            condition = self._conditions[procedure_name] = Condition(self._lock)
+        self._waiting[procedure_name] += 1
+        self._active += 1
+        try:
+            while self._running[procedure_name] >= limit:
+                condition.wait()
+        finally:
+            self._waiting[procedure_name] -= 1
+
+    def _reject(self, procedure_name, reason):
+        self.rejected[procedure_name] += 1
+        raise ResourceExhaustedError("Call of {} rejected, {}".format(procedure_name, reason))
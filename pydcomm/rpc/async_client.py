@@ -0,0 +1,149 @@
+"""
+Non-blocking RPC clients, for driving many devices from a single thread.
+
+Every method returns a `concurrent.futures.Future` right away instead of waiting, so calls to several devices are
+in flight together. Use `gather` and `wait_any` from `pydcomm.rpc.buga_grpc_client` to wait for them, or add done
+callbacks:
+    >>> clients = gather([AsyncGRpcClientFactory.create_connection(29999, ip) for ip in ips])  # doctest: +SKIP
+    >>> versions = gather([client.get_executor_version() for client in clients])  # doctest: +SKIP
+"""
+from concurrent import futures
+
+from pydcomm.rpc.buga_grpc_client import (GRemoteProcedureClient, GRemoteProcedureStreamingClient, _GRpcClientFactory,
+                                          unmarshal_batch_results)
+from pydcomm.rpc.common import RPC_BATCH_PROCEDURE, marshal_batch_request
+
+# Runs the blocking connection handshakes of `AsyncGRpcClientFactory`
+_connect_executor = futures.ThreadPoolExecutor(max_workers=8)
+
+
+def _then(future, func):
+    """
+    :return: Future of `func` applied to the result of `future`.
+    :rtype: futures.Future
+    """
+    chained = futures.Future()
+
+    def on_done(f):
+        try:
+            chained.set_result(func(f.result()))
+        except Exception as ex:
+            chained.set_exception(ex)
+    future.add_done_callback(on_done)
+    return chained
+
+
+class AsyncGReaderWriterStream(object):
+    """
+    Non-blocking view of a streaming call: `read` returns a future of the next value.
+
+    gRPC receives a stream's messages only by blocking on them, so each stream has a single reader thread. Reads are
+    served by it in order.
+    """
+    def __init__(self, stream):
+        """
+        :param pydcomm.rpc.common.GReaderWriterStream stream: The streaming call.
+        """
+        self.stream = stream
+        self._reader = futures.ThreadPoolExecutor(max_workers=1)
+
+    def read(self):
+        """
+        :return: Future of the next value sent from the server. Its exception is StopIteration at the end of the stream.
+        :rtype: futures.Future
+        """
+        return self._reader.submit(self.stream.read)
+
+    def write(self, value):
+        """
+        Writes a value to the server without waiting.
+
+        :raises Queue.Full: If the stream's write queue is full.
+        :raises pydcomm.rpc.common.QueueClosedError: If the call was cancelled or ended.
+        """
+        self.stream.write(value, timeout=0)
+
+    def end_write(self):
+        self.stream.end_write()
+
+    def cancel(self):
+        """Cancels the call, pending reads end with StopIteration."""
+        self.stream.cancel()
+        self._reader.shutdown(wait=False)
+
+
+class AsyncGRemoteProcedureClient(object):
+    """
+    Non-blocking version of `GRemoteProcedureClient`, see the module's documentation.
+    """
+    def __init__(self, client):
+        """
+        :param GRemoteProcedureClient client: Connected client to make the calls with. Must be a
+            `GRemoteProcedureStreamingClient` for streaming calls.
+        """
+        self.client = client
+
+    def call(self, procedure_name, params, timeout=None):
+        """
+        See `GRemoteProcedureClient.call_async`.
+
+        :rtype: pydcomm.rpc.buga_grpc_client.GRpcCallFuture
+        """
+        return self.client.call_async(procedure_name, params, timeout=timeout)
+
+    def call_batch(self, calls, timeout=None):
+        """
+        See `GRemoteProcedureClient.call_batch`.
+
+        :return: Future of the list of results.
+        :rtype: futures.Future
+        """
+        if not calls:
+            no_results = futures.Future()
+            no_results.set_result([])
+            return no_results
+        return _then(self.call(RPC_BATCH_PROCEDURE, marshal_batch_request(calls), timeout=timeout),
+                     unmarshal_batch_results)
+
+    def get_executor_version(self):
+        """
+        :return: Future of the version string of the remote executor.
+        :rtype: futures.Future
+        """
+        return self.call("_rpc_get_version", "")
+
+    def call_streaming(self, procedure_name, params, **stream_options):
+        """
+        See `GRemoteProcedureStreamingClient.call_streaming`.
+
+        :rtype: AsyncGReaderWriterStream
+        """
+        return AsyncGReaderWriterStream(self.client.call_streaming(procedure_name, params, **stream_options))
+
+    def close(self):
+        self.client.close()
+
+
+class AsyncGRpcClientFactory(object):
+    """
+    Creates `AsyncGRemoteProcedureClient`s without waiting, mirrors `_GRpcClientFactory`.
+    """
+    @classmethod
+    def create_connection(cls, rpc_id, device_id, streaming=False, **client_options):
+        """
+        :param int rpc_id: RPC id of the executor's server.
+        :param str device_id: Device IP, or "localhost".
+        :param bool streaming: Whether the executor's server is a streaming server, which is needed for streaming
+            calls.
+        :param client_options: Options of `GRemoteProcedureClient`.
+        :return: Future of the connected client.
+        :rtype: futures.Future
+        """
+        return _connect_executor.submit(cls._create_connection, rpc_id, device_id, streaming, client_options)
+
+    @classmethod
+    def _create_connection(cls, rpc_id, device_id, streaming, client_options):
+        client_class = GRemoteProcedureStreamingClient if streaming else GRemoteProcedureClient
+        client, _ = _GRpcClientFactory._create_connection(device_id, rpc_id, client_class=client_class,
+                                                          **client_options)
+        return AsyncGRemoteProcedureClient(client)
@@ -1,24 +1,169 @@
 import subprocess32 as subprocess
 import grpc
+import struct
 import sys
 import os
 import time
 import re
+import weakref
+from threading import Lock, Timer
+from concurrent import futures
 
 from pydcomm.public.deviceutils.media_player_utils import DEVICE_MUSIC_PATH
 from pydcomm.public.ux_benchmarks.common_extra_stats import get_device_wifi_network_name
 from pydcomm.public.ux_benchmarks.common_extra_stats import CommonExtraStats
 from pydcomm.public.bugarpc import IRemoteProcedureClient, IRemoteProcedureStreamingClient, IRemoteProcedureClientFactory, RpcError, ReaderWriterStream
-from pydcomm.rpc.common import GReaderWriterStream
+from pydcomm.rpc.channel_health import ChannelHealthMonitor
+from pydcomm.rpc.channel_pool import GRpcChannelPool, default_channel_pool
+from pydcomm.rpc.common import (GReaderWriterStream, WatermarkQueue, CompressionPolicy, RPC_COALESCED_STREAMING_PROCEDURE,
+                                marshal_frame, iter_coalesced_frames, RPC_BATCH_PROCEDURE, marshal_batch_request, unmarshal_batch_response,
+                                RPC_CHUNKED_CALL_PROCEDURE, marshal_chunked_header, iter_chunks, reassemble_chunked_return,
+                                LOCAL_SOCKET_PATH, LOCAL_DEVICE_IDS, local_socket_address)
+from pydcomm.rpc.retry_policy import RetryPolicy, DEFAULT_RETRY_POLICY
 from pydcomm.rpc.gen.buga_rpc_pb2_grpc import DeviceRpcStub, DeviceRpcStreamingStub
 from pydcomm.rpc.gen.buga_rpc_pb2 import GRequest, GResponse
 from pydcomm.public.iconnection import CommandFailedError
 
+
+def unmarshal_batch_results(ret):
+    """
+    :param str ret: Return value of the reserved procedure "_rpc_batch".
+    :return: For each call, its return value, or the `RpcError` describing why it failed.
+    :rtype: list[str|RpcError]
+    :raises RpcError: If the response is malformed.
+    """
+    try:
+        results = unmarshal_batch_response(ret)
+    except (ValueError, struct.error) as ex:
+        raise RpcError("Bad batch response: {}".format(ex))
+    return [buf if ok else RpcError(buf) for ok, buf in results]
+
+
+class GRpcCallFuture(futures.Future):
+    """
+    Future of a single `GRemoteProcedureClient.call_async` call.
+    If the underlying gRPC call fails, it's retried over a recreated channel according to the client's retry policy,
+    just like `call` does. Backoff waits run on a timer, so no thread is blocked while waiting.
+    The result is the returned buffer, and the exception is `RpcError`.
+    """
+    def __init__(self, client, procedure_name, params, timeout=None):
+        super(GRpcCallFuture, self).__init__()
+        self._client = client
+        self._request = GRequest(name=procedure_name, buf=params)
+        self._options = client._call_options(params)
+        self._deadline = client._deadline(procedure_name, timeout)
+        self._attempt = 0
+        self._grpc_future = None
+        self._start()
+
+    def _start(self):
+        self._attempt += 1
+        stub = self._client.stub
+        self._grpc_future = stub.call.future(self._request, timeout=self._client._time_left(self._deadline),
+                                             **self._options)
+        self._grpc_future.add_done_callback(lambda f: self._on_done(f, stub))
+
+    def _on_done(self, grpc_future, stub):
+        if self.cancelled() or grpc_future.cancelled():
+            return
+        ex = grpc_future.exception()
+        if ex is None:
+            self.set_result(grpc_future.result().buf)
+            return
+        delay = self._client._retry_delay(self._request.name, ex, self._attempt, self._deadline)
+        if delay is None:
+            self.set_exception(RpcError(grpc_exception=ex))
+        elif delay > 0:
+            timer = Timer(delay, self._retry, (stub,))
+            timer.daemon = True
+            timer.start()
+        else:
+            self._retry(stub)
+
+    def _retry(self, stub):
+        if self.cancelled():
+            return
+        self._client._recreate_channel_if_current(stub)
+        self._start()
+
+    def cancel(self):
+        cancelled = super(GRpcCallFuture, self).cancel()
+        if cancelled:
+            self._grpc_future.cancel()
+        return cancelled
+
+
+def gather(call_futures, timeout=None):
+    """
+    Waits for all calls to finish and returns their results.
+
+    :param list[GRpcCallFuture] call_futures: Futures returned from `call_async`.
+    :param float|None timeout: Maximum time in seconds to wait for all calls.
+    :return: Returned buffers, in the same order as `call_futures`.
+    :rtype: list[str]
+    :raises RpcError: If a call failed or not all calls finished in time.
+    """
+    _, not_done = futures.wait(call_futures, timeout=timeout)
+    if not_done:
+        raise RpcError("{} of {} calls didn't finish in time".format(len(not_done), len(call_futures)))
+    return [f.result() for f in call_futures]
+
+
+def wait_any(call_futures, timeout=None):
+    """
+    Waits until at least one of the calls finishes.
+
+    :param list[GRpcCallFuture] call_futures: Futures returned from `call_async`.
+    :param float|None timeout: Maximum time in seconds to wait.
+    :return: Tuple of two sets: finished futures and pending futures.
+    :rtype: (set[GRpcCallFuture], set[GRpcCallFuture])
+    """
+    return futures.wait(call_futures, timeout=timeout, return_when=futures.FIRST_COMPLETED)
+
+
+def _weak_reconnect_func(client):
+    # The health monitor's thread mustn't keep the client alive, otherwise it's never closed
+    client_ref = weakref.ref(client)
+
+    def reconnect(channel):
+        client = client_ref()
+        if client is not None:
+            client._recreate_channel_if_failed(channel)
+    return reconnect
+
+
 class GRemoteProcedureClient(IRemoteProcedureClient, CommonExtraStats):
     MAX_MESSAGE_SIZE = 1024*1024*1024  # 1Gb
 
-    def __init__(self, ip_port):
+    def __init__(self, ip_port, compression=None, channel_pool=None, retry_policy=None, timeout=None,
+                 procedure_timeouts=None, keepalive_time=None, keepalive_timeout=10, monitor_health=False):
+        """
+        :param str ip_port: Address of the executor's server.
+        :param CompressionPolicy|None compression: Policy for compressing params, None to never compress.
+        :param GRpcChannelPool|None channel_pool: Pool to take the channel from, None for a private channel.
+        :param RetryPolicy|None retry_policy: Policy for retrying failed calls, None for the default policy that
+            retries once.
+        :param float|None timeout: Default deadline in seconds of a call, including its retries. None for no deadline.
+        :param dict[str, float]|None procedure_timeouts: Deadlines in seconds of specific procedures, overriding
+            `timeout`, e.g. short ones for latency sensitive calls and long ones for bulk transfers.
+        :param float|None keepalive_time: Seconds between HTTP/2 keepalive pings, also when there are no calls, so
+            idle connections aren't dropped silently by Wi-Fi and NAT. None to not ping. The server must permit pings
+            this frequent, the Python and C++ servers permit pings every `GRemoteProcedureServer.MIN_PING_INTERVAL`.
+        :param float keepalive_timeout: Seconds to wait for a keepalive ping's ack before the connection is dropped.
+        :param bool monitor_health: Whether to watch the channel's state in the background and reconnect as soon as
+            it fails, instead of in the next call. See `ChannelHealthMonitor`.
+        """
         self.host_port = ip_port
+        self.compression = compression
+        self.channel_pool = channel_pool
+        self.retry_policy = retry_policy or DEFAULT_RETRY_POLICY
+        self.timeout = timeout
+        self.procedure_timeouts = dict(procedure_timeouts or {})
+        self.keepalive_time = keepalive_time
+        self.keepalive_timeout = keepalive_timeout
+        self.health_monitor = ChannelHealthMonitor(_weak_reconnect_func(self)) if monitor_health else None
+        self.channel = None
+        self._channel_lock = Lock()
 
         self._create_grpc_channel_and_stub()
 
@@ -28,16 +173,103 @@ class GRemoteProcedureClient(IRemoteProcedureClient, CommonExtraStats):
         xver = self.get_executor_version()
 
     def _create_grpc_channel_and_stub(self):
-        # This needs to remain an instance variable (according to https://blog.jeffli.me/blog/2017/08/02/keep-python-grpc-client-connection-truly-alive/)
-        self.channel = grpc.insecure_channel(self.host_port, options=[('grpc.max_send_message_length', self.MAX_MESSAGE_SIZE),
-                                                                      ('grpc.max_receive_message_length', self.MAX_MESSAGE_SIZE)])
+        self._create_grpc_channel()
         self.stub = DeviceRpcStub(self.channel)
 
+    def _create_grpc_channel(self):
+        options = [('grpc.max_send_message_length', self.MAX_MESSAGE_SIZE),
+                   ('grpc.max_receive_message_length', self.MAX_MESSAGE_SIZE)]
+        if self.keepalive_time is not None:
+            options += [('grpc.keepalive_time_ms', int(self.keepalive_time * 1000)),
+                        ('grpc.keepalive_timeout_ms', int(self.keepalive_timeout * 1000)),
+                        ('grpc.keepalive_permit_without_calls', 1),
+                        ('grpc.http2.max_pings_without_data', 0)]
+        # This needs to remain an instance variable (according to https://blog.jeffli.me/blog/2017/08/02/keep-python-grpc-client-connection-truly-alive/)
+        if self.channel_pool is None:
+            self.channel = grpc.insecure_channel(self.host_port, options=options)
+        else:
+            if self.channel is not None:
+                # We're reconnecting, so the old channel is suspected as broken
+                self.channel_pool.invalidate(self.channel)
+            self.channel = self.channel_pool.acquire(self.host_port, options)
+        if self.health_monitor is not None:
+            self.health_monitor.watch(self.channel)
+
+    def close(self):
+        """
+        Releases the channel. The client can't be used afterwards.
+        """
+        if self.health_monitor is not None:
+            self.health_monitor.stop()
+        if self.channel is not None and self.channel_pool is not None:
+            self.channel_pool.release(self.channel)
+        self.channel = None
+
+    def __del__(self):
+        self.close()
+
+    def _call_options(self, params):
+        if self.compression is None:
+            return {}
+        return dict(compression=self.compression.choose(params))
+
+    def _recreate_channel_if_current(self, stub):
+        # Many failed async calls may get here together, only the first one should reconnect
+        with self._channel_lock:
+            if self.stub is stub:
+                self._create_grpc_channel_and_stub()
+
+    def _recreate_channel_if_failed(self, channel):
+        with self._channel_lock:
+            if self.channel is channel:
+                self._create_grpc_channel_and_stub()
+
+    def _deadline(self, procedure_name, timeout):
+        if timeout is None:
+            timeout = self.procedure_timeouts.get(procedure_name, self.timeout)
+        return None if timeout is None else time.time() + timeout
+
+    @staticmethod
+    def _time_left(deadline):
+        return None if deadline is None else max(deadline - time.time(), 0)
+
+    def _retry_delay(self, procedure_name, ex, attempt, deadline):
+        """
+        :return: Seconds to wait before retrying the failed attempt, or None if it shouldn't be retried.
+        :rtype: float|None
+        """
+        code = ex.code() if isinstance(ex, grpc.Call) else None
+        if not self.retry_policy.should_retry(procedure_name, code, attempt):
+            return None
+        delay = self.retry_policy.backoff(attempt)
+        if deadline is not None and time.time() + delay >= deadline:
+            return None
+        return delay
+
+    def _call_with_retries(self, procedure_name, timeout, attempt_func):
+        """
+        Runs `attempt_func(stub, time_left)` until it doesn't raise `grpc.RpcError` or the retry policy gives up,
+        recreating the channel between attempts.
+        """
+        deadline = self._deadline(procedure_name, timeout)
+        attempt = 0
+        while True:
+            attempt += 1
+            stub = self.stub
+            try:
+                return attempt_func(stub, self._time_left(deadline))
+            except grpc.RpcError as ex:
+                delay = self._retry_delay(procedure_name, ex, attempt, deadline)
+                if delay is None:
+                    raise RpcError(grpc_exception=ex)
+                time.sleep(delay)
+                self._recreate_channel_if_current(stub)
+
     def __extra_stats__(self):
         common = super(GRemoteProcedureClient, self).__extra_stats__()
         device_id = None
         try:
-            device_id = self.host_port.split(":")[0]
+            device_id = "localhost" if self.host_port.startswith("unix:") else self.host_port.split(":")[0]
         except Exception:
             pass
         if time.time() - self.latest_device_wifi_update > 60:  # update every minute
@@ -51,6 +283,8 @@ class GRemoteProcedureClient(IRemoteProcedureClient, CommonExtraStats):
             "device_id": device_id,
             "device_wifi": self.latest_device_wifi,
         })
+        if self.health_monitor is not None:
+            common.update(self.health_monitor.stats())
         return common
 
     def stop(self):
@@ -59,37 +293,83 @@ class GRemoteProcedureClient(IRemoteProcedureClient, CommonExtraStats):
     def get_version(self):
         return '1.0'
 
-    def call(self, procedure_name, params):
-        for do_retry in (True, False):
-            try:
-                response = self.stub.call(GRequest(name=procedure_name, buf=params))
-                return response.buf
-            except grpc.RpcError as ex:
-                if do_retry:
-                    self._create_grpc_channel_and_stub()
-                else:
-                    raise RpcError(grpc_exception=ex)
+    def call(self, procedure_name, params, timeout=None):
+        """
+        See `IRemoteProcedureClient.call`.
+
+        :param float|None timeout: Deadline in seconds of the call, including its retries.
+            None for the client's deadline of this procedure.
+        """
+        request = GRequest(name=procedure_name, buf=params)
+        options = self._call_options(params)
+        return self._call_with_retries(procedure_name, timeout,
+                                       lambda stub, time_left: stub.call(request, timeout=time_left, **options).buf)
+
+    def call_async(self, procedure_name, params, timeout=None):
+        """
+        Calls procedure on device with the params without waiting for it to return.
+        Several calls can be in flight at once on the same channel, use `gather` or `wait_any` to wait for them.
+
+        :param str procedure_name: Name of procedure that device side handles.
+        :param str params: String, equivalently bytes, to send.
+        :param float|None timeout: Deadline in seconds of the call, including its retries.
+            None for the client's deadline of this procedure.
+        :return: Future whose result is the string sent from device.
+        :rtype: GRpcCallFuture
+        """
+        return GRpcCallFuture(self, procedure_name, params, timeout=timeout)
+
+    def call_batch(self, calls):
+        """
+        Calls many procedures on device in a single round trip, see `IRemoteProcedureClient.call_batch`.
+        The executor's server must support the reserved procedure "_rpc_batch".
+        """
+        if not calls:
+            return []
+        return unmarshal_batch_results(self.call(RPC_BATCH_PROCEDURE, marshal_batch_request(calls)))
 
 
 class GRemoteProcedureStreamingClient(IRemoteProcedureStreamingClient, GRemoteProcedureClient):
+    DEFAULT_CHUNK_SIZE = 1024*1024  # 1Mb
+    DEFAULT_WRITE_HIGH_WATERMARK = 16*1024*1024  # 16Mb
+
+    def __init__(self, ip_port, chunk_threshold=None, chunk_size=DEFAULT_CHUNK_SIZE, **client_options):
+        """
+        :param str ip_port: Address of the executor's server.
+        :param int|None chunk_threshold: Calls with params larger than this many bytes are sent with `call_chunked`.
+            None to never do it implicitly. Only the params size is known before calling, so calls with small params
+            and a large return value aren't chunked implicitly, call `call_chunked` for them.
+        :param int chunk_size: Chunk size in bytes of chunked calls, both for params and for return values.
+        :param client_options: Other options of `GRemoteProcedureClient`, e.g. compression and retry_policy.
+        """
+        self.chunk_threshold = chunk_threshold
+        self.chunk_size = chunk_size
+        super(GRemoteProcedureStreamingClient, self).__init__(ip_port, **client_options)
+
     def _create_grpc_channel_and_stub(self):
-        # This needs to remain an instance variable (according to https://blog.jeffli.me/blog/2017/08/02/keep-python-grpc-client-connection-truly-alive/)
-        self.channel = grpc.insecure_channel(self.host_port, options=[('grpc.max_send_message_length', self.MAX_MESSAGE_SIZE),
-                                                                      ('grpc.max_receive_message_length', self.MAX_MESSAGE_SIZE)])
+        self._create_grpc_channel()
         self.stub = DeviceRpcStreamingStub(self.channel)
 
-    def call_streaming(self, procedure_name, params):
+    def call_streaming(self, procedure_name, params, write_high_watermark=DEFAULT_WRITE_HIGH_WATERMARK,
+                       write_low_watermark=None, coalesce_size=None, coalesce_delay=0.005, read_ahead=0):
         """
         Calls a streaming procedure with the params, and returns an iterator of streamed resuls.
 
         :param str procedure_name: Name of procedure that device side handles.
         :param str params: String to send.
+        :param int write_high_watermark: Bytes written and not yet sent at which writes start blocking.
+        :param int|None write_low_watermark: Bytes written and not yet sent at which blocked writes resume,
+            None for half of `write_high_watermark`.
+        :param int|None coalesce_size: Merge writes into messages of up to about this many bytes, to save per-message
+            overhead when writing many small values. None to send each write in its own message.
+            The executor's server must support the reserved streaming procedure "_rpc_coalesced_streaming".
+        :param float coalesce_delay: Maximum seconds a write waits for more writes to merge with.
+        :param int read_ahead: Number of results to receive ahead in the background while the current one is
+            processed, 0 to receive only when reading.
         :return: Iterator of streamed results from device.
         :rtype: ReaderWriterStream
         """
-        from Queue import Queue
-        from threading import Event
-        queue = Queue()
+        queue = WatermarkQueue(write_high_watermark, write_low_watermark)
         end_write_sential = object()
 
         def read_from_queue():
@@ -103,9 +383,53 @@ class GRemoteProcedureStreamingClient(IRemoteProcedureStreamingClient, GRemotePr
                 else:
                     yield GResponse(buf=value)
 
-        res = self.stub.call_streaming(read_from_queue())
+        def read_coalesced_from_queue():
+            yield GResponse(buf=RPC_COALESCED_STREAMING_PROCEDURE)
+            yield GResponse(buf=marshal_frame([procedure_name, params]))
+            for frame in iter_coalesced_frames(queue, end_write_sential, coalesce_size, coalesce_delay):
+                yield GResponse(buf=frame)
+
+        res = self.stub.call_streaming(read_from_queue() if coalesce_size is None else read_coalesced_from_queue())
+
+        return GReaderWriterStream(res, queue, end_write_sential, read_ahead=read_ahead)
+
+    def call(self, procedure_name, params, timeout=None):
+        if self.chunk_threshold is not None and len(params) > self.chunk_threshold:
+            return self.call_chunked(procedure_name, params, timeout=timeout)
+        return super(GRemoteProcedureStreamingClient, self).call(procedure_name, params, timeout=timeout)
+
+    def call_chunked(self, procedure_name, params, timeout=None):
+        """
+        Calls procedure on device with the params, sending params and return value in chunks over a streaming call.
+        Use for large payloads: chunks are serialized while previous ones are sent, and the return value is written
+        into a buffer that is allocated once.
+        The executor's server must be a streaming server that supports the reserved procedure "_rpc_chunked_call".
+
+        :param str procedure_name: Name of procedure that device side handles.
+        :param str|bytearray params: String, equivalently bytes, to send.
+        :param float|None timeout: Deadline in seconds of the call, including its retries.
+            None for the client's deadline of this procedure.
+        :return: Bytes sent from device.
+        :rtype: bytearray
+        """
+        header = marshal_chunked_header(procedure_name, len(params), self.chunk_size)
 
-        return GReaderWriterStream(res, queue, end_write_sential)
+        def requests():
+            yield GResponse(buf=RPC_CHUNKED_CALL_PROCEDURE)
+            yield GResponse(buf=header)
+            for chunk in iter_chunks(params, self.chunk_size):
+                yield GResponse(buf=chunk)
+
+        options = self._call_options(params)
+
+        def attempt(stub, time_left):
+            responses = stub.call_streaming(requests(), timeout=time_left, **options)
+            return reassemble_chunked_return(response.buf for response in responses)
+
+        try:
+            return self._call_with_retries(procedure_name, timeout, attempt)
+        except (ValueError, StopIteration) as ex:
+            raise RpcError("Bad chunked response: {}".format(ex))
 
 # region Client factories common stuff
 
@@ -113,14 +437,26 @@ class GRemoteProcedureStreamingClient(IRemoteProcedureStreamingClient, GRemotePr
 # noinspection PyAbstractClass
 class _GRpcClientFactory(IRemoteProcedureClientFactory, CommonExtraStats):
     @classmethod
-    def create_connection(cls, rpc_id, device_id=None):
-        return cls._create_connection(device_id, rpc_id)[0]
+    def create_connection(cls, rpc_id, device_id=None, **client_options):
+        """
+        See `IRemoteProcedureClientFactory.create_connection`.
+
+        :param client_options: Options of `GRemoteProcedureClient`, e.g. compression, retry_policy and timeout.
+        """
+        return cls._create_connection(device_id, rpc_id, **client_options)[0]
 
     @classmethod
-    def _create_connection(cls, device_id, rpc_id):
+    def _create_connection(cls, device_id, rpc_id, client_class=None, **client_options):
+        client_class = client_class or GRemoteProcedureClient
         device_id = cls._choose_device_id_if_none(device_id)
+        client_options.setdefault("channel_pool", default_channel_pool)
+        if device_id in LOCAL_DEVICE_IDS and os.path.exists(LOCAL_SOCKET_PATH.format(rpc_id)):
+            try:
+                return client_class(local_socket_address(rpc_id), **client_options), device_id
+            except RpcError:
+                pass  # Left by a server that's gone, the TCP port may still belong to a live one
         ip_port = "{}:{}".format(device_id, rpc_id)
-        return GRemoteProcedureClient(ip_port), device_id
+        return client_class(ip_port, **client_options), device_id
 
     @classmethod
     def _choose_device_id_if_none(cls, device_id):
@@ -451,13 +787,13 @@ class GRpcLibbugatoneAndroidClientFactory(_GRpcClientFactory):
             print("")
 
     @classmethod
-    def create_connection(cls, rpc_id, device_id=None):
+    def create_connection(cls, rpc_id, device_id=None, **client_options):
         # Make sure a headset is connected so Bugatone would work
         cls._ensure_headset_connected(device_id)
 
         for recover_with_silence in (True, False):
             try:
-                client, device_id = cls._create_connection(device_id, rpc_id)
+                client, device_id = cls._create_connection(device_id, rpc_id, **client_options)
                 break
             except RpcError as ex:
                 if not recover_with_silence:
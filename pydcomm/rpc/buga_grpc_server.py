@@ -1,11 +1,19 @@
+import time
+
 import grpc
 from concurrent import futures
+from threading import Lock
 from pydcomm.rpc.gen.buga_rpc_pb2_grpc import (DeviceRpcStub, DeviceRpcServicer, add_DeviceRpcServicer_to_server, 
                                                DeviceRpcStreamingStub, DeviceRpcStreamingServicer, 
                                                add_DeviceRpcStreamingServicer_to_server)
 from pydcomm.rpc.gen.buga_rpc_pb2 import GRequest, GResponse
 from pydcomm.rpc.buga_grpc_client import GRemoteProcedureClient, ReaderWriterStream
-from pydcomm.rpc.common import GReaderWriterStream
+from pydcomm.rpc.common import (GReaderWriterStream, CompressionPolicy, RPC_BATCH_PROCEDURE, unmarshal_batch_request,
+                                marshal_batch_response, RPC_CHUNKED_CALL_PROCEDURE, unmarshal_chunked_header,
+                                reassemble_chunks, iter_chunked_return, local_socket_address,
+                                RPC_COALESCED_STREAMING_PROCEDURE, unmarshal_frame, iter_split_frames)
+from pydcomm.rpc.process_pool import ProcessPoolDispatcher, get_cpu_bound_procedures
+from pydcomm.rpc.admission import AdmissionControl, ResourceExhaustedError
 
 from pybuga.infra.utils.thread_utils import apply_async
 
@@ -31,6 +39,26 @@ class RemoteProcedureExecutor(object):
         """
         raise NotImplementedError
 
+class RemoteProcedureAsyncExecutor(RemoteProcedureExecutor):
+    """
+    An executor that doesn't block on calls, but returns a future of the return value, which can be set later from
+    any thread, e.g. by a callback.
+
+    The python gRPC servers still block a handler thread on each pending call until its future is done, so executors
+    with many pending calls need a server with as many threads, see `GRemoteProcedureLargePoolServer`.
+    """
+    def execute_procedure_async(self, procedure_name, params):
+        """
+        @param str procedure_name: Name of procedure called, not beginning with "_rpc_".
+        @param str params: The Buffer sent from python.
+        @return: Future of the buffer representing the return value to be sent back to python.
+        @rtype: futures.Future
+        """
+        raise NotImplementedError
+
+    def execute_procedure(self, procedure_name, params):
+        return self.execute_procedure_async(procedure_name, params).result()
+
 class RemoteProcedureStreamingExecutor(RemoteProcedureExecutor):
     """
     This method will be called by the RemoteProcedureStreamingServer.
@@ -49,6 +77,14 @@ class RemoteProcedureServer(object):
         1. If python calls the procedure "_rpc_get_version", server must call `getVersion` on the executor
             instance and return the result.
         2. If python calls the procedure "_rpc_stop", server must call its `stop` method.
+        3. If python calls the procedure "_rpc_batch", server must execute each call in the batch in order, and return
+            all results in one response (see `pydcomm.rpc.common.marshal_batch_request`).
+        4. Streaming servers: if python calls the streaming procedure "_rpc_chunked_call", server must reassemble the
+            chunked params, call the procedure and stream the return value back in chunks
+            (see `pydcomm.rpc.common.marshal_chunked_header`).
+        5. Streaming servers: if python calls the streaming procedure "_rpc_coalesced_streaming", server must call the
+            streaming procedure in its params, splitting each received frame back into the values written by python
+            (see `pydcomm.rpc.common.iter_coalesced_frames`).
     """
     def listen(self, executor, rpc_id, wait):
         """
@@ -61,10 +97,14 @@ class RemoteProcedureServer(object):
         """
         raise NotImplementedError
         
-    def wait(self):
+    def wait(self, timeout=None):
         """
         Block waiting in a server loop. This should be used if listen() was called with wait==false.
         Could be from a different thread than listen().
+
+        @param float timeout: Seconds to wait, None to wait until the server stops.
+        @return: Whether the server stopped.
+        @rtype: bool
         """
         raise NotImplementedError
         
@@ -85,27 +125,83 @@ class RemoteProcedureStreamingServer(object):
 
 class BugaGRpcServiceImpl(DeviceRpcServicer):
     """A python version of the C++ class of the same name"""
-    def __init__(self, executor, stop_func):
+    def __init__(self, executor, stop_func, compression=None, process_pool=None, admission_control=None):
         self.executor = executor
         self.stop_func = stop_func
+        self.compression = compression  # type: CompressionPolicy or None
+        self.process_pool = process_pool  # type: ProcessPoolDispatcher or None
+        self.cpu_bound_procedures = get_cpu_bound_procedures(executor)
+        self.admission_control = admission_control or AdmissionControl()
+        # Looked up once per call instead of comparing against each reserved name
+        self._reserved_procedures = {"_rpc_get_version": self._get_version,
+                                     "_rpc_device_time_usec": self._device_time_usec,
+                                     "_rpc_stop": self._stop,
+                                     RPC_BATCH_PROCEDURE: self._call_batch}
+        # Calls in a batch may be any procedure but another batch
+        self._batched_reserved_procedures = dict(self._reserved_procedures)
+        self._batched_reserved_procedures[RPC_BATCH_PROCEDURE] = self._reject_nested_batch
         
     def call(self, request, context):
         procedure_name = request.name
         params = request.buf
         
-        if procedure_name == "_rpc_get_version":
-            ret = self.executor.get_version()
-        elif procedure_name == "_rpc_device_time_usec":
-            import time
-            ret = str(time.time() * 1000)
-        elif procedure_name == "_rpc_stop":
-            self.stop_func()
-            ret = ""
-        else:
-            ret = self.executor.execute_procedure(procedure_name, params)
+        try:
+            ret = self._call_procedure(procedure_name, params)
+        except ResourceExhaustedError as ex:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(ex))
         
+        self._set_compression(context, ret)
         return GResponse(buf=ret)
     
+    def _set_compression(self, context, ret):
+        if self.compression is not None:
+            context.set_compression(self.compression.choose(ret))
+    
+    def _call_procedure(self, procedure_name, params, reserved_procedures=None):
+        reserved_procedure = (reserved_procedures or self._reserved_procedures).get(procedure_name)
+        if reserved_procedure is not None:
+            return reserved_procedure(params)  # Control procedures are never limited, batched calls are one by one
+        
+        with self.admission_control.admit(procedure_name):
+            return self._execute_procedure(procedure_name, params)
+    
+    def _execute_procedure(self, procedure_name, params):
+        cpu_bound_procedure = self.cpu_bound_procedures.get(procedure_name)
+        if cpu_bound_procedure is None:
+            return self.executor.execute_procedure(procedure_name, params)
+        elif self.process_pool is not None:
+            return self.process_pool.call(procedure_name, params)
+        else:
+            return cpu_bound_procedure(params)
+    
+    def _get_version(self, params):
+        return self.executor.get_version()
+    
+    @staticmethod
+    def _device_time_usec(params):
+        return str(time.time() * 1000)
+    
+    def _stop(self, params):
+        self.stop_func()
+        return ""
+    
+    def _call_batch(self, params):
+        results = []
+        for procedure_name, call_params in unmarshal_batch_request(params):
+            try:
+                ret = self._call_procedure(procedure_name, call_params, self._batched_reserved_procedures)
+                if not isinstance(ret, (str, bytearray)):
+                    raise TypeError("Procedure {} returned {}, not a buffer".format(procedure_name,
+                                                                                    type(ret).__name__))
+                results.append((True, str(ret)))
+            except Exception as ex:
+                results.append((False, "{}: {}".format(type(ex).__name__, ex)))
+        return marshal_batch_response(results)
+    
+    @staticmethod
+    def _reject_nested_batch(params):
+        raise ValueError("Nested batches are not supported")
+    
     def grpc_echo(self, request, context):
         return GResponse(buf="hmm?")
 
@@ -119,43 +215,112 @@ class BugaGRpcStreamingServiceImpl(BugaGRpcServiceImpl, DeviceRpcStreamingServic
 
         bufs = imap(lambda _: _.buf, request_iterator)
 
-        for value in self.executor.execute_streaming_procedure(procedure_name, params, bufs):
-            yield GResponse(buf=value)
+        try:
+            if procedure_name == RPC_CHUNKED_CALL_PROCEDURE:
+                values = self._call_chunked(params, bufs, context)
+            elif procedure_name == RPC_COALESCED_STREAMING_PROCEDURE:
+                procedure_name, params = unmarshal_frame(params)
+                values = self._call_streaming_procedure(procedure_name, params, iter_split_frames(bufs))
+            else:
+                values = self._call_streaming_procedure(procedure_name, params, bufs)
+
+            for value in values:
+                yield GResponse(buf=value)
+        except ResourceExhaustedError as ex:
+            context.abort(grpc.StatusCode.RESOURCE_EXHAUSTED, str(ex))
+
+    def _call_streaming_procedure(self, procedure_name, params, bufs):
+        # Holds the procedure's admission until the stream ends
+        with self.admission_control.admit(procedure_name):
+            for value in self.executor.execute_streaming_procedure(procedure_name, params, bufs):
+                yield value
+
+    def _call_chunked(self, header, bufs, context):
+        procedure_name, total_size, chunk_size = unmarshal_chunked_header(header)
+        if total_size > GRemoteProcedureServer.MAX_MESSAGE_SIZE:
+            # Checked before allocating the params buffer, like the C++ server
+            context.abort(grpc.StatusCode.INVALID_ARGUMENT,
+                          "Chunked params size {} exceeds the max message size {}".format(
+                              total_size, GRemoteProcedureServer.MAX_MESSAGE_SIZE))
+        params = reassemble_chunks(total_size, bufs)
+        ret = self._call_procedure(procedure_name, str(params))
+        del params  # Don't hold both copies of the params while streaming the return value
+        self._set_compression(context, ret)
+        return iter_chunked_return(ret, chunk_size)
 
     
 class GRemoteProcedureServer(RemoteProcedureServer):
     MAX_MESSAGE_SIZE = 1024*1024*1024  # 1Gb
+    MIN_PING_INTERVAL = 10  # Seconds between client keepalive pings the server accepts
 
     """
     A remote procedure server implementation that uses gRPC
     
     This is a python version of the C++ class of the same name.
     """
-    def __init__(self, max_workers=10, wait_sleep=0):
+    def __init__(self, max_workers=10, wait_sleep=0, compression=None, local_socket=True, on_stop=None,
+                 cpu_processes=None, admission_control=None):
+        """
+        @param int max_workers: Maximum number of calls handled concurrently.
+        @param float wait_sleep: Unused, `wait` blocks without polling. Kept for compatibility.
+        @param CompressionPolicy compression: Policy for compressing return values, None to never compress.
+        @param bool local_socket: Whether to also listen on a Unix domain socket, see `local_socket_address`.
+        @param () -> None on_stop: Called once when the server stops, either by `stop` or by the "_rpc_stop" procedure.
+        @param int cpu_processes: Number of worker processes for the executor's procedures marked with
+            `pydcomm.rpc.process_pool.cpu_bound`, None to run them on the server's threads.
+        @param AdmissionControl admission_control: Per procedure concurrency limits, None for no limits. Its
+            `max_active` should be below `max_workers`, to keep threads free for control procedures.
+        """
         self.max_workers = max_workers
         self.wait_sleep = wait_sleep
+        self.compression = compression
+        self.local_socket = local_socket
+        self.on_stop = on_stop
+        self.cpu_processes = cpu_processes
+        self.admission_control = admission_control
         self.server = None
+        self.process_pool = None
+        self._stop_lock = Lock()
+        self._stop_called = False
 
     def _add_servicer_to_server(self, server, executor):
-        add_DeviceRpcServicer_to_server(BugaGRpcServiceImpl(executor, self.stop), server)
+        add_DeviceRpcServicer_to_server(BugaGRpcServiceImpl(executor, self.stop, self.compression, self.process_pool,
+                                                            self.admission_control), server)
+
+    def _create_server(self, **server_kwargs):
+        return grpc.server(futures.ThreadPoolExecutor(max_workers=self.max_workers),
+                           options=[('grpc.max_send_message_length', self.MAX_MESSAGE_SIZE),
+                                    ('grpc.max_receive_message_length', self.MAX_MESSAGE_SIZE),
+                                    ('grpc.keepalive_permit_without_calls', 1),
+                                    ('grpc.http2.min_ping_interval_without_data_ms', self.MIN_PING_INTERVAL * 1000)],
+                           **server_kwargs)
         
     def listen(self, executor, rpc_id, wait):
-        self.server = server = grpc.server(futures.ThreadPoolExecutor(max_workers=self.max_workers),
-                                           options=[('grpc.max_send_message_length', self.MAX_MESSAGE_SIZE),
-                                                    ('grpc.max_receive_message_length', self.MAX_MESSAGE_SIZE)])
+        if self.cpu_processes:
+            # Forks the workers, so before gRPC starts its threads
+            self.process_pool = ProcessPoolDispatcher(executor, self.cpu_processes)
+        self.server = server = self._create_server()
         self._add_servicer_to_server(server, executor)
         ret = server.add_insecure_port('[::]:{}'.format(rpc_id))
         if ret == 0:
             raise RuntimeError("Cannot bind to port {}".format(rpc_id))
+        if self.local_socket and server.add_insecure_port(local_socket_address(rpc_id)) == 0:
+            # Not fatal, local clients fall back to the TCP port
+            print("Cannot bind to {}".format(local_socket_address(rpc_id)))
         server.start()
         if wait:
             self.wait()
     
-    def wait(self):
-        import time
-        stage = self.server._state.stage
-        while stage != stage.STOPPED:
-            time.sleep(self.wait_sleep)
+    def wait(self, timeout=None):
+        """
+        Block until the server stops.
+
+        @param float timeout: Seconds to wait, None to wait until it stops.
+        @return: Whether the server stopped.
+        @rtype: bool
+        """
+        assert self.server, "No server set"
+        return not self.server.wait_for_termination(timeout)
             
     def stop(self, timeout=None):
         """
@@ -165,13 +330,47 @@ class GRemoteProcedureServer(RemoteProcedureServer):
         @rtype: bool
         """
         assert self.server, "No server set"
-        return self.server.stop(0).wait(timeout)
+        stopped = self.server.stop(0).wait(timeout)
+        if self.process_pool is not None:
+            self.process_pool.shutdown()
+        with self._stop_lock:
+            call_on_stop = self.on_stop is not None and not self._stop_called
+            self._stop_called = True
+        if call_on_stop:
+            self.on_stop()
+        return stopped
     
 class GRemoteProcedureStreamingServer(RemoteProcedureStreamingServer, GRemoteProcedureServer):
     listen_streaming = GRemoteProcedureServer.listen
     
     def _add_servicer_to_server(self, server, executor):
-        add_DeviceRpcStreamingServicer_to_server(BugaGRpcStreamingServiceImpl(executor, self.stop), server)
+        add_DeviceRpcStreamingServicer_to_server(BugaGRpcStreamingServiceImpl(executor, self.stop, self.compression,
+                                                                              self.process_pool,
+                                                                              self.admission_control), server)
+
+class GRemoteProcedureLargePoolServer(GRemoteProcedureServer):
+    """
+    A gRPC server with a large handler thread pool, for executors with many pending calls, e.g.
+    `RemoteProcedureAsyncExecutor`s.
+
+    This is not an asynchronous server: the python 2 gRPC server only replies to a call once its handler returns, so
+    each pending call blocks a handler thread, and costs its stack memory. Unlike `GRemoteProcedureServer`, whose few
+    workers deadlock once they all wait for calls that are answered later, threads are added as calls come in, up to
+    `max_pending_calls`, and idle ones are reused. Calls beyond it fail right away with RESOURCE_EXHAUSTED instead of
+    waiting for a thread.
+    """
+    MAX_PENDING_CALLS = 4096
+
+    def __init__(self, max_pending_calls=MAX_PENDING_CALLS, **server_options):
+        """
+        @param int max_pending_calls: Maximum number of calls handled concurrently.
+        @param server_options: Options of `GRemoteProcedureServer`.
+        """
+        super(GRemoteProcedureLargePoolServer, self).__init__(max_workers=max_pending_calls, **server_options)
+
+    def _create_server(self, **server_kwargs):
+        server_kwargs.setdefault("maximum_concurrent_rpcs", self.max_workers)
+        return super(GRemoteProcedureLargePoolServer, self)._create_server(**server_kwargs)
 
 class BugaEchoExecutor(RemoteProcedureExecutor):
     """A simple echo executor"""
@@ -194,8 +393,8 @@ class Call(object):
     Object representing a call to an executor
     Use `return_` to set the return value, after which the rpc call returns to its caller.
     """
-    def __init__(self, ret_event, index, procedure_name, params):
-        self._ret_event = ret_event  # type: threading.Event
+    def __init__(self, future, index, procedure_name, params):
+        self.future = future  # type: futures.Future
         self.index = index  # type: int
         self.procedure_name = procedure_name  # type: str
         self.params = params  # type: str
@@ -204,10 +403,10 @@ class Call(object):
         
     def return_(self, value):
         """Set the return value of this call"""
-        assert not self._ret_event.is_set(), "Call already returned"
+        assert not self.future.done(), "Call already returned"
         self.return_value = value
         self.returned = True
-        self._ret_event.set()
+        self.future.set_result(value)
         
     def __str__(self):
         if self.returned:
@@ -223,7 +422,7 @@ params={!r}{}""".format(self.index, self.returned, self.procedure_name, self.par
     def __repr__(self):
         return "Call(index={}, returned={}, procedure_name={})".format(self.index, self.returned, self.procedure_name)
     
-class AsyncExecutor(RemoteProcedureExecutor):
+class AsyncExecutor(RemoteProcedureAsyncExecutor):
     """
     An asynchronous executor that lets users take their time to reply to calls
     
@@ -245,29 +444,27 @@ class AsyncExecutor(RemoteProcedureExecutor):
         self.logged_calls = []
         self.verbose = verbose
         
-    def execute_procedure(self, procedure_name, params):
-        from threading import Event
-        
-        ret_event = Event()
+    def execute_procedure_async(self, procedure_name, params):
+        future = futures.Future()
         
         with self.lock:
             index = self.index
             self.index += 1
-            self.waiting_calls[index] = call = Call(ret_event, index, procedure_name, params)
+            self.waiting_calls[index] = call = Call(future, index, procedure_name, params)
             
         if self.verbose:
             print "[AsyncExecutor] incoming {!r}".format(call)
             
-        ret_event.wait()
-        
+        future.add_done_callback(lambda _: self._log_call(call))
+        return future
+    
+    def _log_call(self, call):
         with self.lock:
-            del self.waiting_calls[index]
+            del self.waiting_calls[call.index]
             self.logged_calls.append(call)
             
         if self.verbose:
-            print "[AsyncExecutor] returning on call: {}".format(index)
-        
-        return call.return_value
+            print "[AsyncExecutor] returning on call: {}".format(call.index)
     
     def get(self):
         """Get the top most waiting call. Throws `StopIteration` if the waiting list is empty."""
@@ -278,6 +475,13 @@ class AsyncExecutor(RemoteProcedureExecutor):
     def empty(self):
         """Check if there's a call waiting."""
         return len(self.waiting_calls) == 0
+    
+    def cancel_waiting(self):
+        """Cancel all waiting calls, so they don't hold the server's threads, e.g. when it stops."""
+        with self.lock:
+            calls = list(self.waiting_calls.values())
+        for call in calls:
+            call.future.cancel()
         
     def get_version(self):
         return "1.0"
@@ -286,7 +490,8 @@ class AsyncServerAndExecutor(object):
     def __init__(self, port, server=None, verbose=True):
         """
         Conveniance object putting server and executor in one object
-        If server is None, uses GRemoteProcedureServer (gRPC).
+        If server is None, uses GRemoteProcedureServer (gRPC). To have more waiting calls than its workers, pass
+        a GRemoteProcedureLargePoolServer.
         
         @param int port: Port to listen on.
         @param RemoteProcedureServer server: Server instance for running the executor. Must not have started yet.
@@ -307,8 +512,10 @@ class AsyncServerAndExecutor(object):
         return self
     
     def stop(self, timeout=None):
-        """Stop server with timeout. Returns if server definitely stopped."""
-        return self.server.stop(timeout)
+        """Stop server with timeout, and cancel the calls still waiting. Returns if server definitely stopped."""
+        stopped = self.server.stop(timeout)
+        self.async_executor.cancel_waiting()
+        return stopped
         
     def __exit__(self, *args):
         self.stop(10)
@@ -0,0 +1,122 @@
+import time
+from collections import deque, Counter
+from functools import partial
+from threading import Lock, Thread, Event
+from Queue import Queue
+
+import grpc
+
+
+class ChannelHealthMonitor(object):
+    """
+    Watches the connectivity state of a client's channel in the background.
+
+    Whenever the channel becomes idle, e.g. after the server dropped the connection, the monitor makes it connect
+    again, so the next call doesn't pay for the connection. When the channel fails, `reconnect_func` is called from
+    the monitor's thread to replace it, at most once every `min_reconnect_interval` seconds, so a device that went
+    away doesn't cause a reconnect storm.
+
+    State transitions are kept as metrics, see `stats`.
+    """
+    def __init__(self, reconnect_func, min_reconnect_interval=5., history_size=100):
+        """
+        :param (grpc.Channel) -> None reconnect_func: Replaces the given failed channel, if it's still in use.
+        :param float min_reconnect_interval: Minimum seconds between reconnects.
+        :param int history_size: Number of state transitions to keep.
+        """
+        self.reconnect_func = reconnect_func
+        self.min_reconnect_interval = min_reconnect_interval
+        self.state = None
+        self.transitions = deque(maxlen=history_size)  # type: deque[(float, grpc.ChannelConnectivity)]
+        self.state_counts = Counter()
+        self.reconnects = 0
+        self._lock = Lock()
+        self._channel = None
+        self._callback = None
+        self._last_reconnect = 0
+        self._events = Queue()
+        self._stopped = Event()
+        self._thread = Thread(target=self._run, name="ChannelHealthMonitor")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def watch(self, channel):
+        """
+        Starts watching a channel instead of the previously watched one.
+
+        :param grpc.Channel channel: Channel to watch.
+        """
+        callback = partial(self._on_state_change, channel)
+        with self._lock:
+            old_channel, old_callback = self._channel, self._callback
+            self._channel, self._callback = channel, callback
+        if old_channel is not None:
+            old_channel.unsubscribe(old_callback)
+        channel.subscribe(callback, try_to_connect=True)
+
+    def stop(self):
+        """Stops watching, the monitor can't be used afterwards."""
+        with self._lock:
+            channel, callback = self._channel, self._callback
+            self._channel = self._callback = None
+        if channel is not None:
+            channel.unsubscribe(callback)
+        self._stopped.set()
+        self._events.put(None)
+
+    def stats(self):
+        """
+        :return: Current state, number of times each state was entered, and number of reconnects.
+        :rtype: dict
+        """
+        with self._lock:
+            stats = {"channel_state": self.state.name if self.state is not None else None,
+                     "channel_reconnects": self.reconnects}
+            stats.update(("channel_{}_count".format(state.name.lower()), count)
+                         for state, count in self.state_counts.items())
+            return stats
+
+    def _on_state_change(self, channel, state):
+        # Runs in gRPC's connectivity thread, which mustn't block
+        with self._lock:
+            if channel is not self._channel:
+                return
+            if state == self.state:
+                return
+            self.state = state
+            self.state_counts[state] += 1
+            self.transitions.append((time.time(), state))
+        if state in (grpc.ChannelConnectivity.IDLE, grpc.ChannelConnectivity.TRANSIENT_FAILURE):
+            self._events.put((channel, state))
+
+    def _run(self):
+        while True:
+            event = self._events.get()
+            if event is None:
+                return
+            channel, state = event
+            if state == grpc.ChannelConnectivity.IDLE:
+                self._connect(channel)
+            else:
+                self._reconnect(channel)
+
+    def _connect(self, channel):
+        with self._lock:
+            if channel is not self._channel or self.state != grpc.ChannelConnectivity.IDLE:
+                return
+            callback = self._callback
+        # Subscribing again is the public way to make an idle channel connect
+        channel.unsubscribe(callback)
+        channel.subscribe(callback, try_to_connect=True)
+
+    def _reconnect(self, channel):
+        self._stopped.wait(self._last_reconnect + self.min_reconnect_interval - time.time())
+        with self._lock:
+            # The channel may have recovered or been replaced while waiting
+            still_failed = (channel is self._channel and self.state == grpc.ChannelConnectivity.TRANSIENT_FAILURE
+                            and not self._stopped.is_set())
+            if still_failed:
+                self.reconnects += 1
+        if still_failed:
+            self._last_reconnect = time.time()
+            self.reconnect_func(channel)
@@ -0,0 +1,127 @@
+import time
+from threading import Lock
+
+import grpc
+
+
+class _PooledChannel(object):
+    def __init__(self, key, channel):
+        self.key = key
+        self.channel = channel
+        self.refs = 0
+        self.idle_since = time.time()
+        self.stale = False
+
+
+class GRpcChannelPool(object):
+    """
+    Pool of gRPC channels shared by all clients connecting to the same address with the same options, so that
+    creating a connection doesn't pay for a new TCP/HTTP2 handshake.
+
+    Channels are reference counted: `acquire` a channel, and `release` it when done. Channels nobody uses are closed
+    after `idle_timeout` seconds. A channel that failed can be `invalidate`d, so following acquires create a new one.
+
+    With `stripes` > 1, up to that many channels are opened per address, each over its own TCP connection, and
+    acquires get the least used one, so concurrent clients don't block each other on a single HTTP/2 connection.
+    """
+    def __init__(self, idle_timeout=60, stripes=1):
+        """
+        :param float idle_timeout: Seconds to keep an unused channel open.
+        :param int stripes: Maximum number of channels per address.
+        """
+        self.idle_timeout = idle_timeout
+        self.stripes = stripes
+        self._lock = Lock()
+        self._channels = {}  # type: dict[tuple, list[_PooledChannel]]
+        self._by_channel = {}  # type: dict[int, _PooledChannel]
+
+    def acquire(self, host_port, options=()):
+        """
+        :param str host_port: Address to connect to.
+        :param list[(str, object)] options: gRPC channel options.
+        :rtype: grpc.Channel
+        """
+        key = (host_port, tuple(options))
+        with self._lock:
+            self._evict_idle()
+            pooled = self._channels.setdefault(key, [])
+            if not pooled or (len(pooled) < self.stripes and min(p.refs for p in pooled) > 0):
+                pooled.append(self._create(key))
+            entry = min(pooled, key=lambda p: p.refs)
+            entry.refs += 1
+            return entry.channel
+
+    def release(self, channel):
+        """
+        Tells the pool a channel returned from `acquire` is no longer used by the caller.
+
+        :param grpc.Channel channel: Channel to release.
+        """
+        with self._lock:
+            self._release(channel)
+            self._evict_idle()
+
+    def invalidate(self, channel):
+        """
+        Releases a channel and stops giving it to new callers, e.g. after it failed.
+        It's closed once all callers released it.
+
+        :param grpc.Channel channel: Channel to invalidate.
+        """
+        with self._lock:
+            entry = self._by_channel.get(id(channel))
+            if entry is not None and not entry.stale:
+                entry.stale = True
+                self._channels[entry.key].remove(entry)
+                if not self._channels[entry.key]:
+                    del self._channels[entry.key]
+            self._release(channel)
+
+    def close_all(self):
+        """Closes all channels, including those still in use."""
+        with self._lock:
+            for entry in self._by_channel.values():
+                entry.channel.close()
+            self._channels.clear()
+            self._by_channel.clear()
+
+    def __len__(self):
+        return len(self._by_channel)
+
+    def _create(self, key):
+        host_port, options = key
+        if self.stripes > 1:
+            # Don't share subchannels (i.e. TCP connections) with the other stripes
+            options += (('grpc.use_local_subchannel_pool', 1),)
+        entry = _PooledChannel(key, grpc.insecure_channel(host_port, options=list(options)))
+        self._by_channel[id(entry.channel)] = entry
+        return entry
+
+    def _release(self, channel):
+        entry = self._by_channel.get(id(channel))
+        if entry is None:
+            return
+        entry.refs -= 1
+        if entry.refs > 0:
+            return
+        entry.idle_since = time.time()
+        if entry.stale:
+            self._close(entry)
+
+    def _close(self, entry):
+        entry.channel.close()
+        del self._by_channel[id(entry.channel)]
+        if not entry.stale:
+            self._channels[entry.key].remove(entry)
+            if not self._channels[entry.key]:
+                del self._channels[entry.key]
+
+    def _evict_idle(self):
+        now = time.time()
+        for entry in list(self._by_channel.values()):
+            if entry.refs == 0 and now - entry.idle_since > self.idle_timeout:
+                self._close(entry)
+
+
+# Pool used by the gRPC client factories
+default_channel_pool = GRpcChannelPool()
@@ -1,36 +1,689 @@
-from threading import Event
+import mmap
+import os
+import struct
+import tempfile
+import time
+import zlib
+from collections import deque
+from itertools import chain, imap
+from Queue import Queue, Full, Empty
+from threading import Event, Condition, Thread
+
+import grpc
 from pydcomm.public.bugarpc import ReaderWriterStream
 
+# Reserved procedure that executes many calls sent in a single message, see `marshal_batch_request`
+RPC_BATCH_PROCEDURE = "_rpc_batch"
+# Reserved streaming procedure that executes a call whose params and return value are sent in chunks,
+# see `marshal_chunked_header`
+RPC_CHUNKED_CALL_PROCEDURE = "_rpc_chunked_call"
+# Reserved streaming procedure whose writes are coalesced into frames, see `iter_coalesced_frames`
+RPC_COALESCED_STREAMING_PROCEDURE = "_rpc_coalesced_streaming"
+
+# Servers also listen on this Unix domain socket, so clients on the same machine can skip TCP
+LOCAL_SOCKET_PATH = "/tmp/buga_rpc_{}.sock"
+# Device ids that mean the executor runs on this machine
+LOCAL_DEVICE_IDS = ("localhost", "127.0.0.1")
+
+# Control socket of the shared memory transport, see `SharedMemoryRing`
+SHM_CONTROL_SOCKET_PATH = "/tmp/buga_shm_{}.sock"
+
+_UINT32 = struct.Struct("<I")
+_UINT64 = struct.Struct("<Q")
+_CHUNKED_HEADER = struct.Struct("<QI")
+_BATCH_STATUS_OK = 0
+_BATCH_STATUS_ERROR = 1
+
+
+def local_socket_address(rpc_id):
+    """
+    :param int rpc_id: RPC id, i.e. TCP port, of the server.
+    :return: gRPC address of the server's Unix domain socket.
+    :rtype: str
+    """
+    return "unix://" + LOCAL_SOCKET_PATH.format(rpc_id)
+
+
+class QueueClosedError(Exception):
+    """Put to a `WatermarkQueue` after it was closed"""
+
+
+class WatermarkQueue(object):
+    """
+    Queue of buffers bounded by their total size, so a fast producer can't buffer unbounded memory.
+
+    Once a put would take the queue over `high_watermark` bytes, the queue is full: puts block until gets drain it
+    down to `low_watermark` bytes. A single buffer larger than `high_watermark` is accepted when the queue is empty.
+
+    Once the consumer stops getting, e.g. because the call it sends to ended, the queue should be closed: blocked and
+    following puts raise `QueueClosedError` instead of waiting for gets that never come.
+    """
+    def __init__(self, high_watermark, low_watermark=None):
+        """
+        :param int high_watermark: Size in bytes at which the queue becomes full.
+        :param int|None low_watermark: Size in bytes at which a full queue accepts puts again, None for half of
+            `high_watermark`.
+        """
+        self.high_watermark = high_watermark
+        self.low_watermark = low_watermark if low_watermark is not None else high_watermark // 2
+        self.queued_bytes = 0
+        self.max_queued_bytes = 0
+        self.blocked_puts = 0
+        self._items = deque()
+        self._full = False
+        self._closed = False
+        self._cond = Condition()
+
+    def put(self, value, block=True, timeout=None, force=False):
+        """
+        :param str|bytearray value: Buffer to put.
+        :param bool block: Whether to wait while the queue is full.
+        :param float|None timeout: Maximum seconds to wait, None to wait forever.
+        :param bool force: Put even if the queue is full or closed, without counting the value's size, e.g. for
+            sentinels.
+        :raises Queue.Full: If the queue is still full when not waiting, or after the timeout.
+        :raises QueueClosedError: If the queue is closed, or was closed while waiting.
+        """
+        size = 0 if force else len(value)
+        with self._cond:
+            if not force:
+                if self._closed:
+                    raise QueueClosedError("Queue is closed")
+                if self._items and self.queued_bytes + size > self.high_watermark:
+                    self._full = True
+                if self._full:
+                    if not block:
+                        raise Full
+                    self.blocked_puts += 1
+                    self._wait_not_full(timeout)
+            self._items.append((value, size))
+            self.queued_bytes += size
+            self.max_queued_bytes = max(self.max_queued_bytes, self.queued_bytes)
+            self._cond.notify_all()
+
+    def _wait_not_full(self, timeout):
+        deadline = None if timeout is None else time.time() + timeout
+        while self._full:
+            if self._closed:
+                raise QueueClosedError("Queue was closed while waiting for it to drain")
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                raise Full
+            self._cond.wait(remaining)
+
+    def get(self, timeout=None):
+        """
+        Removes and returns the oldest value, waiting while the queue is empty.
+
+        :param float|None timeout: Maximum seconds to wait, None to wait forever.
+        :raises Queue.Empty: If the queue is still empty after the timeout.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._cond:
+            while not self._items:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    raise Empty
+                self._cond.wait(remaining)
+            value, size = self._items.popleft()
+            self.queued_bytes -= size
+            if self._full and self.queued_bytes <= self.low_watermark:
+                self._full = False
+                self._cond.notify_all()
+            return value
+
+    def close(self):
+        """Reject following puts, and wake blocked ones. Values already queued can still be taken."""
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """
+        :return: Current and maximal depth counters.
+        :rtype: dict
+        """
+        with self._cond:
+            return {"queue_depth": len(self._items), "queued_bytes": self.queued_bytes,
+                    "max_queued_bytes": self.max_queued_bytes, "blocked_writes": self.blocked_puts}
+
 
 class GReaderWriterStream(ReaderWriterStream):
     """
     Interface for return object from a streaming call.
     Member functions:
-        read, write, end_write
+        read, write, end_write, cancel
+
+    The stream is also an iterator of the values read, and a context manager that cancels the call on exit:
+        >>> with client.call_streaming("process_frames", "", read_ahead=2) as stream:  # doctest: +SKIP
+        ...     for frame in stream:
+        ...         process(frame)
+
+    With `read_ahead`, a background thread reads up to that many values ahead, so the next value is received while
+    the current one is processed.
     """
-    def __init__(self, stream_it, write_queue, end_write_sential):
+    # Polling interval of a blocked prefetch thread or reader, for noticing `cancel`
+    _CANCEL_POLL_INTERVAL = 0.1
+
+    def __init__(self, stream_it, write_queue, end_write_sential, read_ahead=0):
+        """
+        :param stream_it: Iterator of the call's responses.
+        :param WatermarkQueue write_queue: Queue the call's requests are sent from.
+        :param object end_write_sential: Value that ends the requests.
+        :param int read_ahead: Number of values to read ahead in the background, 0 to read only in `read`.
+        """
         self.stream_it = stream_it
         self.write_queue = write_queue
         self.end_write_sential = end_write_sential
         self._end_write = Event()
+        self._cancelled = Event()
+        self._prefetched = None
+        self._read_end = None  # (value, exception) of the end of a prefetched stream
+        if hasattr(stream_it, "add_done_callback"):
+            # Once the call ended, whether read or not, nothing sends the written values anymore
+            stream_it.add_done_callback(lambda _: write_queue.close())
+        if read_ahead > 0:
+            self._prefetched = Queue(maxsize=read_ahead)
+            # Doesn't reference the stream, so a stream dropped without cancelling is still collected and ends writing
+            prefetch_thread = Thread(target=self._prefetch,
+                                     args=(stream_it, self._prefetched, self._cancelled, write_queue),
+                                     name="GReaderWriterStreamPrefetch")
+            prefetch_thread.daemon = True
+            prefetch_thread.start()
 
     def read(self):
         """
         Receive value from server side.
 
         This is blocking until server sends a response, or closes the connection.
+
+        :raises StopIteration: If the server closed the stream, or the call was cancelled.
+        """
+        if self._cancelled.is_set():
+            raise StopIteration
+        if self._prefetched is None:
+            try:
+                return next(self.stream_it).buf
+            except grpc.RpcError:
+                self.write_queue.close()
+                if self._cancelled.is_set():
+                    # A read blocked while cancelling gets the CANCELLED status
+                    raise StopIteration
+                raise
+            except BaseException:
+                self.write_queue.close()
+                raise
+        if self._read_end is None:
+            item = self._get_prefetched()
+            if not isinstance(item, tuple):
+                return item
+            self._read_end = item
+        ex = self._read_end[1]
+        if ex is not None:
+            raise ex
+        raise StopIteration
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        return self.read()
+
+    def _get_prefetched(self):
+        while True:
+            try:
+                return self._prefetched.get(timeout=self._CANCEL_POLL_INTERVAL)
+            except Empty:
+                if self._cancelled.is_set():
+                    raise StopIteration
+
+    @classmethod
+    def _prefetch(cls, stream_it, prefetched, cancelled, write_queue):
+        # Values are put as is, the end of the stream as a tuple of (None, exception raised or None)
+        try:
+            for response in stream_it:
+                if not cls._put_prefetched(prefetched, cancelled, response.buf):
+                    return
+            write_queue.close()
+            cls._put_prefetched(prefetched, cancelled, (None, None))
+        except Exception as ex:
+            write_queue.close()
+            cls._put_prefetched(prefetched, cancelled, (None, ex))
+
+    @classmethod
+    def _put_prefetched(cls, prefetched, cancelled, item):
+        while not cancelled.is_set():
+            try:
+                prefetched.put(item, timeout=cls._CANCEL_POLL_INTERVAL)
+                return True
+            except Full:
+                pass
+        return False
+
+    def cancel(self):
+        """
+        Cancels the call: stops writing and reading, and tells the server.
+        Following and blocked reads raise StopIteration, following and blocked writes raise QueueClosedError.
         """
-        return next(self.stream_it).buf
+        self._cancelled.set()
+        self.write_queue.close()
+        self.end_write()
+        self.stream_it.cancel()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.cancel()
+
+    def write(self, value, timeout=None):
+        """
+        Write a value to the server.
+
+        If the write queue is full, this blocks until it drains.
 
-    def write(self, value):
-        """Write a value to the server."""
+        :param float|None timeout: Maximum seconds to wait for the queue to drain, None to wait forever and 0 to not
+            wait at all.
+        :raises Queue.Full: If the queue didn't drain in time.
+        :raises QueueClosedError: If the call was cancelled or ended.
+        """
         assert not self._end_write.is_set(), "already called end_write"
-        self.write_queue.put(value)
+        self.write_queue.put(value, block=timeout != 0, timeout=timeout)
 
     def end_write(self):
         """Tell server that you're done writing."""
+        if self._end_write.is_set():
+            return
         self._end_write.set()
-        self.write_queue.put(self.end_write_sential)
+        self.write_queue.put(self.end_write_sential, force=True)
+
+    def stats(self):
+        """
+        :return: Write queue depth counters, see `WatermarkQueue.stats`.
+        :rtype: dict
+        """
+        return self.write_queue.stats()
 
     def __del__(self):
-        self.end_write()
\ No newline at end of file
+        self.end_write()
+        self._cancelled.set()  # Nothing reads the values anymore, stop the read-ahead thread
+
+
+class CompressionPolicy(object):
+    """
+    Decides whether to compress a gRPC message, by its size and by how well a sample of it compresses.
+    Both sides decompress transparently, so this only needs to be set on the sending side.
+    """
+    def __init__(self, threshold=64 * 1024, max_ratio=0.8, sample_size=64 * 1024, algorithm=grpc.Compression.Gzip):
+        """
+        :param int threshold: Messages smaller than this many bytes are never compressed.
+        :param float max_ratio: Compress only if a sample compresses to at most this fraction of its size.
+        :param int sample_size: Size of the sample to measure the compression ratio on.
+        :param grpc.Compression algorithm: Compression to use.
+        """
+        self.threshold = threshold
+        self.max_ratio = max_ratio
+        self.sample_size = sample_size
+        self.algorithm = algorithm
+        self.last_ratio = None  # Measured ratio of the last sampled message, for stats
+
+    def choose(self, buf):
+        """
+        :param str|None buf: Message that's about to be sent.
+        :rtype: grpc.Compression
+        """
+        if not buf or len(buf) < self.threshold:
+            return grpc.Compression.NoCompression
+        sample = buf[:self.sample_size]
+        self.last_ratio = len(zlib.compress(sample, 1)) / float(len(sample))
+        return self.algorithm if self.last_ratio <= self.max_ratio else grpc.Compression.NoCompression
+
+# region Batch framing
+#
+# A batch request is a uint32 count followed by that many (name, params) pairs, a batch response is a uint32 count
+# followed by that many (status, buffer) pairs, where buffer is the return value or the error message.
+# Integers are little endian uint32, except status which is a single byte. Strings are prefixed by their uint32 length.
+# The C++ side implements the same framing in `handleServerRpc`.
+
+def _pack_buf(buf):
+    return _UINT32.pack(len(buf)) + buf
+
+
+def _unpack_buf(buf, offset, what="batch message"):
+    # "what" names the message being read, for errors
+    if offset + _UINT32.size > len(buf):
+        raise ValueError("Truncated " + what)
+    length, = _UINT32.unpack_from(buf, offset)
+    offset += _UINT32.size
+    if offset + length > len(buf):
+        raise ValueError("Truncated " + what)
+    return buf[offset:offset + length], offset + length
+
+
+def marshal_batch_request(calls):
+    """
+    :param list[(str, str)] calls: Pairs of procedure name and params.
+    :rtype: str
+    """
+    return _UINT32.pack(len(calls)) + "".join(_pack_buf(name) + _pack_buf(params or "") for name, params in calls)
+
+
+def unmarshal_batch_request(buf):
+    """
+    :param str buf: Buffer created by `marshal_batch_request`.
+    :return: Pairs of procedure name and params.
+    :rtype: list[(str, str)]
+    """
+    count, = _UINT32.unpack_from(buf, 0)
+    offset = _UINT32.size
+    calls = []
+    for _ in range(count):
+        name, offset = _unpack_buf(buf, offset)
+        params, offset = _unpack_buf(buf, offset)
+        calls.append((name, params))
+    return calls
+
+
+def marshal_batch_response(results):
+    """
+    :param list[(bool, str)] results: Pairs of success flag and return value or error message.
+    :rtype: str
+    """
+    return _UINT32.pack(len(results)) + "".join(
+        chr(_BATCH_STATUS_OK if ok else _BATCH_STATUS_ERROR) + _pack_buf(ret) for ok, ret in results)
+
+
+def unmarshal_batch_response(buf):
+    """
+    :param str buf: Buffer created by `marshal_batch_response`.
+    :return: Pairs of success flag and return value or error message.
+    :rtype: list[(bool, str)]
+    """
+    count, = _UINT32.unpack_from(buf, 0)
+    offset = _UINT32.size
+    results = []
+    for _ in range(count):
+        if offset >= len(buf):
+            raise ValueError("Truncated batch message")
+        status = ord(buf[offset])
+        ret, offset = _unpack_buf(buf, offset + 1)
+        results.append((status == _BATCH_STATUS_OK, ret))
+    return results
+
+# endregion
+
+
+# region Chunked call framing
+#
+# A chunked call is a streaming call to `RPC_CHUNKED_CALL_PROCEDURE`. Its params are a header made of the total params
+# size (uint64), the chunk size (uint32) and the procedure name, and the params themselves follow in chunks.
+# The server answers with the total return value size (uint64), followed by the return value in chunks.
+# The C++ side implements the same framing in `BugaGRpcStreamingServiceImpl::call_streaming`.
+
+def marshal_chunked_header(procedure_name, total_size, chunk_size):
+    """
+    :param str procedure_name: Name of the procedure to call.
+    :param int total_size: Size of the params that will follow in chunks.
+    :param int chunk_size: Maximum chunk size, used by both sides.
+    :rtype: str
+    """
+    return _CHUNKED_HEADER.pack(total_size, chunk_size) + procedure_name
+
+
+def unmarshal_chunked_header(buf):
+    """
+    :param str buf: Buffer created by `marshal_chunked_header`.
+    :return: Procedure name, total size and chunk size.
+    :rtype: (str, int, int)
+    """
+    total_size, chunk_size = _CHUNKED_HEADER.unpack_from(buf, 0)
+    return buf[_CHUNKED_HEADER.size:], total_size, chunk_size
+
+
+def iter_chunks(buf, chunk_size):
+    """
+    Splits `buf` to chunks, without copying more than a single chunk at a time.
+
+    :param str|bytearray buf: Buffer to split.
+    :param int chunk_size: Maximum chunk size.
+    :rtype: collections.Iterable[str]
+    """
+    view = memoryview(buf)
+    for offset in xrange(0, len(buf), chunk_size):
+        yield view[offset:offset + chunk_size].tobytes()
+
+
+def iter_chunked_return(buf, chunk_size):
+    """
+    Messages a server sends for a chunked call's return value: its size and then its chunks.
+
+    :param str buf: Return value.
+    :param int chunk_size: Maximum chunk size.
+    :rtype: collections.Iterable[str]
+    """
+    yield _UINT64.pack(len(buf))
+    for chunk in iter_chunks(buf, chunk_size):
+        yield chunk
+
+
+def reassemble_chunks(total_size, chunks):
+    """
+    Copies chunks into a buffer that is allocated once.
+
+    :param int total_size: Expected sum of chunk sizes.
+    :param collections.Iterable[str] chunks: Chunks to reassemble.
+    :rtype: bytearray
+    """
+    buf = bytearray(total_size)
+    view = memoryview(buf)
+    offset = 0
+    for chunk in chunks:
+        if offset + len(chunk) > total_size:
+            raise ValueError("Chunks are larger than the expected {} bytes".format(total_size))
+        view[offset:offset + len(chunk)] = chunk
+        offset += len(chunk)
+    if offset != total_size:
+        raise ValueError("Got {} bytes out of the expected {} bytes".format(offset, total_size))
+    return buf
+
+
+def reassemble_chunked_return(messages):
+    """
+    Reverse of `iter_chunked_return`.
+
+    :param collections.Iterable[str] messages: Messages sent by the server.
+    :rtype: bytearray
+    """
+    messages = iter(messages)
+    total_size, = _UINT64.unpack(next(messages))
+    return reassemble_chunks(total_size, messages)
+
+# endregion
+
+
+# region Coalesced streaming framing
+#
+# A streaming call to the reserved procedure "_rpc_coalesced_streaming" sends, after the procedure name, a frame of the
+# real procedure name and params. Each following message is a frame of any number of values written by the client.
+# A frame is a concatenation of (uint32 length, value).
+
+
+def marshal_frame(values):
+    """
+    :param collections.Iterable[str|bytearray] values: Values to put in the frame.
+    :rtype: str
+    """
+    parts = []
+    for value in values:
+        parts.append(_UINT32.pack(len(value)))
+        parts.append(value if isinstance(value, str) else str(value))
+    return "".join(parts)
+
+
+def unmarshal_frame(buf):
+    """
+    Reverse of `marshal_frame`.
+
+    :rtype: list[str]
+    :raises ValueError: If the frame is truncated.
+    """
+    values = []
+    offset = 0
+    while offset < len(buf):
+        value, offset = _unpack_buf(buf, offset, "coalesced frame")
+        values.append(value)
+    return values
+
+
+def iter_coalesced_frames(queue, end_sentinel, max_frame_size, max_delay):
+    """
+    Takes values from the queue until `end_sentinel`, and merges them into frames, see `marshal_frame`.
+    A frame is sent once it reaches `max_frame_size` bytes, or `max_delay` seconds after its first value was taken.
+
+    :param WatermarkQueue queue: Queue of written values.
+    :param object end_sentinel: Value that ends the stream.
+    :param int max_frame_size: Size in bytes of values after which a frame is sent.
+    :param float max_delay: Maximum seconds a value waits for more values.
+    :rtype: collections.Iterable[str]
+    """
+    while True:
+        value = queue.get()
+        if value is end_sentinel:
+            return
+        values, size = [value], len(value)
+        deadline = time.time() + max_delay
+        while size < max_frame_size:
+            try:
+                value = queue.get(timeout=max(deadline - time.time(), 0))
+            except Empty:
+                break
+            if value is end_sentinel:
+                yield marshal_frame(values)
+                return
+            values.append(value)
+            size += len(value)
+        yield marshal_frame(values)
+
+
+def iter_split_frames(frames):
+    """
+    Reverse of `iter_coalesced_frames`.
+
+    :param collections.Iterable[str] frames: Received frames.
+    :rtype: collections.Iterable[str]
+    """
+    return chain.from_iterable(imap(unmarshal_frame, frames))
+
+# endregion
+
+
+# region Shared memory transport framing
+
+# Control socket messages of a call. Payloads are in the sender's ring at the offset, or follow the message on the
+# control socket if the offset is SHM_INLINE.
+# Request: name length, payload offset, payload length; followed by the name.
+SHM_REQUEST = struct.Struct("<IQQ")
+# Response: status (SHM_STATUS_OK or SHM_STATUS_ERROR), payload offset, payload length.
+SHM_RESPONSE = struct.Struct("<BQQ")
+# Handshake the client sends after connecting: lengths of the request and response ring paths; followed by them.
+# The server answers with an empty SHM_RESPONSE once it mapped both rings.
+SHM_HANDSHAKE = struct.Struct("<II")
+SHM_INLINE = 2 ** 64 - 1
+SHM_STATUS_OK = 0
+SHM_STATUS_ERROR = 1
+
+
+class SharedMemoryRing(object):
+    """
+    Ring buffer over a memory mapped file in /dev/shm, for passing payloads between processes on the same machine.
+
+    The ring holds the payload of one call at a time: the writer may overwrite a payload once the reader answered it.
+    Payloads are written after the previous one, wrapping to the start when there's no room left, so consecutive
+    payloads touch different pages.
+    """
+    SHM_DIR = "/dev/shm"
+
+    def __init__(self, fd, path, size):
+        self.path = path
+        self.size = size
+        self._mm = mmap.mmap(fd, size)
+        self._cursor = 0
+
+    @classmethod
+    def create(cls, size):
+        """
+        :param int size: Size in bytes of the ring.
+        :rtype: SharedMemoryRing
+        """
+        fd, path = tempfile.mkstemp(prefix="buga_rpc_", dir=cls.SHM_DIR if os.path.isdir(cls.SHM_DIR) else None)
+        try:
+            os.ftruncate(fd, size)
+            return cls(fd, path, size)
+        finally:
+            os.close(fd)
+
+    @classmethod
+    def open(cls, path):
+        """
+        :param str path: Path of a ring created by another process.
+        :rtype: SharedMemoryRing
+        """
+        fd = os.open(path, os.O_RDWR)
+        try:
+            return cls(fd, path, os.fstat(fd).st_size)
+        finally:
+            os.close(fd)
+
+    def unlink(self):
+        """Removes the file, once both sides mapped it. The memory is freed when both sides close."""
+        os.unlink(self.path)
+
+    def write(self, buf):
+        """
+        :param str|bytearray buf: Payload to write.
+        :return: Offset of the payload, or SHM_INLINE if it's larger than the ring.
+        :rtype: int
+        """
+        if len(buf) > self.size:
+            return SHM_INLINE
+        if self._cursor + len(buf) > self.size:
+            self._cursor = 0
+        offset = self._cursor
+        self._mm.seek(offset)
+        self._mm.write(buffer(buf))  # mmap doesn't take bytearrays, buffer wraps without copying
+        self._cursor += len(buf)
+        return offset
+
+    def read(self, offset, length):
+        """:rtype: str"""
+        return self._mm[offset:offset + length]
+
+    def close(self):
+        self._mm.close()
+
+
+def recv_exactly(sock, size):
+    """
+    :param socket.socket sock: Socket to read from.
+    :param int size: Number of bytes to read.
+    :rtype: str
+    :raises EOFError: If the socket was closed before all bytes arrived.
+    """
+    buf = bytearray(size)
+    view = memoryview(buf)
+    received = 0
+    while received < size:
+        n = sock.recv_into(view[received:], size - received)
+        if n == 0:
+            raise EOFError("Socket closed after {} of {} bytes".format(received, size))
+        received += n
+    return str(buf)
+
+# endregion
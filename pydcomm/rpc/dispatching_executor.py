@@ -0,0 +1,160 @@
+"""
+Executors whose procedures are methods registered with the `procedure` decorator, instead of an if/elif chain in
+`execute_procedure`:
+    >>> class RecorderExecutor(DispatchingExecutor):
+    ...     def get_version(self):
+    ...         return "1.0"
+    ...
+    ...     @procedure()  # Named after the method
+    ...     def get_status(self, params):
+    ...         return "idle"
+    ...
+    ...     @procedure("get_recorded_data", marshaller=default_marshaller_registry, max_concurrency=2)
+    ...     def get_recorded_data(self, params):
+    ...         return self.recorder.read(**params)  # params and the returned array are (un)marshalled
+    ...
+    ...     @procedure("record", streaming=True)
+    ...     def record(self, params, it):
+    ...         for command in it:
+    ...             yield self.recorder.handle(command)
+
+The dispatch table is built once, when the class is created, and is available as the `procedures` class attribute.
+"""
+import time
+from collections import namedtuple, defaultdict
+from contextlib import contextmanager
+from itertools import imap
+from threading import BoundedSemaphore, Lock
+
+from pydcomm.rpc.buga_grpc_server import RemoteProcedureStreamingExecutor
+
+ProcedureInfo = namedtuple("ProcedureInfo", "name method_name marshaller streaming max_concurrency")
+
+
+def procedure(name=None, marshaller=None, streaming=False, max_concurrency=None):
+    """
+    Decorator registering a method of a `DispatchingExecutor` as a procedure.
+
+    @param str name: Name of the procedure, None for the method's name. Must not begin with "_rpc_".
+    @param marshaller: Unmarshals params and values written by the caller, and marshals return values. Either a
+        `pydcomm.rpc._marshallers.Marshaller`, or a `pydcomm.rpc._marshallers.MarshallerRegistry`, whose envelopes are
+        answered in a content type the caller accepts. None to pass the buffers as they are.
+    @param bool streaming: Whether the method is a streaming procedure, called with the params and an iterator of the
+        values written by the caller, and returning an iterable of values to write back.
+    @param int max_concurrency: Maximum number of invocations running at once, further ones wait for their turn. None
+        for no limit.
+    """
+    def decorator(func):
+        procedure_name = name or func.__name__
+        if procedure_name.startswith("_rpc_"):
+            raise ValueError("Procedure names beginning with '_rpc_' are reserved: {!r}".format(procedure_name))
+        func.procedure_info = ProcedureInfo(procedure_name, func.__name__, marshaller, streaming, max_concurrency)
+        return func
+    return decorator
+
+
+class _DispatchingExecutorMeta(type):
+    """Collects the procedures of the class and its bases into the `procedures` class attribute"""
+    def __init__(cls, name, bases, namespace):
+        super(_DispatchingExecutorMeta, cls).__init__(name, bases, namespace)
+        procedures = {}
+        for base in reversed(cls.__mro__[1:]):
+            procedures.update(getattr(base, "procedures", {}))
+        for value in namespace.values():
+            info = getattr(value, "procedure_info", None)
+            if info is not None:
+                procedures[info.name] = info
+        cls.procedures = procedures  # type: dict[str, ProcedureInfo]
+
+
+class DispatchingExecutor(RemoteProcedureStreamingExecutor):
+    """
+    Executor dispatching calls to its methods registered with `procedure`, see the module's documentation.
+
+    Keeps the number of calls, errors and call durations of each procedure, see `stats`. Subclasses overriding
+    `__init__` must call it.
+    """
+    __metaclass__ = _DispatchingExecutorMeta
+
+    def __init__(self):
+        self._semaphores = {name: BoundedSemaphore(info.max_concurrency)
+                            for name, info in self.procedures.items() if info.max_concurrency}
+        self._stats_lock = Lock()
+        self._stats = defaultdict(lambda: {"calls": 0, "errors": 0, "total_time": 0., "max_time": 0.})
+
+    def execute_procedure(self, procedure_name, params):
+        info = self._get_procedure(procedure_name, streaming=False)
+        with self._invocation(info):
+            params, marshal = self._unmarshal_params(info.marshaller, params)
+            return marshal(getattr(self, info.method_name)(params))
+
+    def execute_streaming_procedure(self, procedure_name, params, it):
+        info = self._get_procedure(procedure_name, streaming=True)
+        with self._invocation(info):
+            params, marshal = self._unmarshal_params(info.marshaller, params)
+            values = imap(self._value_unmarshaller(info.marshaller), it)
+            for value in getattr(self, info.method_name)(params, values):
+                yield marshal(value)
+
+    def stats(self):
+        """
+        @return: For each procedure called so far, its number of calls and errors, and its total and maximal call
+            durations in seconds, under keys like "procedure_<name>_calls".
+        @rtype: dict
+        """
+        with self._stats_lock:
+            return {"procedure_{}_{}".format(name, key): value
+                    for name, stats in self._stats.items() for key, value in stats.items()}
+
+    def _get_procedure(self, procedure_name, streaming):
+        try:
+            info = self.procedures[procedure_name]
+        except KeyError:
+            raise ValueError("Unknown procedure {!r}".format(procedure_name))
+        if info.streaming != streaming:
+            raise ValueError("Procedure {!r} is {}a streaming procedure".format(procedure_name,
+                                                                                "" if info.streaming else "not "))
+        return info
+
+    @contextmanager
+    def _invocation(self, info):
+        semaphore = self._semaphores.get(info.name)
+        if semaphore is not None:
+            semaphore.acquire()
+        start = time.time()
+        failed = False
+        try:
+            yield
+        except Exception:
+            failed = True
+            raise
+        finally:
+            duration = time.time() - start
+            if semaphore is not None:
+                semaphore.release()
+            with self._stats_lock:
+                stats = self._stats[info.name]
+                stats["calls"] += 1
+                stats["errors"] += failed
+                stats["total_time"] += duration
+                stats["max_time"] = max(stats["max_time"], duration)
+
+    @staticmethod
+    def _unmarshal_params(marshaller, params):
+        """
+        @return: The unmarshalled params, and a function marshalling return values for the caller.
+        """
+        if marshaller is None:
+            return params, lambda ret: ret
+        if hasattr(marshaller, "unpack"):
+            params, accepted = marshaller.unpack(params)
+            return params, lambda ret: marshaller.pack(ret, accepted=accepted)
+        return marshaller.unmarshal(params), marshaller.marshal
+
+    @staticmethod
+    def _value_unmarshaller(marshaller):
+        if marshaller is None:
+            return lambda value: value
+        if hasattr(marshaller, "unpack"):
+            return lambda value: marshaller.unpack(value)[0]
+        return marshaller.unmarshal
@@ -0,0 +1,168 @@
+"""
+Runs CPU-bound procedures of python executors in worker processes, so they aren't serialized by the GIL.
+
+Mark a procedure as CPU-bound by implementing it as a method of the executor, named after the procedure and
+decorated with `cpu_bound`. Then give the server worker processes:
+    >>> class DspExecutor(BugaEchoExecutor):
+    ...     @cpu_bound
+    ...     def filter_recording(self, params):
+    ...         return apply_filter(params)
+    >>> GRemoteProcedureServer(cpu_processes=4).listen(DspExecutor(), 30001, True)  # doctest: +SKIP
+
+Workers are forked when the server starts listening, and each gets its own copy of the executor as it was then.
+Changes a CPU-bound procedure makes to the executor stay in its worker.
+"""
+import mmap
+import os
+import tempfile
+from itertools import count
+
+from concurrent import futures
+
+from pydcomm.rpc.common import SharedMemoryRing
+
+# CPU-bound procedures of the running pools' executors by pool id, see `get_cpu_bound_procedures`. Workers inherit
+# this when they fork.
+_worker_procedures = {}
+_pool_ids = count()
+
+
+def cpu_bound(func):
+    """
+    Decorator marking an executor method as a CPU-bound procedure, see the module's documentation.
+
+    @param (RemoteProcedureExecutor, str) -> str func: Method taking the params buffer and returning the return value
+        buffer.
+    """
+    func.cpu_bound = True
+    return func
+
+
+def get_cpu_bound_procedures(executor):
+    """
+    Looks up the executor's procedures marked with `cpu_bound`, once, instead of on each call.
+
+    @return: The executor's methods marked with `cpu_bound` by procedure name.
+    @rtype: dict[str, (str) -> str]
+    """
+    executor_type = type(executor)
+    return {name: getattr(executor, name) for name in dir(executor_type)
+            if getattr(getattr(executor_type, name, None), "cpu_bound", False)}
+
+
+class _SharedBuffer(object):
+    """
+    A buffer handed to another process through a memory mapped file in shared memory, instead of pickling it through
+    a pipe
+    """
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+
+    @classmethod
+    def create(cls, buf):
+        shm_dir = SharedMemoryRing.SHM_DIR if os.path.isdir(SharedMemoryRing.SHM_DIR) else None
+        fd, path = tempfile.mkstemp(prefix="buga_rpc_", dir=shm_dir)
+        shared_buffer = cls(path, len(buf))
+        try:
+            if buf:  # Empty files can't be mapped
+                os.ftruncate(fd, len(buf))
+                mm = mmap.mmap(fd, len(buf))
+                try:
+                    mm.write(buffer(buf))  # mmap doesn't take bytearrays, buffer wraps without copying
+                finally:
+                    mm.close()
+        except BaseException:
+            shared_buffer.discard()  # E.g. shared memory is full
+            raise
+        finally:
+            os.close(fd)
+        return shared_buffer
+
+    def take(self):
+        """Read the buffer and delete its file."""
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.unlink(self.path)
+            if not self.size:
+                return ""
+            mm = mmap.mmap(fd, self.size, access=mmap.ACCESS_READ)
+            try:
+                return mm[:]
+            finally:
+                mm.close()
+        finally:
+            os.close(fd)
+
+    def discard(self):
+        """Delete the file if the buffer wasn't taken, e.g. when the worker died."""
+        try:
+            os.unlink(self.path)
+        except OSError:
+            pass
+
+
+def _hand_off(buf, threshold):
+    return _SharedBuffer.create(buf) if len(buf) >= threshold else buf
+
+
+def _take(value):
+    return value.take() if isinstance(value, _SharedBuffer) else value
+
+
+def _execute_in_worker(pool_id, procedure_name, params, threshold):
+    method = _worker_procedures[pool_id][procedure_name]
+    return _hand_off(method(_take(params)), threshold)
+
+
+def _warm_up():
+    pass
+
+
+class ProcessPoolDispatcher(object):
+    """
+    Calls the `cpu_bound` procedures of an executor in a pool of worker processes.
+
+    Params and return values of at least `handoff_threshold` bytes are passed through shared memory files.
+    """
+    DEFAULT_HANDOFF_THRESHOLD = 64 * 1024
+
+    def __init__(self, executor, max_workers=None, handoff_threshold=DEFAULT_HANDOFF_THRESHOLD):
+        """
+        @param RemoteProcedureExecutor executor: Executor whose procedures are called.
+        @param int max_workers: Number of worker processes, None for the number of CPUs.
+        @param int handoff_threshold: Minimal size in bytes of buffers passed through shared memory.
+        """
+        self.handoff_threshold = handoff_threshold
+        self._pool_id = next(_pool_ids)
+        _worker_procedures[self._pool_id] = get_cpu_bound_procedures(executor)
+        self._pool = futures.ProcessPoolExecutor(max_workers=max_workers)
+        # Workers are forked on the first submit, make it happen now, before the server starts more threads
+        self._pool.submit(_warm_up).result()
+
+    def call(self, procedure_name, params):
+        """
+        Call a procedure in a worker process and wait for its return value.
+
+        @param str procedure_name: Name of a `cpu_bound` procedure of the executor.
+        @param str params: The Buffer sent from python.
+        @return: Buffer representing return value to be sent back to python.
+        @rtype: str
+        """
+        params = _hand_off(params, self.handoff_threshold)
+        try:
+            ret = self._pool.submit(_execute_in_worker, self._pool_id, procedure_name, params,
+                                    self.handoff_threshold).result()
+        finally:
+            if isinstance(params, _SharedBuffer):
+                params.discard()
+        try:
+            return _take(ret)
+        finally:
+            if isinstance(ret, _SharedBuffer):
+                ret.discard()
+
+    def shutdown(self):
+        """Stop the worker processes once the pending calls return."""
+        self._pool.shutdown(wait=False)
+        _worker_procedures.pop(self._pool_id, None)
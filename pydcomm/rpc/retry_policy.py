@@ -0,0 +1,67 @@
+import random
+
+import grpc
+
+
+class RetryPolicy(object):
+    """
+    Decides whether and when a failed RPC call is retried.
+
+    The default policy retries every failed call once, immediately, like the clients always did.
+    Example of a stricter policy, that doesn't retry calls with side effects, and backs off between attempts:
+        >>> policy = RetryPolicy(max_attempts=4, initial_backoff=0.1, retryable_codes=RetryPolicy.TRANSIENT_CODES,
+        ...                      idempotent_procedures={"get_recorded_data", "get_status"})
+    """
+    # Codes that usually mean the call can succeed if tried again
+    TRANSIENT_CODES = (grpc.StatusCode.UNAVAILABLE, grpc.StatusCode.DEADLINE_EXCEEDED,
+                       grpc.StatusCode.RESOURCE_EXHAUSTED, grpc.StatusCode.ABORTED)
+    # Reserved procedures without side effects
+    RESERVED_IDEMPOTENT_PROCEDURES = ("_rpc_get_version", "_rpc_device_time_usec")
+
+    def __init__(self, max_attempts=2, initial_backoff=0., max_backoff=5., backoff_multiplier=2., jitter=0.2,
+                 retryable_codes=None, idempotent_procedures=None):
+        """
+        :param int max_attempts: Maximum number of attempts per call, including the first one.
+        :param float initial_backoff: Seconds to wait before the first retry.
+        :param float max_backoff: Maximum seconds to wait between attempts.
+        :param float backoff_multiplier: Factor by which the wait grows after each retry.
+        :param float jitter: Fraction by which each wait is randomly shortened or lengthened.
+        :param collections.Iterable[grpc.StatusCode]|None retryable_codes: Status codes to retry on, None for all.
+        :param collections.Iterable[str]|None idempotent_procedures: Procedures that are safe to call more than once.
+            Other procedures are never retried. None to treat all procedures as idempotent.
+        """
+        self.max_attempts = max_attempts
+        self.initial_backoff = initial_backoff
+        self.max_backoff = max_backoff
+        self.backoff_multiplier = backoff_multiplier
+        self.jitter = jitter
+        self.retryable_codes = frozenset(retryable_codes) if retryable_codes is not None else None
+        self.idempotent_procedures = (frozenset(idempotent_procedures).union(self.RESERVED_IDEMPOTENT_PROCEDURES)
+                                      if idempotent_procedures is not None else None)
+
+    def is_idempotent(self, procedure_name):
+        """:rtype: bool"""
+        return self.idempotent_procedures is None or procedure_name in self.idempotent_procedures
+
+    def should_retry(self, procedure_name, code, attempt):
+        """
+        :param str procedure_name: Name of the called procedure.
+        :param grpc.StatusCode|None code: Status code of the failed attempt, None if unknown.
+        :param int attempt: Number of the failed attempt, starting from 1.
+        :rtype: bool
+        """
+        if attempt >= self.max_attempts or not self.is_idempotent(procedure_name):
+            return False
+        return self.retryable_codes is None or code in self.retryable_codes
+
+    def backoff(self, attempt):
+        """
+        :param int attempt: Number of the failed attempt, starting from 1.
+        :return: Seconds to wait before the next attempt.
+        :rtype: float
+        """
+        delay = min(self.initial_backoff * self.backoff_multiplier ** (attempt - 1), self.max_backoff)
+        return delay * (1 + random.uniform(-self.jitter, self.jitter))
+
+
+DEFAULT_RETRY_POLICY = RetryPolicy()
@@ -0,0 +1,91 @@
+import socket
+from threading import Lock
+
+from pydcomm.public.bugarpc import IRemoteProcedureClient, RpcError
+from pydcomm.rpc.common import (SHM_CONTROL_SOCKET_PATH, SHM_HANDSHAKE, SHM_REQUEST, SHM_RESPONSE, SHM_INLINE,
+                                SHM_STATUS_OK, SharedMemoryRing, recv_exactly)
+
+
+class SharedMemoryRemoteProcedureClient(IRemoteProcedureClient):
+    """
+    Client of an executor running on the same machine, e.g. a Linux simulation, that passes params and return values
+    through shared memory instead of serializing them into a socket. Only the small call headers go through the
+    control socket.
+
+    The server is `pydcomm.rpc.shm_server.SharedMemoryRemoteProcedureServer`. Calls from several threads are
+    serialized.
+    """
+    DEFAULT_RING_SIZE = 64 * 1024 * 1024  # 64Mb, larger payloads are sent over the control socket
+
+    def __init__(self, rpc_id, ring_size=DEFAULT_RING_SIZE):
+        """
+        :param int rpc_id: RPC id of the executor's server.
+        :param int ring_size: Size in bytes of each of the request and response rings.
+        """
+        self.rpc_id = rpc_id
+        self._lock = Lock()
+        self._socket = None
+        self._requests = self._responses = None
+        try:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(SHM_CONTROL_SOCKET_PATH.format(rpc_id))
+            self._requests = SharedMemoryRing.create(ring_size)
+            self._responses = SharedMemoryRing.create(ring_size)
+            self._handshake()
+        except (socket.error, EnvironmentError, EOFError) as ex:
+            self.close()
+            raise RpcError("Can't connect to shared memory server {}: {}".format(rpc_id, ex))
+
+        xver = self.get_executor_version()
+
+    def _handshake(self):
+        try:
+            self._socket.sendall(SHM_HANDSHAKE.pack(len(self._requests.path), len(self._responses.path)) +
+                                 self._requests.path + self._responses.path)
+            recv_exactly(self._socket, SHM_RESPONSE.size)
+        finally:
+            # Both sides mapped the rings, or the server failed, either way the files aren't needed anymore
+            self._requests.unlink()
+            self._responses.unlink()
+
+    def close(self):
+        """
+        Disconnects from the server. The client can't be used afterwards.
+        """
+        for resource in (self._socket, self._requests, self._responses):
+            if resource is not None:
+                resource.close()
+        self._socket = self._requests = self._responses = None
+
+    def __del__(self):
+        self.close()
+
+    def get_version(self):
+        return '1.0'
+
+    def stop(self):
+        self.call('_rpc_stop', '')
+
+    def call(self, procedure_name, params):
+        with self._lock:
+            if self._socket is None:
+                raise RpcError("Client is closed")
+            try:
+                status, ret = self._call(procedure_name, params)
+            except (socket.error, EOFError) as ex:
+                self.close()
+                raise RpcError("Shared memory call {} failed: {}".format(procedure_name, ex))
+        if status != SHM_STATUS_OK:
+            raise RpcError(ret)
+        return ret
+
+    def _call(self, procedure_name, params):
+        offset = self._requests.write(params)
+        self._socket.sendall(SHM_REQUEST.pack(len(procedure_name), offset, len(params)) + procedure_name)
+        if offset == SHM_INLINE:
+            self._socket.sendall(params)
+
+        status, offset, length = SHM_RESPONSE.unpack(recv_exactly(self._socket, SHM_RESPONSE.size))
+        if offset == SHM_INLINE:
+            return status, recv_exactly(self._socket, length)
+        return status, self._responses.read(offset, length)
@@ -0,0 +1,108 @@
+import os
+import socket
+import time
+from threading import Thread, Event
+
+from pydcomm.rpc.buga_grpc_server import RemoteProcedureServer, BugaGRpcServiceImpl
+from pydcomm.rpc.common import (SHM_CONTROL_SOCKET_PATH, SHM_HANDSHAKE, SHM_REQUEST, SHM_RESPONSE, SHM_INLINE,
+                                SHM_STATUS_OK, SHM_STATUS_ERROR, SharedMemoryRing, recv_exactly)
+
+
+class SharedMemoryRemoteProcedureServer(RemoteProcedureServer):
+    """
+    A remote procedure server for clients on the same machine, that passes params and return values through shared
+    memory rings the client creates, see `pydcomm.rpc.shm_client.SharedMemoryRemoteProcedureClient`.
+
+    Each connected client is served by its own thread.
+    """
+    def __init__(self):
+        self._service = None
+        self._path = None
+        self._socket = None
+        self._stopped = Event()
+
+    def listen(self, executor, rpc_id, wait):
+        self._service = BugaGRpcServiceImpl(executor, self.stop)
+        self._path = SHM_CONTROL_SOCKET_PATH.format(rpc_id)
+        if os.path.exists(self._path):
+            os.unlink(self._path)  # Left by a server that's gone
+        self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self._socket.bind(self._path)
+        self._socket.listen(5)
+        self._stopped.clear()
+
+        accept_thread = Thread(target=self._accept_loop, name="SharedMemoryServer")
+        accept_thread.daemon = True
+        accept_thread.start()
+        if wait:
+            self.wait()
+
+    def wait(self, timeout=None):
+        # Waits in short steps, a single long wait doesn't wake up for KeyboardInterrupt
+        end = None if timeout is None else time.time() + timeout
+        while not self._stopped.wait(1 if end is None else min(1, max(end - time.time(), 0))):
+            if end is not None and time.time() >= end:
+                return False
+        return True
+
+    def stop(self, timeout=None):
+        """
+        Stops accepting clients. Clients that are already connected are served until they disconnect.
+
+        @return: Whether the stop definitely happened.
+        @rtype: bool
+        """
+        assert self._socket, "No server set"
+        if not self._stopped.is_set():
+            self._stopped.set()
+            # Closing alone doesn't wake up a blocking accept
+            self._socket.shutdown(socket.SHUT_RDWR)
+            self._socket.close()
+            os.unlink(self._path)
+        return True
+
+    def _accept_loop(self):
+        while not self._stopped.is_set():
+            try:
+                conn, _ = self._socket.accept()
+            except socket.error:
+                break
+            conn_thread = Thread(target=self._serve, args=(conn,), name="SharedMemoryServerConnection")
+            conn_thread.daemon = True
+            conn_thread.start()
+
+    def _serve(self, conn):
+        requests = responses = None
+        try:
+            request_path_size, response_path_size = SHM_HANDSHAKE.unpack(recv_exactly(conn, SHM_HANDSHAKE.size))
+            requests = SharedMemoryRing.open(recv_exactly(conn, request_path_size))
+            responses = SharedMemoryRing.open(recv_exactly(conn, response_path_size))
+            conn.sendall(SHM_RESPONSE.pack(SHM_STATUS_OK, 0, 0))
+            while True:
+                name_size, offset, length = SHM_REQUEST.unpack(recv_exactly(conn, SHM_REQUEST.size))
+                procedure_name = recv_exactly(conn, name_size)
+                params = recv_exactly(conn, length) if offset == SHM_INLINE else requests.read(offset, length)
+
+                status, ret = self._call(procedure_name, params)
+                del params
+                offset = responses.write(ret)
+                conn.sendall(SHM_RESPONSE.pack(status, offset, len(ret)))
+                if offset == SHM_INLINE:
+                    conn.sendall(ret)
+        except (EOFError, socket.error, EnvironmentError):
+            pass  # Client disconnected
+        finally:
+            conn.close()
+            for ring in (requests, responses):
+                if ring is not None:
+                    ring.close()
+
+    def _call(self, procedure_name, params):
+        try:
+            ret = self._service._call_procedure(procedure_name, params)
+            if not isinstance(ret, (str, bytearray)):
+                # Fails this call only, instead of the connection's thread when writing it to the ring
+                raise TypeError("Procedure {} returned {}, not a buffer".format(procedure_name, type(ret).__name__))
+            return SHM_STATUS_OK, ret
+        except Exception as ex:
+            return SHM_STATUS_ERROR, "{}: {}".format(type(ex).__name__, ex)
@@ -1,7 +1,15 @@
 import unittest
 import mock
+import numpy as np
 
 from pydcomm.examples.rpc_loopback_ai_example import AdbIntentsProcedureCaller
+from pydcomm.rpc._marshallers import default_marshaller_registry
+from pydcomm.rpc._remote_procedure_call import StandardRemoteProcedureCaller
+
+
+class EchoProcedureCaller(StandardRemoteProcedureCaller):
+    def _send_and_wait_for_return(self, procedure_name, marshalled_params):
+        return marshalled_params
 
 
 class UnitTestRpc(unittest.TestCase):
@@ -34,4 +42,15 @@ class UnitTestRpc(unittest.TestCase):
         # TODO: Create dummy marshallers for int and float, call rpc.call() with parameters of types int and float, make sure the correct marshaller is called with the correct parameter.
         pass
 
+    def test_marshaller_registry_used_without_marshallers(self):
+        rpc = EchoProcedureCaller()
+        rpc.marshaller_registry = default_marshaller_registry
+        np.testing.assert_array_equal(rpc.call("echo", np.arange(3)), np.arange(3))
+        self.assertEqual(rpc.call("echo", {"a": 1}), {"a": 1})
+
+    def test_explicit_marshallers_override_registry(self):
+        rpc = EchoProcedureCaller()
+        rpc.marshaller_registry = default_marshaller_registry
+        self.assertEqual(rpc.call("echo", 3, marshaller=str, unmarshaller=int), 3)
+
     # endregion
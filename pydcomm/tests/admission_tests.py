@@ -0,0 +1,57 @@
+import unittest
+from threading import Thread
+
+from pydcomm.rpc.admission import AdmissionControl, ResourceExhaustedError
+
+
+class UnitTestAdmissionControl(unittest.TestCase):
+    def _hold(self, admission, procedure_name):
+        """Enters the admission of a call, and leaves it when the test ends."""
+        context = admission.admit(procedure_name)
+        context.__enter__()
+        self.addCleanup(context.__exit__, None, None, None)
+
+    # region AdmissionControl.admit() unit tests
+
+    def test_unlimited_by_default(self):
+        admission = AdmissionControl()
+        for _ in range(100):
+            self._hold(admission, "get_recorded_data")
+
+    def test_over_limit_rejected_without_waiting_room(self):
+        admission = AdmissionControl({"get_recorded_data": 1})
+        self._hold(admission, "get_recorded_data")
+        with self.assertRaises(ResourceExhaustedError):
+            self._hold(admission, "get_recorded_data")
+        self._hold(admission, "get_status")
+        self.assertEqual(admission.stats()["admission_get_recorded_data_rejected"], 1)
+
+    def test_waiting_call_runs_when_slot_frees(self):
+        admission = AdmissionControl({"get_recorded_data": 1}, max_waiting=1)
+        first = admission.admit("get_recorded_data")
+        first.__enter__()
+        entered = []
+
+        def second():
+            with admission.admit("get_recorded_data"):
+                entered.append(True)
+        thread = Thread(target=second)
+        thread.start()
+        thread.join(0.1)
+        self.assertEqual(admission.stats()["admission_get_recorded_data_waiting"], 1)
+        with self.assertRaises(ResourceExhaustedError):
+            self._hold(admission, "get_recorded_data")
+
+        first.__exit__(None, None, None)
+        thread.join(5)
+        self.assertEqual(entered, [True])
+        self.assertEqual(admission.stats()["admission_active"], 0)
+
+    def test_control_procedures_bypass_max_active(self):
+        admission = AdmissionControl(max_active=1)
+        self._hold(admission, "get_recorded_data")
+        with self.assertRaises(ResourceExhaustedError):
+            self._hold(admission, "get_status")
+        self._hold(admission, "_rpc_get_version")
+
+    # endregion
@@ -0,0 +1,75 @@
+import unittest
+
+import mock
+from concurrent import futures
+
+from pydcomm.public.bugarpc import RpcError
+from pydcomm.rpc.async_client import AsyncGRemoteProcedureClient, AsyncGRpcClientFactory
+from pydcomm.rpc.common import marshal_batch_response, unmarshal_batch_request
+from pydcomm.tests.helpers import TestCasePatcher
+
+
+def _done_future(result):
+    future = futures.Future()
+    future.set_result(result)
+    return future
+
+
+class UnitTestAsyncGRemoteProcedureClient(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.client = mock.Mock()
+        self.async_client = AsyncGRemoteProcedureClient(self.client)
+
+    # region AsyncGRemoteProcedureClient unit tests
+
+    def test_call_returns_future(self):
+        self.client.call_async.return_value = _done_future("pong")
+        self.assertEqual(self.async_client.call("ping", "", timeout=3).result(), "pong")
+        self.client.call_async.assert_called_once_with("ping", "", timeout=3)
+
+    def test_call_batch_maps_results(self):
+        self.client.call_async.return_value = _done_future(marshal_batch_response([(True, "a"), (False, "oops")]))
+        res = self.async_client.call_batch([("first", "1"), ("second", "2")]).result()
+
+        procedure_name, params = self.client.call_async.call_args[0]
+        self.assertEqual(procedure_name, "_rpc_batch")
+        self.assertEqual(unmarshal_batch_request(params), [("first", "1"), ("second", "2")])
+        self.assertEqual(res[0], "a")
+        self.assertIsInstance(res[1], RpcError)
+
+    def test_empty_batch_not_sent(self):
+        self.assertEqual(self.async_client.call_batch([]).result(), [])
+        self.client.call_async.assert_not_called()
+
+    # endregion
+
+
+class UnitTestAsyncGRpcClientFactory(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.patcher = TestCasePatcher(self)
+        self.mock_client = self.patcher.addPatch("pydcomm.rpc.async_client.GRemoteProcedureClient")
+        self.mock_streaming_client = self.patcher.addPatch("pydcomm.rpc.async_client.GRemoteProcedureStreamingClient")
+
+    # region AsyncGRpcClientFactory.create_connection() unit tests
+
+    def test_create_connection_future(self):
+        client = AsyncGRpcClientFactory.create_connection(29999, "10.0.0.5").result(timeout=5)
+        self.assertIs(client.client, self.mock_client.return_value)
+        self.assertEqual(self.mock_client.call_args[0][0], "10.0.0.5:29999")
+
+    def test_create_streaming_connection(self):
+        client = AsyncGRpcClientFactory.create_connection(29999, "10.0.0.5", streaming=True).result(timeout=5)
+        self.assertIs(client.client, self.mock_streaming_client.return_value)
+
+    def test_create_connection_error_in_future(self):
+        self.mock_client.side_effect = RpcError("Connection refused")
+        future = AsyncGRpcClientFactory.create_connection(29999, "10.0.0.5")
+        self.assertIsInstance(future.exception(timeout=5), RpcError)
+
+    # endregion
@@ -0,0 +1,46 @@
+import unittest
+from threading import Event
+
+import grpc
+import mock
+
+from pydcomm.rpc.channel_health import ChannelHealthMonitor
+
+
+class UnitTestChannelHealthMonitor(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.reconnected = Event()
+        self.reconnect_func = mock.Mock(side_effect=lambda channel: self.reconnected.set())
+        self.monitor = ChannelHealthMonitor(self.reconnect_func, min_reconnect_interval=0)
+        self.addCleanup(self.monitor.stop)
+        self.channel = mock.Mock()
+        self.monitor.watch(self.channel)
+
+    def _set_state(self, channel, state):
+        callback = channel.subscribe.call_args[0][0]
+        callback(state)
+
+    def test_transitions_counted(self):
+        for state in (grpc.ChannelConnectivity.CONNECTING, grpc.ChannelConnectivity.READY,
+                      grpc.ChannelConnectivity.READY, grpc.ChannelConnectivity.IDLE):
+            self._set_state(self.channel, state)
+        stats = self.monitor.stats()
+        self.assertEqual(stats["channel_state"], "IDLE")
+        self.assertEqual(stats["channel_ready_count"], 1)
+        self.assertEqual(len(self.monitor.transitions), 3)
+
+    def test_failure_reconnects(self):
+        self._set_state(self.channel, grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self.assertTrue(self.reconnected.wait(5))
+        self.reconnect_func.assert_called_once_with(self.channel)
+        self.assertEqual(self.monitor.stats()["channel_reconnects"], 1)
+
+    def test_replaced_channel_ignored(self):
+        new_channel = mock.Mock()
+        self.monitor.watch(new_channel)
+        self.channel.unsubscribe.assert_called_once_with(self.channel.subscribe.call_args[0][0])
+        self._set_state(self.channel, grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self.assertIsNone(self.monitor.state)
@@ -0,0 +1,58 @@
+import unittest
+
+import mock
+
+from pydcomm.rpc.channel_pool import GRpcChannelPool
+from pydcomm.tests.helpers import TestCasePatcher
+
+
+class UnitTestGRpcChannelPool(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.patcher = TestCasePatcher(self)
+        self.mock_insecure_channel = self.patcher.addPatch("grpc.insecure_channel")
+        self.mock_insecure_channel.side_effect = lambda *args, **kwargs: mock.Mock()
+        self.mock_time = self.patcher.addPatch("pydcomm.rpc.channel_pool.time.time")
+        self.mock_time.return_value = 1000.
+        self.pool = GRpcChannelPool(idle_timeout=60)
+
+    def test_same_address_shares_channel(self):
+        channel = self.pool.acquire("localhost:29999")
+        self.assertIs(self.pool.acquire("localhost:29999"), channel)
+        self.assertIsNot(self.pool.acquire("localhost:30000"), channel)
+        self.assertIsNot(self.pool.acquire("localhost:29999", [("opt", 1)]), channel)
+        self.assertEqual(self.mock_insecure_channel.call_count, 3)
+
+    def test_idle_channel_evicted(self):
+        channel = self.pool.acquire("localhost:29999")
+        self.pool.release(channel)
+        self.mock_time.return_value += 30
+        self.assertIs(self.pool.acquire("localhost:29999"), channel)
+        self.pool.release(channel)
+        self.mock_time.return_value += 61
+        self.assertIsNot(self.pool.acquire("localhost:29999"), channel)
+        channel.close.assert_called_once_with()
+
+    def test_channel_in_use_not_evicted(self):
+        channel = self.pool.acquire("localhost:29999")
+        self.mock_time.return_value += 1000
+        self.assertIs(self.pool.acquire("localhost:29999"), channel)
+        self.assertFalse(channel.close.called)
+
+    def test_invalidated_channel_closed_when_released(self):
+        channel = self.pool.acquire("localhost:29999")
+        self.pool.acquire("localhost:29999")
+        self.pool.invalidate(channel)
+        self.assertIsNot(self.pool.acquire("localhost:29999"), channel)
+        self.assertFalse(channel.close.called)
+        self.pool.release(channel)
+        channel.close.assert_called_once_with()
+        self.assertEqual(len(self.pool), 1)
+
+    def test_stripes_spread_concurrent_users(self):
+        self.pool = GRpcChannelPool(stripes=2)
+        channels = [self.pool.acquire("localhost:29999") for _ in range(4)]
+        self.assertEqual(len(set(channels)), 2)
+        self.assertEqual(channels.count(channels[0]), 2)
@@ -0,0 +1,206 @@
+import errno
+import os
+import shutil
+import socket
+import tempfile
+import time
+import unittest
+
+import mock
+import subprocess32 as subprocess
+from nose.tools import assert_raises
+
+from pydcomm.general_android.connection.adb_host_client import AdbHostClient, AdbHostProtocolUnsupported
+from pydcomm.general_android.connection.internal_adb_connection import InternalAdbConnection
+from pydcomm.public.iconnection import CommandFailedError
+from pydcomm.tests.connection.fake_adb_server import FakeAdbServer
+
+WIRED_MODULE_NAME = "pydcomm.general_android.connection.internal_adb_connection"
+
+
+def _shell(command):
+    if command == "echo hi":
+        return "hi\n", "", 0
+    if command.startswith("ls "):
+        return "", "ls: {}: No such file or directory\n".format(command[3:]), 1
+    if command == "sleep 10":
+        time.sleep(10)
+    return command + "\n", "", 0
+
+
+class AdbHostClientTests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer(serials=["avocado", "10.0.0.101:5555"], shell_handler=_shell).start()
+        self.addCleanup(self.server.stop)
+        self.client = AdbHostClient(port=self.server.port)
+        self.tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tmp_dir)
+
+    # region shell
+
+    def test_shell__command_succeeds__returns_stdout(self):
+        self.assertEqual(self.client.run(["-s", "avocado", "shell", "echo", "hi"]), "hi\n")
+        self.assertEqual(self.server.requests, ["host:transport:avocado", "shell,v2,raw:echo hi"])
+
+    def test_shell__command_fails__raises_with_exit_code_and_stderr(self):
+        with assert_raises(CommandFailedError) as e:
+            self.client.run(["-s", "avocado", "shell", "ls /nothing"])
+
+        self.assertEqual(e.exception.returncode, 1)
+        self.assertIn("No such file or directory", e.exception.stderr)
+
+    def test_shell__no_shell_protocol__falls_back_to_legacy_shell(self):
+        self.server.shell_v2 = False
+
+        self.assertEqual(self.client.run(["-s", "avocado", "shell", "echo hi"]), "hi\r\n")
+        self.assertEqual(self.client.run(["-s", "avocado", "shell", "echo hi"]), "hi\r\n")
+        self.assertEqual(self.server.requests.count("shell,v2,raw:echo hi"), 1)
+
+    def test_shell__connection_lost__falls_back_without_remembering(self):
+        self.server.shell_v2_drops = 1
+
+        self.assertEqual(self.client.run(["-s", "avocado", "shell", "echo hi"]), "hi\r\n")
+        self.assertEqual(self.client.run(["-s", "avocado", "shell", "echo hi"]), "hi\n")
+        self.assertEqual(self.server.requests.count("shell,v2,raw:echo hi"), 2)
+
+    def test_shell__unknown_device__raises(self):
+        with assert_raises(CommandFailedError) as e:
+            self.client.run(["-s", "banana", "shell", "echo hi"])
+
+        self.assertIn("device 'banana' not found", e.exception.stderr)
+
+    def test_shell__no_device_given__uses_any_device(self):
+        self.client.run(["shell", "echo hi"])
+
+        self.assertEqual(self.server.requests[0], "host:transport-any")
+
+    def test_shell__timeout__raises_timeout_expired(self):
+        with assert_raises(subprocess.TimeoutExpired):
+            self.client.run(["-s", "avocado", "shell", "sleep 10"], timeout=0.2)
+
+    # endregion
+
+    # region sync
+
+    def test_push_pull__file__round_trips(self):
+        local_path = os.path.join(self.tmp_dir, "data.bin")
+        content = os.urandom(200 * 1024)
+        with open(local_path, "wb") as f:
+            f.write(content)
+
+        output = self.client.run(["-s", "avocado", "push", local_path, "/sdcard/tmp/"])
+        self.assertRegexpMatches(output, "1 file pushed")
+        self.assertEqual(self.server.files["/sdcard/tmp/data.bin"], content)
+
+        output = self.client.run(["-s", "avocado", "pull", "/sdcard/tmp/data.bin", self.tmp_dir + "/pulled.bin"])
+        self.assertRegexpMatches(output, "1 file pulled")
+        with open(os.path.join(self.tmp_dir, "pulled.bin"), "rb") as f:
+            self.assertEqual(f.read(), content)
+
+    def test_push__existing_directory_without_slash__pushes_into_it(self):
+        local_path = os.path.join(self.tmp_dir, "data.bin")
+        with open(local_path, "wb") as f:
+            f.write("data")
+        self.server.dirs.add("/sdcard/tmp")
+
+        self.client.run(["-s", "avocado", "push", local_path, "/sdcard/tmp"])
+
+        self.assertEqual(self.server.files, {"/sdcard/tmp/data.bin": "data"})
+
+    def test_push__read_only_path__raises_with_adb_error(self):
+        local_path = os.path.join(self.tmp_dir, "data.bin")
+        open(local_path, "w").close()
+
+        with assert_raises(CommandFailedError) as e:
+            self.client.run(["-s", "avocado", "push", local_path, "/system/data.bin"])
+
+        self.assertIn("Read-only file system", e.exception.stderr)
+
+    def test_pull__missing_file__raises_with_adb_error(self):
+        with assert_raises(CommandFailedError) as e:
+            self.client.run(["-s", "avocado", "pull", "/sdcard/nothing", self.tmp_dir])
+
+        self.assertIn("No such file or directory", e.exception.stderr)
+
+    def test_pull__transfer_fails__no_partial_file(self):
+        self.server.files["/sdcard/data.bin"] = os.urandom(200 * 1024)
+        self.server.failing_reads.add("/sdcard/data.bin")
+        local_path = os.path.join(self.tmp_dir, "pulled.bin")
+
+        with assert_raises(CommandFailedError) as e:
+            self.client.run(["-s", "avocado", "pull", "/sdcard/data.bin", local_path])
+
+        self.assertIn("Input/output error", e.exception.stderr)
+        self.assertFalse(os.path.exists(local_path))
+
+    def test_pull__connection_reset_during_transfer__raises_command_failed(self):
+        self.server.files["/sdcard/data.bin"] = os.urandom(200 * 1024)
+        self.server.resetting_reads.add("/sdcard/data.bin")
+        local_path = os.path.join(self.tmp_dir, "pulled.bin")
+
+        with assert_raises(CommandFailedError) as e:
+            self.client.run(["-s", "avocado", "pull", "/sdcard/data.bin", local_path])
+
+        self.assertIn("adb server connection failed", str(e.exception))
+        self.assertFalse(os.path.exists(local_path))
+
+    def test_pull__directory__unsupported(self):
+        self.server.dirs.add("/sdcard/tmp")
+
+        with assert_raises(AdbHostProtocolUnsupported):
+            self.client.run(["-s", "avocado", "pull", "/sdcard/tmp", self.tmp_dir])
+
+    # endregion
+
+    # region host services
+
+    def test_devices__returns_devices_list(self):
+        self.assertEqual(self.client.run(["devices"]),
+                         "List of devices attached\navocado\tdevice\n10.0.0.101:5555\tdevice\n")
+
+    def test_connect__returns_server_message(self):
+        self.assertEqual(self.client.run(["connect", "10.0.0.101:5555"]), "connected to 10.0.0.101:5555")
+
+    def test_run__unsupported_command__raises_unsupported(self):
+        with assert_raises(AdbHostProtocolUnsupported):
+            self.client.run(["-s", "avocado", "reboot"])
+
+    def test_run__server_not_running__raises_unsupported(self):
+        sock = socket.socket()
+        sock.bind(("localhost", 0))
+        port = sock.getsockname()[1]
+        sock.close()
+
+        with assert_raises(AdbHostProtocolUnsupported):
+            AdbHostClient(port=port).run(["devices"])
+
+    def test_run__connection_reset_before_command_started__raises_unsupported(self):
+        with mock.patch.object(AdbHostClient, "_request", side_effect=socket.error(errno.ECONNRESET, "reset")):
+            with assert_raises(AdbHostProtocolUnsupported):
+                self.client.run(["-s", "avocado", "shell", "echo hi"])
+
+    # endregion
+
+
+class InternalAdbConnectionHostClientTests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer(shell_handler=_shell).start()
+        self.addCleanup(self.server.stop)
+
+    @mock.patch(WIRED_MODULE_NAME + ".subprocess.Popen")
+    def test_adb__host_client__runs_without_adb_binary(self, mock_popen):
+        con = InternalAdbConnection(device_id="avocado", adb_client=AdbHostClient(port=self.server.port))
+
+        self.assertEqual(con.adb("shell echo hi"), "hi")
+        mock_popen.assert_not_called()
+
+    @mock.patch(WIRED_MODULE_NAME + ".subprocess.Popen")
+    def test_adb__unsupported_command__runs_adb_binary(self, mock_popen):
+        mock_popen.return_value.communicate.return_value = "", ""
+        mock_popen.return_value.returncode = 0
+        con = InternalAdbConnection(device_id="avocado", adb_client=AdbHostClient(port=self.server.port))
+
+        con.adb("reboot", disable_fixers=True)
+
+        mock_popen.assert_called_once_with(["adb", "-s", "avocado", "reboot"], stderr=subprocess.PIPE,
+                                           stdout=subprocess.PIPE)
@@ -0,0 +1,110 @@
+import unittest
+
+import mock
+
+from pydcomm.general_android.connection.adb_rate_limiter import AdbRateLimiter, TokenBucket
+from pydcomm.general_android.connection.internal_adb_connection import InternalAdbConnection
+
+LIMITER_MODULE_NAME = "pydcomm.general_android.connection.adb_rate_limiter"
+WIRED_MODULE_NAME = "pydcomm.general_android.connection.internal_adb_connection"
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 1000.
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class AdbRateLimiterTests(unittest.TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        patcher = mock.patch(LIMITER_MODULE_NAME + ".time", self.clock)
+        self.addCleanup(patcher.stop)
+        patcher.start()
+
+    def test_wait__shell_commands__not_limited(self):
+        limiter = AdbRateLimiter(min_interval=0.5)
+
+        for _ in range(10):
+            limiter.wait(["-s", "avocado", "shell", "echo", "hi"])
+
+        self.assertEqual(self.clock.now, 1000.)
+
+    def test_wait__racy_commands__spaced_by_min_interval(self):
+        limiter = AdbRateLimiter(min_interval=0.5)
+
+        limiter.wait(["disconnect", "10.0.0.101:5555"])
+        limiter.wait(["connect", "10.0.0.101:5555"])
+        limiter.wait(["-s", "avocado", "root"])
+
+        self.assertAlmostEqual(self.clock.now, 1001.)
+
+    def test_wait__released_commands__spaced_from_their_end(self):
+        limiter = AdbRateLimiter(min_interval=0.5)
+
+        limiter.wait(["disconnect", "10.0.0.101:5555"])
+        self.clock.now += 2  # The command runs
+        limiter.release(["disconnect", "10.0.0.101:5555"])
+        limiter.wait(["connect", "10.0.0.101:5555"])
+
+        self.assertAlmostEqual(self.clock.now, 1002.5)
+
+    def test_wait__no_racy_commands_given__limits_all_commands(self):
+        limiter = AdbRateLimiter(min_interval=0.5, racy_commands=None)
+
+        limiter.wait(["shell", "echo hi"])
+        limiter.wait(["shell", "echo hi"])
+
+        self.assertAlmostEqual(self.clock.now, 1000.5)
+
+    def test_token_bucket__burst__allows_burst_then_refill_rate(self):
+        bucket = TokenBucket(interval=1, burst=3)
+
+        for _ in range(3):
+            bucket.acquire()
+        self.assertEqual(self.clock.now, 1000.)
+
+        bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 1001.)
+
+    def test_token_bucket__idle__refills_up_to_burst(self):
+        bucket = TokenBucket(interval=1, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+
+        self.clock.now += 100
+        for _ in range(2):
+            bucket.acquire()
+        self.assertEqual(self.clock.now, 1100.)
+
+        bucket.acquire()
+        self.assertAlmostEqual(self.clock.now, 1101.)
+
+    def test_token_bucket__waiting__doesnt_hold_lock(self):
+        bucket = TokenBucket(interval=1)
+        bucket.acquire()
+
+        def sleep(seconds):
+            self.assertFalse(bucket._lock.locked())
+            self.clock.now += seconds
+        with mock.patch.object(self.clock, "sleep", side_effect=sleep) as mock_sleep:
+            bucket.acquire()
+
+        mock_sleep.assert_called_once_with(1.)
+
+    @mock.patch(WIRED_MODULE_NAME + ".subprocess.Popen")
+    def test_adb__custom_limiter__used_by_connection(self, mock_popen):
+        mock_popen.return_value.communicate.return_value = "hi", ""
+        mock_popen.return_value.returncode = 0
+        limiter = mock.Mock(spec=AdbRateLimiter)
+
+        con = InternalAdbConnection(device_id="avocado", rate_limiter=limiter)
+        con.adb("kill-server", specific_device=False)
+
+        limiter.wait.assert_called_with(["kill-server"])
+        limiter.release.assert_called_with(["kill-server"])
@@ -0,0 +1,228 @@
+"""
+Stand-in for the adb server and a device behind it, speaking the adb server's protocol on a local port.
+"""
+import SocketServer
+import os
+import signal
+import socket
+import stat
+import struct
+import threading
+
+import subprocess32 as subprocess
+
+from pydcomm.general_android.connection.adb_host_client import SHELL_PACKET_HEADER, SHELL_ID_STDIN, \
+    SHELL_ID_STDOUT, SHELL_ID_STDERR, SHELL_ID_EXIT, SHELL_ID_CLOSE_STDIN, SYNC_HEADER, SYNC_STAT
+
+
+class FakeAdbServer(SocketServer.ThreadingTCPServer):
+    """
+    Fake adb server with the devices `serials`.
+
+    Shell commands are answered by `shell_handler`, a function of the command line returning its stdout, stderr and
+    exit code. Interactive shells through the shell protocol run a local sh. Files are kept in the `files` dict by
+    path, directories are the paths in `dirs`, and pulling the paths in `failing_reads` fails after their first chunk.
+    Pulling the paths in `resetting_reads` resets the connection after their first chunk, like when the server dies.
+    Requests received are recorded in `requests`.
+
+    Without `shell_v2`, shell protocol requests fail like with an old adbd. The next `shell_v2_drops` shell protocol
+    requests are dropped without an answer, like when the connection is lost.
+    """
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, serials=("avocado",), shell_handler=None, shell_v2=True):
+        SocketServer.ThreadingTCPServer.__init__(self, ("localhost", 0), _FakeAdbHandler)
+        self.serials = list(serials)
+        self.shell_handler = shell_handler or (lambda command: ("", "", 0))
+        self.shell_v2 = shell_v2
+        self.shell_v2_drops = 0
+        self.files = {}
+        self.dirs = set()
+        self.failing_reads = set()
+        self.resetting_reads = set()
+        self.requests = []
+        self._thread = threading.Thread(target=self.serve_forever, args=(0.05,))
+        self._thread.daemon = True
+
+    @property
+    def port(self):
+        return self.server_address[1]
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class _FakeAdbHandler(SocketServer.BaseRequestHandler):
+    def handle(self):
+        serial = None
+        while True:
+            length = self._recv(4)
+            if not length:
+                return
+            request = self._recv(int(length, 16))
+            self.server.requests.append(request)
+
+            if request == "host:version":
+                self._okay_with_data("0029")
+            elif request == "host:devices":
+                self._okay_with_data("".join("{}\tdevice\n".format(s) for s in self.server.serials))
+            elif request.startswith("host:connect:"):
+                self._okay_with_data("connected to " + request[len("host:connect:"):])
+            elif request.startswith("host:disconnect:"):
+                self._okay_with_data("disconnected " + request[len("host:disconnect:"):])
+            elif request == "host:kill":
+                self.request.sendall("OKAY")
+                return
+            elif request.startswith("host:transport"):
+                serial = request.split(":", 2)[2] if ":" in request[len("host:"):] else self.server.serials[0]
+                if serial not in self.server.serials:
+                    return self._fail("device '{}' not found".format(serial))
+                self.request.sendall("OKAY")
+            elif serial is None:
+                return self._fail("unknown host service")
+            elif request.startswith("shell,v2,raw:"):
+                if not self.server.shell_v2:
+                    return self._fail("closed")  # Old adbd closes unknown services
+                if self.server.shell_v2_drops:
+                    self.server.shell_v2_drops -= 1
+                    return
+                self.request.sendall("OKAY")
+                command = request.split(":", 1)[1]
+                return self._shell_v2(command) if command else self._interactive_shell_v2()
+            elif request.startswith("shell:"):
+                self.request.sendall("OKAY")
+                stdout, stderr, _ = self.server.shell_handler(request.split(":", 1)[1])
+                self.request.sendall((stdout + stderr).replace("\n", "\r\n"))
+                return
+            elif request == "sync:":
+                self.request.sendall("OKAY")
+                return self._sync()
+            else:
+                return self._fail("unknown service")
+
+    def _shell_v2(self, command):
+        stdout, stderr, exit_code = self.server.shell_handler(command)
+        for packet_id, data in ((SHELL_ID_STDOUT, stdout), (SHELL_ID_STDERR, stderr)):
+            if data:
+                self.request.sendall(SHELL_PACKET_HEADER.pack(packet_id, len(data)) + data)
+        self.request.sendall(SHELL_PACKET_HEADER.pack(SHELL_ID_EXIT, 1) + chr(exit_code))
+
+    def _interactive_shell_v2(self):
+        shell = subprocess.Popen(["sh"], stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                                 start_new_session=True)
+        send_lock = threading.Lock()
+
+        def forward(packet_id, stream):
+            for data in iter(lambda: os.read(stream.fileno(), 4096), ""):
+                with send_lock:
+                    try:
+                        self.request.sendall(SHELL_PACKET_HEADER.pack(packet_id, len(data)) + data)
+                    except socket.error:
+                        pass  # The client closed the connection
+
+        def send_exit_code():
+            forwarders = [threading.Thread(target=forward, args=args)
+                          for args in ((SHELL_ID_STDOUT, shell.stdout), (SHELL_ID_STDERR, shell.stderr))]
+            for forwarder in forwarders:
+                forwarder.start()
+            for forwarder in forwarders:
+                forwarder.join()
+            try:
+                with send_lock:
+                    self.request.sendall(SHELL_PACKET_HEADER.pack(SHELL_ID_EXIT, 1) + chr(shell.wait() & 0xff))
+                self.request.shutdown(socket.SHUT_RDWR)  # Stop reading stdin
+            except socket.error:
+                pass
+
+        waiter = threading.Thread(target=send_exit_code)
+        waiter.start()
+        try:
+            while True:
+                header = self._recv(SHELL_PACKET_HEADER.size)
+                if len(header) < SHELL_PACKET_HEADER.size:
+                    break
+                packet_id, length = SHELL_PACKET_HEADER.unpack(header)
+                data = self._recv(length)
+                if packet_id == SHELL_ID_STDIN:
+                    shell.stdin.write(data)
+                    shell.stdin.flush()
+                elif packet_id == SHELL_ID_CLOSE_STDIN:
+                    break
+        except (IOError, socket.error):
+            pass  # The shell exited, or the client closed the connection
+        if shell.poll() is None:
+            os.killpg(shell.pid, signal.SIGKILL)  # With the commands it's running
+        waiter.join()
+
+    def _sync(self):
+        files = self.server.files
+        while True:
+            header = self._recv(SYNC_HEADER.size)
+            if not header:
+                return
+            message_id, length = SYNC_HEADER.unpack(header)
+            data = self._recv(length)
+            if message_id == "QUIT":
+                return
+            elif message_id == "STAT":
+                if data in self.server.dirs:
+                    mode = stat.S_IFDIR | 0755
+                elif data in files:
+                    mode = stat.S_IFREG | 0644
+                else:
+                    mode = 0
+                self.request.sendall(SYNC_STAT.pack("STAT", mode, len(files.get(data, "")), 0))
+            elif message_id == "SEND":
+                path = data.rsplit(",", 1)[0]
+                chunks = []
+                while True:
+                    message_id, length = SYNC_HEADER.unpack(self._recv(SYNC_HEADER.size))
+                    if message_id == "DONE":
+                        break
+                    chunks.append(self._recv(length))
+                if path.startswith("/system/"):
+                    self._sync_fail("couldn't create file: Read-only file system")
+                else:
+                    files[path] = "".join(chunks)
+                    self.request.sendall(SYNC_HEADER.pack("OKAY", 0))
+            elif message_id == "RECV":
+                if data not in files:
+                    self._sync_fail("No such file or directory")
+                    continue
+                content = files[data]
+                for i in range(0, len(content), 64 * 1024):
+                    chunk = content[i:i + 64 * 1024]
+                    self.request.sendall(SYNC_HEADER.pack("DATA", len(chunk)) + chunk)
+                    if data in self.server.failing_reads:
+                        self._sync_fail("Input/output error")
+                        break
+                    if data in self.server.resetting_reads:
+                        self.request.setsockopt(socket.SOL_SOCKET, socket.SO_LINGER, struct.pack("ii", 1, 0))
+                        self.request.close()  # Sends RST
+                        return
+                else:
+                    self.request.sendall(SYNC_HEADER.pack("DONE", 0))
+
+    def _okay_with_data(self, data):
+        self.request.sendall("OKAY{:04x}{}".format(len(data), data))
+
+    def _fail(self, message):
+        self.request.sendall("FAIL{:04x}{}".format(len(message), message))
+
+    def _sync_fail(self, message):
+        self.request.sendall(SYNC_HEADER.pack("FAIL", len(message)) + message)
+
+    def _recv(self, size):
+        data = ""
+        while len(data) < size:
+            buf = self.request.recv(size - len(data))
+            if not buf:
+                return data
+            data += buf
+        return data
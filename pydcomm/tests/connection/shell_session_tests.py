@@ -0,0 +1,94 @@
+import unittest
+
+import subprocess32 as subprocess
+from nose.tools import assert_raises
+
+from pydcomm.general_android.connection.adb_host_client import AdbHostClient
+from pydcomm.general_android.connection.internal_adb_connection import InternalAdbConnection
+from pydcomm.general_android.connection.shell_session import ShellSession, AdbProcessShell, ShellSessionClosedError
+from pydcomm.public.iconnection import CommandFailedError
+from pydcomm.tests.connection.fake_adb_server import FakeAdbServer
+
+
+class ShellSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.opened = 0
+        self.session = ShellSession(self._open_shell)
+        self.addCleanup(self.session.close)
+
+    def _open_shell(self):
+        self.opened += 1
+        return AdbProcessShell(["sh"])
+
+    def test_run__commands__output_of_each_command(self):
+        self.assertEqual(self.session.run("echo hi"), "hi\n")
+        self.assertEqual(self.session.run("printf 'no newline'"), "no newline")
+        self.assertEqual(self.session.run("true"), "")
+        self.assertEqual(self.opened, 1)
+
+    def test_run__command_fails__raises_with_exit_code_and_stderr(self):
+        with assert_raises(CommandFailedError) as e:
+            self.session.run("echo out; echo err >&2; exit 3")
+
+        self.assertEqual(e.exception.returncode, 3)
+        self.assertEqual(e.exception.stdout, "out\n")
+        self.assertEqual(e.exception.stderr, "err\n")
+        self.assertEqual(self.session.run("echo hi"), "hi\n")
+        self.assertEqual(self.opened, 1)
+
+    def test_run__command_changes_environment__next_command_unaffected(self):
+        self.session.run("cd /tmp; FOO=bar")
+
+        self.assertEqual(self.session.run("echo $FOO"), "\n")
+        self.assertNotEqual(self.session.run("pwd"), "/tmp\n")
+
+    def test_run__timeout__next_command_runs_in_new_shell(self):
+        with assert_raises(subprocess.TimeoutExpired):
+            self.session.run("sleep 1", timeout=0.1)
+
+        self.assertEqual(self.session.run("echo hi"), "hi\n")
+        self.assertEqual(self.opened, 2)
+
+    def test_run__shell_exits__raises_closed_then_reopens(self):
+        with assert_raises(ShellSessionClosedError):
+            self.session.run("kill -9 $$")
+
+        self.assertEqual(self.session.run("echo hi"), "hi\n")
+        self.assertEqual(self.opened, 2)
+
+    def test_run__shell_without_stderr__stderr_in_stdout(self):
+        session = ShellSession(lambda: AdbProcessShell(["sh", "-c", "exec sh 2>&1"]))  # Like on old devices
+        self.addCleanup(session.close)
+
+        with assert_raises(CommandFailedError) as e:
+            session.run("echo out; echo err >&2; exit 3", timeout=5)
+
+        self.assertEqual(e.exception.returncode, 3)
+        self.assertEqual(e.exception.stdout, "out\nerr\n")
+        self.assertEqual(e.exception.stderr, "")
+        self.assertEqual(session.run("echo hi", timeout=5), "hi\n")
+
+
+class HostShellSessionTests(unittest.TestCase):
+    def setUp(self):
+        self.server = FakeAdbServer().start()
+        self.addCleanup(self.server.stop)
+        self.client = AdbHostClient(port=self.server.port)
+
+    def test_run__shell_protocol__output_and_exit_code(self):
+        session = ShellSession(lambda: self.client.open_shell("avocado"))
+        self.addCleanup(session.close)
+
+        self.assertEqual(session.run("echo hi"), "hi\n")
+        with assert_raises(CommandFailedError) as e:
+            session.run("echo err >&2; false")
+        self.assertEqual(e.exception.stderr, "err\n")
+
+    def test_adb__persistent_shell__commands_share_one_shell(self):
+        con = InternalAdbConnection(device_id="avocado", adb_client=self.client, persistent_shell=True)
+        self.addCleanup(con.disconnect)
+
+        self.assertEqual(con.adb("shell echo hello"), "hello")
+        self.assertEqual(con.adb(["shell", "echo", "a", "b"]), "a b")
+
+        self.assertEqual([r for r in self.server.requests if r.startswith("shell")], ["shell,v2,raw:"])
@@ -0,0 +1,96 @@
+import time
+import unittest
+from threading import Timer
+
+import subprocess32 as subprocess
+from nose.tools import assert_raises
+
+from pydcomm.general_android.connection.adb_host_client import AdbHostClient
+from pydcomm.general_android.connection.internal_adb_connection import InternalAdbConnection
+from pydcomm.general_android.connection.shell_session import AdbProcessShell, MAX_BUFFERED_PACKETS
+from pydcomm.general_android.connection.streaming_shell import StreamingShell
+from pydcomm.tests.connection.fake_adb_server import FakeAdbServer
+
+
+def _streaming_sh(command, **kwargs):
+    return StreamingShell(AdbProcessShell(["sh", "-c", command]), **kwargs)
+
+
+class StreamingShellTests(unittest.TestCase):
+    def test_iterate__command_exits__all_lines(self):
+        lines = _streaming_sh("echo a; echo err >&2; printf 'b\\r\\nc'; exit 3")
+
+        self.assertEqual(list(lines), ["a", "b", "c"])
+        self.assertEqual(lines.returncode, 3)
+        self.assertEqual(lines.stderr, "err\n")
+
+    def test_iterate__command_running__lines_available_before_it_exits(self):
+        lines = _streaming_sh("echo first; exec sleep 10")
+        start = time.time()
+
+        self.assertEqual(next(lines), "first")
+        self.assertLess(time.time() - start, 5)
+
+        lines.stop()
+        self.assertEqual(list(lines), [])
+        self.assertTrue(lines.wait(5))
+
+    def test_iterate__timeout__raises_after_lines_read(self):
+        lines = _streaming_sh("echo a; sleep 10", timeout=0.3)
+
+        self.assertEqual(next(lines), "a")
+        with assert_raises(subprocess.TimeoutExpired):
+            next(lines)
+        self.assertTrue(lines.timed_out)
+
+    def test_iterate__slow_consumer__buffer_bounded(self):
+        lines = _streaming_sh("i=0; while [ $i -lt 500 ]; do echo $i; i=$((i+1)); done", max_buffered_lines=10)
+        time.sleep(0.3)
+
+        self.assertLessEqual(lines._lines.qsize(), 10)
+        self.assertFalse(lines.wait(0))
+        self.assertEqual(list(lines), [str(i) for i in range(500)])
+
+    def test_iterate__slow_consumer__shell_output_buffer_bounded(self):
+        # 4MB of output, more than the buffers of the lines, the shell's packets and the pipe together
+        lines = _streaming_sh("yes {} | head -n 4000".format("x" * 999), max_buffered_lines=10)
+        time.sleep(0.5)
+
+        self.assertLessEqual(lines._shell._packets.qsize(), MAX_BUFFERED_PACKETS)
+        self.assertIsNone(lines._shell._process.poll())
+        self.assertEqual(sum(1 for _ in lines), 4000)
+        self.assertEqual(lines.returncode, 0)
+
+    def test_iterate__timeout_while_buffer_full__command_killed(self):
+        lines = _streaming_sh("exec yes", timeout=0.3, max_buffered_lines=10)
+        time.sleep(1)
+
+        self.assertTrue(lines.timed_out)
+        self.assertIsNotNone(lines._shell._process.poll())
+        self.assertEqual([next(lines) for _ in range(10)], ["y"] * 10)
+        with assert_raises(subprocess.TimeoutExpired):
+            next(lines)
+        self.assertTrue(lines.wait(5))
+
+    def test_stop__from_another_thread__ends_waiting_iteration(self):
+        lines = _streaming_sh("sleep 10")
+        start = time.time()
+        stopper = Timer(0.2, lines.stop)
+        stopper.start()
+
+        self.assertEqual(list(lines), [])
+        self.assertLess(time.time() - start, 5)
+
+
+class HostStreamingShellTests(unittest.TestCase):
+    def test_streaming_shell__host_client__lines_of_command(self):
+        server = FakeAdbServer(shell_handler=lambda command: ("hi\n" if command == "echo hi" else "a\nb\n", "", 0))
+        server.start()
+        self.addCleanup(server.stop)
+        con = InternalAdbConnection(device_id="avocado", adb_client=AdbHostClient(port=server.port))
+
+        with con.streaming_shell("logcat") as lines:
+            self.assertEqual(list(lines), ["a", "b"])
+
+        self.assertEqual(lines.returncode, 0)
+        self.assertIn("shell,v2,raw:logcat", server.requests)
@@ -1,4 +1,7 @@
 import datetime
+import os
+import shutil
+import subprocess
 import tempfile
 import unittest
 from textwrap import dedent
@@ -348,3 +351,42 @@ class UnitTestDeviceUtils(unittest.TestCase):
         self.assertFalse(self.device_utils.is_max_volume())
 
     # endregion
+
+    # region ShellBatch unit tests
+
+    def _run_adb_with_local_shell(self, command, timeout=None):
+        self.assertEqual(command[0], "shell")
+        return subprocess.check_output(["sh", "-c", " ".join(command[1:])]).strip("\r\n")
+
+    def test_batch_results_and_errors(self):
+        self.conn.adb.side_effect = self._run_adb_with_local_shell
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        new_dir = os.path.join(tmp_dir, "new")
+
+        results = self.device_utils.batch() \
+            .mkdir(new_dir) \
+            .mkdir(new_dir) \
+            .touch_file(os.path.join(tmp_dir, "nothing", "file")) \
+            .shell("printf", "out;", "echo", "err", ">&2;", "exit", "4") \
+            .shell("echo", "last") \
+            .execute()
+
+        self.assertEqual(self.conn.adb.call_count, 1)
+        self.assertTrue(os.path.isdir(new_dir))
+        self.assertIsNone(results[0].get())
+        self.assertRaises(FileAlreadyExists, results[1].get)
+        self.assertRaises(RemoteFileNotFound, results[2].get)
+        self.assertEqual((results[3].stdout, results[3].stderr, results[3].returncode), ("out", "err\n", 4))
+        self.assertRaises(CommandFailedError, results[3].get)
+        self.assertEqual(results[4].get(), "last")
+
+    def test_batch_empty(self):
+        self.assertEqual(self.device_utils.batch().execute(), [])
+        self.conn.adb.assert_not_called()
+
+    def test_batch_unparsable_output(self):
+        self.conn.adb.return_value = "error: closed"
+        self.assertRaises(AndroidDeviceUtilsError, self.device_utils.batch().get_prop("ro.build.id").execute)
+
+    # endregion
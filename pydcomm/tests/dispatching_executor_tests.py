@@ -0,0 +1,118 @@
+import unittest
+from threading import Event, Lock, Thread
+
+from pydcomm.rpc._marshallers import Marshaller, cbor_marshal, cbor_unmarshal, create_default_registry
+from pydcomm.rpc.dispatching_executor import DispatchingExecutor, procedure
+
+CBOR = Marshaller("cbor", cbor_marshal, cbor_unmarshal, ())
+REGISTRY = create_default_registry()
+
+
+class RecorderExecutor(DispatchingExecutor):
+    def __init__(self):
+        super(RecorderExecutor, self).__init__()
+        self.release = Event()
+        self.lock = Lock()
+        self.running = self.max_running = 0
+
+    def get_version(self):
+        return "1.0"
+
+    @procedure()
+    def get_status(self, params):
+        return "idle"
+
+    @procedure("sum", marshaller=CBOR)
+    def sum_values(self, params):
+        return sum(params)
+
+    @procedure("sum_any", marshaller=REGISTRY)
+    def sum_any(self, params):
+        return sum(params)
+
+    @procedure("wait", max_concurrency=1)
+    def wait(self, params):
+        with self.lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+        self.release.wait()
+        with self.lock:
+            self.running -= 1
+        return params
+
+    @procedure("fail")
+    def fail(self, params):
+        raise ValueError("bad params")
+
+    @procedure("echo", marshaller=CBOR, streaming=True)
+    def echo(self, params, it):
+        yield params
+        for value in it:
+            yield value
+
+
+class SubRecorderExecutor(RecorderExecutor):
+    def get_status(self, params):
+        return "busy"
+
+
+class UnitTestDispatchingExecutor(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.executor = RecorderExecutor()
+
+    # region DispatchingExecutor unit tests
+
+    def test_dispatch_table_built_at_class_creation(self):
+        self.assertEqual(sorted(RecorderExecutor.procedures), ["echo", "fail", "get_status", "sum", "sum_any", "wait"])
+        self.assertEqual(RecorderExecutor.procedures["sum"].method_name, "sum_values")
+
+    def test_marshalled_call(self):
+        self.assertEqual(cbor_unmarshal(self.executor.execute_procedure("sum", cbor_marshal([1, 2, 3]))), 6)
+
+    def test_registry_answers_in_accepted_content_type(self):
+        ret = self.executor.execute_procedure("sum_any", REGISTRY.pack([1, 2, 3], content_type="cbor"))
+        self.assertEqual(REGISTRY.unpack(ret)[0], 6)
+
+    def test_streaming_call(self):
+        values = self.executor.execute_streaming_procedure("echo", cbor_marshal("a"), iter([cbor_marshal(1)]))
+        self.assertEqual(map(cbor_unmarshal, values), ["a", 1])
+
+    def test_unknown_procedure(self):
+        with self.assertRaises(ValueError):
+            self.executor.execute_procedure("missing", "")
+        with self.assertRaises(ValueError):
+            self.executor.execute_procedure("echo", "")
+
+    def test_reserved_name_rejected(self):
+        with self.assertRaises(ValueError):
+            procedure("_rpc_get_version")(lambda self, params: "")
+
+    def test_overridden_method_dispatched(self):
+        self.assertEqual(SubRecorderExecutor().execute_procedure("get_status", ""), "busy")
+
+    def test_stats(self):
+        self.executor.execute_procedure("get_status", "")
+        with self.assertRaises(ValueError):
+            self.executor.execute_procedure("fail", "")
+        stats = self.executor.stats()
+        self.assertEqual(stats["procedure_get_status_calls"], 1)
+        self.assertEqual(stats["procedure_get_status_errors"], 0)
+        self.assertEqual(stats["procedure_fail_errors"], 1)
+
+    def test_max_concurrency(self):
+        results = []
+        threads = [Thread(target=lambda: results.append(self.executor.execute_procedure("wait", "x")))
+                   for _ in range(2)]
+        for thread in threads:
+            thread.start()
+        threads[0].join(0.1)
+        self.executor.release.set()
+        for thread in threads:
+            thread.join(5)
+        self.assertEqual(results, ["x", "x"])
+        self.assertEqual(self.executor.max_running, 1)
+
+    # endregion
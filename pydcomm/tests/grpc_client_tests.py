@@ -0,0 +1,204 @@
+import unittest
+
+import grpc
+import mock
+
+from pydcomm.public.bugarpc import RpcError
+from pydcomm.rpc.buga_grpc_client import GRemoteProcedureClient, GRpcSoLoaderLinuxClientFactory, gather, wait_any
+from pydcomm.rpc.common import marshal_batch_response, unmarshal_batch_request
+from pydcomm.rpc.gen.buga_rpc_pb2 import GResponse
+from pydcomm.rpc.retry_policy import RetryPolicy
+from pydcomm.tests.helpers import TestCasePatcher
+
+
+class FakeGrpcError(grpc.RpcError, grpc.Call):
+    """A failed gRPC call with a status code"""
+    def __init__(self, code):
+        super(FakeGrpcError, self).__init__()
+        self._code = code
+
+    def code(self):
+        return self._code
+
+
+class FakeGrpcFuture(object):
+    """A finished gRPC future that runs its callbacks immediately"""
+    def __init__(self, result=None, exception=None):
+        self._result = result
+        self._exception = exception
+
+    def add_done_callback(self, fn):
+        fn(self)
+
+    def cancelled(self):
+        return False
+
+    def cancel(self):
+        return False
+
+    def exception(self):
+        return self._exception
+
+    def result(self):
+        if self._exception:
+            raise self._exception
+        return self._result
+
+
+class UnitTestGRemoteProcedureClient(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.stubs = []
+        self.futures = []
+        self.call_error = None
+
+        def create_stub(client):
+            client.stub = mock.Mock()
+            client.stub.call.return_value = GResponse(buf="1.0")
+            client.stub.call.side_effect = self.call_error
+            client.stub.call.future.side_effect = lambda request, **kwargs: self.futures.pop(0)
+            self.stubs.append(client.stub)
+
+        patcher = mock.patch.object(GRemoteProcedureClient, "_create_grpc_channel_and_stub", create_stub)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client = GRemoteProcedureClient("localhost:29999")
+
+    def _fail_calls(self, error):
+        self.call_error = error
+        self.client.stub.call.side_effect = error
+
+    # region GRemoteProcedureClient.call_async() unit tests
+
+    def test_call_async_ok(self):
+        self.futures = [FakeGrpcFuture(GResponse(buf="pong"))]
+        self.assertEqual(self.client.call_async("ping", "").result(), "pong")
+        self.assertEqual(len(self.stubs), 1)
+
+    def test_call_async_retries_on_new_channel(self):
+        self.futures = [FakeGrpcFuture(exception=grpc.RpcError()), FakeGrpcFuture(GResponse(buf="pong"))]
+        self.assertEqual(self.client.call_async("ping", "").result(), "pong")
+        self.assertEqual(len(self.stubs), 2)
+
+    def test_call_async_fails_after_retry(self):
+        self.futures = [FakeGrpcFuture(exception=grpc.RpcError()), FakeGrpcFuture(exception=grpc.RpcError())]
+        self.assertIsInstance(self.client.call_async("ping", "").exception(), RpcError)
+
+    def test_call_async_not_retried_when_not_idempotent(self):
+        self.client.retry_policy = RetryPolicy(idempotent_procedures=["get_status"])
+        self.futures = [FakeGrpcFuture(exception=grpc.RpcError()), FakeGrpcFuture(GResponse(buf="pong"))]
+        self.assertIsInstance(self.client.call_async("start_recording", "").exception(), RpcError)
+        self.assertEqual(len(self.stubs), 1)
+
+    # endregion
+
+    # region GRemoteProcedureClient.call() retries and deadlines unit tests
+
+    def test_call_retries_until_max_attempts(self):
+        self.client.retry_policy = RetryPolicy(max_attempts=3)
+        stubs_before = len(self.stubs)
+        self._fail_calls(grpc.RpcError())
+        with self.assertRaises(RpcError):
+            self.client.call("ping", "")
+        self.assertEqual(len(self.stubs) - stubs_before, 2)
+
+    def test_call_not_retried_on_non_retryable_code(self):
+        self.client.retry_policy = RetryPolicy(retryable_codes=RetryPolicy.TRANSIENT_CODES)
+        stubs_before = len(self.stubs)
+        self._fail_calls(FakeGrpcError(grpc.StatusCode.INVALID_ARGUMENT))
+        with self.assertRaises(RpcError):
+            self.client.call("ping", "")
+        self.assertEqual(len(self.stubs), stubs_before)
+
+    def test_call_passes_procedure_deadline(self):
+        self.client.procedure_timeouts = {"ping": 2}
+        self.client.call("ping", "")
+        self.assertAlmostEqual(self.client.stub.call.call_args[1]["timeout"], 2, places=1)
+        self.client.call("other", "")
+        self.assertIsNone(self.client.stub.call.call_args[1]["timeout"])
+
+    def test_call_not_retried_after_deadline(self):
+        self.client.retry_policy = RetryPolicy(max_attempts=5, initial_backoff=10, jitter=0)
+        stubs_before = len(self.stubs)
+        self._fail_calls(FakeGrpcError(grpc.StatusCode.UNAVAILABLE))
+        with self.assertRaises(RpcError):
+            self.client.call("ping", "", timeout=1)
+        self.assertEqual(len(self.stubs), stubs_before)
+
+    def test_backoff_grows_up_to_max(self):
+        policy = RetryPolicy(initial_backoff=0.1, max_backoff=0.3, backoff_multiplier=2, jitter=0)
+        self.assertEqual([policy.backoff(attempt) for attempt in (1, 2, 3)], [0.1, 0.2, 0.3])
+
+    # endregion
+
+    # region gather() and wait_any() unit tests
+
+    def test_gather_keeps_order(self):
+        self.futures = [FakeGrpcFuture(GResponse(buf=str(i))) for i in range(5)]
+        futs = [self.client.call_async("ping", "") for _ in range(5)]
+        self.assertEqual(gather(futs), [str(i) for i in range(5)])
+
+    def test_wait_any_returns_done(self):
+        self.futures = [FakeGrpcFuture(GResponse(buf="pong"))]
+        done, not_done = wait_any([self.client.call_async("ping", "")])
+        self.assertEqual(len(done), 1)
+        self.assertEqual(len(not_done), 0)
+
+    # endregion
+
+    # region GRemoteProcedureClient.call_batch() unit tests
+
+    def test_call_batch_single_round_trip(self):
+        self.client.stub.call.return_value = GResponse(buf=marshal_batch_response([(True, "a"), (False, "oops")]))
+        res = self.client.call_batch([("first", "1"), ("second", "2")])
+
+        request = self.client.stub.call.call_args[0][0]
+        self.assertEqual(request.name, "_rpc_batch")
+        self.assertEqual(unmarshal_batch_request(request.buf), [("first", "1"), ("second", "2")])
+        self.assertEqual(res[0], "a")
+        self.assertIsInstance(res[1], RpcError)
+
+    def test_call_batch_truncated_response_raises_rpc_error(self):
+        self.client.stub.call.return_value = GResponse(buf=marshal_batch_response([(True, "abc")])[:-1])
+        with self.assertRaises(RpcError):
+            self.client.call_batch([("first", "1")])
+
+    # endregion
+
+
+class UnitTestGRpcClientFactory(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.patcher = TestCasePatcher(self)
+        self.mock_client = self.patcher.addPatch("pydcomm.rpc.buga_grpc_client.GRemoteProcedureClient")
+        self.mock_exists = self.patcher.addPatch("pydcomm.rpc.buga_grpc_client.os.path.exists")
+
+    # region _GRpcClientFactory.create_connection() unit tests
+
+    def test_local_device_uses_unix_socket(self):
+        self.mock_exists.return_value = True
+        GRpcSoLoaderLinuxClientFactory.create_connection(29999, device_id="localhost")
+        self.mock_exists.assert_called_once_with("/tmp/buga_rpc_29999.sock")
+        self.assertEqual(self.mock_client.call_args[0][0], "unix:///tmp/buga_rpc_29999.sock")
+
+    def test_local_device_without_socket_uses_tcp(self):
+        self.mock_exists.return_value = False
+        GRpcSoLoaderLinuxClientFactory.create_connection(29999, device_id="localhost")
+        self.assertEqual(self.mock_client.call_args[0][0], "localhost:29999")
+
+    def test_stale_socket_falls_back_to_tcp(self):
+        self.mock_exists.return_value = True
+        self.mock_client.side_effect = [RpcError("Connection refused"), mock.Mock()]
+        GRpcSoLoaderLinuxClientFactory.create_connection(29999, device_id="127.0.0.1")
+        self.assertEqual(self.mock_client.call_args[0][0], "127.0.0.1:29999")
+
+    def test_remote_device_uses_tcp(self):
+        GRpcSoLoaderLinuxClientFactory.create_connection(29999, device_id="10.0.0.5")
+        self.mock_exists.assert_not_called()
+        self.assertEqual(self.mock_client.call_args[0][0], "10.0.0.5:29999")
+
+    # endregion
@@ -0,0 +1,198 @@
+import time
+import unittest
+from threading import Thread
+
+import grpc
+import mock
+from concurrent import futures
+
+from pydcomm.public.bugarpc import RpcError
+from pydcomm.rpc.buga_grpc_client import GRemoteProcedureClient, gather
+from pydcomm.rpc.buga_grpc_server import (AsyncExecutor, AsyncServerAndExecutor, GRemoteProcedureLargePoolServer,
+                                          GRemoteProcedureServer, BugaEchoExecutor, BugaGRpcServiceImpl,
+                                          BugaGRpcStreamingServiceImpl)
+from pydcomm.rpc.admission import AdmissionControl
+from pydcomm.rpc.common import (RPC_BATCH_PROCEDURE, marshal_batch_request, unmarshal_batch_response,
+                                RPC_CHUNKED_CALL_PROCEDURE, marshal_chunked_header)
+from pydcomm.rpc.gen.buga_rpc_pb2 import GRequest, GResponse
+from pydcomm.rpc.process_pool import cpu_bound
+
+
+class CpuBoundEchoExecutor(BugaEchoExecutor):
+    def execute_procedure(self, procedure_name, params):
+        return None if procedure_name == "none" else params
+
+    @cpu_bound
+    def reverse(self, params):
+        return params[::-1]
+
+
+class UnitTestBugaGRpcServiceImpl(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.process_pool = mock.Mock()
+        self.service = BugaGRpcServiceImpl(CpuBoundEchoExecutor(), mock.Mock(), process_pool=self.process_pool)
+
+    # region BugaGRpcServiceImpl._call_procedure() unit tests
+
+    def test_cpu_bound_procedure_dispatched_to_pool(self):
+        self.process_pool.call.return_value = "ba"
+        self.assertEqual(self.service._call_procedure("reverse", "ab"), "ba")
+        self.process_pool.call.assert_called_once_with("reverse", "ab")
+
+    def test_other_procedures_executed_in_thread(self):
+        self.assertEqual(self.service._call_procedure("echo", "ab"), "ab")
+        self.process_pool.call.assert_not_called()
+
+    def test_cpu_bound_procedure_without_pool(self):
+        self.service.process_pool = None
+        self.assertEqual(self.service._call_procedure("reverse", "ab"), "ba")
+
+    def test_rejected_call_aborted_with_resource_exhausted(self):
+        self.service.admission_control = AdmissionControl(max_active=0)
+        context = mock.Mock()
+        context.abort.side_effect = Exception("aborted")
+        with self.assertRaises(Exception):
+            self.service.call(GRequest(name="echo", buf=""), context)
+        self.assertEqual(context.abort.call_args[0][0], grpc.StatusCode.RESOURCE_EXHAUSTED)
+        self.assertEqual(self.service.call(GRequest(name="_rpc_get_version", buf=""), context).buf, "1.0")
+
+    def test_batch_executes_each_call_and_rejects_nested_batch(self):
+        batch = marshal_batch_request([("echo", "a"), ("_rpc_get_version", ""),
+                                       (RPC_BATCH_PROCEDURE, marshal_batch_request([])), ("none", ""),
+                                       ("echo", "b")])
+        ret = self.service.call(GRequest(name=RPC_BATCH_PROCEDURE, buf=batch), mock.Mock()).buf
+        results = unmarshal_batch_response(ret)
+        self.assertEqual(results[:2], [(True, "a"), (True, "1.0")])
+        self.assertEqual(results[2], (False, "ValueError: Nested batches are not supported"))
+        self.assertFalse(results[3][0])
+        self.assertIn("TypeError", results[3][1])
+        self.assertEqual(results[4], (True, "b"))
+
+    # endregion
+
+
+class UnitTestBugaGRpcStreamingServiceImpl(unittest.TestCase):
+    # region BugaGRpcStreamingServiceImpl.call_streaming() unit tests
+
+    @mock.patch("pydcomm.rpc.buga_grpc_server.reassemble_chunks")
+    def test_chunked_call_over_max_message_size_rejected_before_allocating(self, mock_reassemble):
+        service = BugaGRpcStreamingServiceImpl(BugaEchoExecutor(), mock.Mock())
+        context = mock.Mock()
+        context.abort.side_effect = Exception("aborted")
+        header = marshal_chunked_header("echo", GRemoteProcedureServer.MAX_MESSAGE_SIZE + 1, 1024)
+        requests = iter([GResponse(buf=RPC_CHUNKED_CALL_PROCEDURE), GResponse(buf=header)])
+
+        with self.assertRaises(Exception):
+            list(service.call_streaming(requests, context))
+        self.assertEqual(context.abort.call_args[0][0], grpc.StatusCode.INVALID_ARGUMENT)
+        mock_reassemble.assert_not_called()
+
+    # endregion
+
+
+class UnitTestAsyncExecutor(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.executor = AsyncExecutor(verbose=False)
+
+    # region AsyncExecutor unit tests
+
+    def test_call_pending_until_returned(self):
+        future = self.executor.execute_procedure_async("ping", "1")
+        self.assertFalse(future.done())
+        call = self.executor.get()
+        self.assertEqual((call.procedure_name, call.params), ("ping", "1"))
+
+        call.return_("pong")
+        self.assertEqual(future.result(timeout=0), "pong")
+        self.assertTrue(self.executor.empty())
+        self.assertEqual(self.executor.logged_calls, [call])
+
+    def test_calls_returned_out_of_order(self):
+        first = self.executor.execute_procedure_async("a", "")
+        second = self.executor.execute_procedure_async("b", "")
+        self.executor.waiting_calls[1].return_("2")
+        self.assertFalse(first.done())
+        self.assertEqual(second.result(timeout=0), "2")
+        self.assertEqual(self.executor.get().index, 0)
+
+    def test_cancel_waiting(self):
+        future = self.executor.execute_procedure_async("ping", "")
+        self.executor.cancel_waiting()
+        with self.assertRaises(futures.CancelledError):
+            future.result(timeout=0)
+        self.assertTrue(self.executor.empty())
+
+    # endregion
+
+
+class UnitTestGRemoteProcedureServer(unittest.TestCase):
+    RPC_ID = 29993
+
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.on_stop = mock.Mock()
+        self.server = GRemoteProcedureServer(local_socket=False, on_stop=self.on_stop)
+        self.server.listen(BugaEchoExecutor(), self.RPC_ID, False)
+        self.addCleanup(self.server.stop)
+
+    # region GRemoteProcedureServer.wait() and stop() unit tests
+
+    def test_wait_times_out_while_running(self):
+        self.assertFalse(self.server.wait(0.05))
+        self.on_stop.assert_not_called()
+
+    def test_wait_returns_on_stop(self):
+        waiter = Thread(target=self.server.wait)
+        waiter.start()
+        self.assertTrue(self.server.stop(5))
+        waiter.join(5)
+        self.assertFalse(waiter.is_alive())
+        self.assertTrue(self.server.wait(0))
+
+    def test_on_stop_called_once(self):
+        self.assertTrue(self.server.stop(5))
+        self.assertTrue(self.server.stop(5))
+        self.on_stop.assert_called_once_with()
+
+    # endregion
+
+
+class UnitTestGRemoteProcedureLargePoolServer(unittest.TestCase):
+    RPC_ID = 29990
+
+    def _wait_for_calls(self, server_and_executor, count):
+        deadline = time.time() + 10
+        while len(server_and_executor.waiting_calls) < count and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual(len(server_and_executor.waiting_calls), count)
+
+    def test_more_pending_calls_than_default_workers(self):
+        server = GRemoteProcedureLargePoolServer(local_socket=False)
+        with AsyncServerAndExecutor(self.RPC_ID, server=server, verbose=False) as server_and_executor:
+            client = GRemoteProcedureClient("localhost:{}".format(self.RPC_ID))
+            calls = [client.call_async("echo", str(i), timeout=10) for i in range(100)]
+            self._wait_for_calls(server_and_executor, 100)
+            for call in reversed(server_and_executor.waiting_calls.values()):
+                call.return_(call.params)
+            self.assertEqual(gather(calls), [str(i) for i in range(100)])
+
+    def test_calls_over_limit_rejected(self):
+        server = GRemoteProcedureLargePoolServer(max_pending_calls=2, local_socket=False)
+        with AsyncServerAndExecutor(self.RPC_ID, server=server, verbose=False) as server_and_executor:
+            client = GRemoteProcedureClient("localhost:{}".format(self.RPC_ID))
+            calls = [client.call_async("echo", str(i), timeout=10) for i in range(2)]
+            self._wait_for_calls(server_and_executor, 2)
+            with self.assertRaises(RpcError) as cm:
+                client.call_async("echo", "over", timeout=10).result()
+            self.assertEqual(cm.exception.grpc_exception.code(), grpc.StatusCode.RESOURCE_EXHAUSTED)
+            for call in server_and_executor.waiting_calls.values():
+                call.return_(call.params)
+            self.assertEqual(gather(calls), ["0", "1"])
@@ -0,0 +1,81 @@
+import unittest
+
+import numpy as np
+from parameterized import parameterized
+
+from pydcomm.rpc._marshallers import (nparray_binary_marshal, nparray_binary_unmarshal, create_default_registry,
+                                      cbor_marshal, cbor_unmarshal)
+
+
+class UnitTestMarshallers(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.registry = create_default_registry()
+
+    # region nparray_binary_marshal() unit tests
+
+    @parameterized.expand([
+        ("float64", np.random.rand(2 ** 8)),
+        ("int16_2d", np.arange(12, dtype=np.int16).reshape(3, 4)),
+        ("big_endian", np.arange(10, dtype='>i4')),
+        ("fortran", np.asfortranarray(np.random.rand(3, 5))),
+        ("scalar", np.array(3.5)),
+        ("empty", np.zeros((0, 3), dtype=np.uint8)),
+        ("complex", np.array([1 + 2j, 3 - 4j])),
+    ])
+    def test_nparray_binary_roundtrip(self, _, x):
+        y = nparray_binary_unmarshal(nparray_binary_marshal(x))
+        self.assertEqual(y.dtype, x.dtype)
+        self.assertEqual(y.shape, x.shape)
+        self.assertEqual(y.flags.f_contiguous and not y.flags.c_contiguous,
+                         x.flags.f_contiguous and not x.flags.c_contiguous)
+        np.testing.assert_array_equal(y, x)
+
+    def test_nparray_binary_non_contiguous(self):
+        x = np.arange(20).reshape(4, 5)[::2, 1:]
+        np.testing.assert_array_equal(nparray_binary_unmarshal(nparray_binary_marshal(x)), x)
+
+    def test_nparray_binary_unmarshal_doesnt_copy(self):
+        buf = bytearray(nparray_binary_marshal(np.zeros(4, dtype=np.int32)))
+        y = nparray_binary_unmarshal(buf)
+        y[0] = 7
+        self.assertEqual(nparray_binary_unmarshal(buf)[0], 7)
+
+    def test_nparray_binary_rejects_objects(self):
+        self.assertRaises(ValueError, nparray_binary_marshal, np.array([object()]))
+
+    def test_nparray_binary_unmarshal_rejects_cbor(self):
+        from pydcomm.rpc._marshallers import nparray_marshal
+        self.assertRaises(ValueError, nparray_binary_unmarshal, nparray_marshal(np.arange(100)))
+
+    # endregion
+
+    # region MarshallerRegistry unit tests
+
+    @parameterized.expand([
+        ("str", "abc", "raw"),
+        ("ndarray", np.arange(5), "ndarray"),
+        ("dict", {"a": [1, 2]}, "cbor"),
+    ])
+    def test_registry_chooses_by_type(self, _, value, content_type):
+        self.assertEqual(self.registry.choose(value).content_type, content_type)
+
+    def test_registry_roundtrip(self):
+        for content_type in ["cbor", "zlib+cbor"]:
+            value, accepted = self.registry.unpack(self.registry.pack({"a": [1, 2]}, content_type=content_type))
+            self.assertEqual(value, {"a": [1, 2]})
+            self.assertEqual(accepted, self.registry.content_types())
+
+    def test_registry_answers_in_accepted_format(self):
+        self.assertEqual(self.registry.choose(np.arange(5), accepted=["cbor", "ndarray-cbor"]).content_type,
+                         "ndarray-cbor")
+        self.assertEqual(self.registry.choose("abc", accepted=["cbor"]).content_type, "cbor")
+
+    def test_registry_unknown_content_type(self):
+        other = create_default_registry()
+        other.register("custom", cbor_marshal, cbor_unmarshal, types=(int,))
+        self.assertRaises(ValueError, self.registry.unpack, other.pack(3))
+
+    # endregion
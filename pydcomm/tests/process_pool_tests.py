@@ -0,0 +1,71 @@
+import glob
+import os
+import unittest
+
+import mock
+
+from pydcomm.rpc.common import SharedMemoryRing
+from pydcomm.rpc.process_pool import ProcessPoolDispatcher, cpu_bound, get_cpu_bound_procedures
+
+
+class PidExecutor(object):
+    def __init__(self):
+        self.calls = 0
+
+    @cpu_bound
+    def reverse(self, params):
+        self.calls += 1
+        return params[::-1]
+
+    @cpu_bound
+    def pid(self, params):
+        return str(os.getpid())
+
+    def not_cpu_bound(self, params):
+        return params
+
+
+class UnitTestProcessPoolDispatcher(unittest.TestCase):
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.executor = PidExecutor()
+        self.dispatcher = ProcessPoolDispatcher(self.executor, max_workers=1, handoff_threshold=1024)
+        self.addCleanup(self.dispatcher.shutdown)
+
+    # region ProcessPoolDispatcher unit tests
+
+    def test_call_in_worker_process(self):
+        self.assertNotEqual(self.dispatcher.call("pid", ""), str(os.getpid()))
+
+    def test_large_buffers_handed_off(self):
+        params = os.urandom(4096)
+        self.assertEqual(self.dispatcher.call("reverse", params), params[::-1])
+
+    def test_worker_has_own_executor_copy(self):
+        self.assertEqual(self.dispatcher.call("reverse", "ab"), "ba")
+        self.assertEqual(self.executor.calls, 0)
+
+    def test_handed_off_return_value_removed_when_taking_fails(self):
+        handoff_files = os.path.join(SharedMemoryRing.SHM_DIR, "buga_rpc_*")
+        files_before = set(glob.glob(handoff_files))
+
+        # The worker was forked before patching, so only this process fails to take
+        with mock.patch("pydcomm.rpc.process_pool._SharedBuffer.take", side_effect=IOError("broken")):
+            with self.assertRaises(IOError):
+                self.dispatcher.call("reverse", os.urandom(4096))
+
+        self.assertEqual(set(glob.glob(handoff_files)), files_before)
+
+    def test_empty_buffers_handed_off(self):
+        dispatcher = ProcessPoolDispatcher(self.executor, max_workers=1, handoff_threshold=0)
+        self.addCleanup(dispatcher.shutdown)
+        self.assertEqual(dispatcher.call("reverse", ""), "")
+
+    def test_get_cpu_bound_procedures(self):
+        procedures = get_cpu_bound_procedures(self.executor)
+        self.assertEqual(sorted(procedures), ["pid", "reverse"])
+        self.assertEqual(procedures["reverse"]("ab"), "ba")
+
+    # endregion
@@ -0,0 +1,286 @@
+import gc
+import os
+import unittest
+import weakref
+from Queue import Full, Queue
+from threading import Thread
+
+import grpc
+
+from pydcomm.rpc.common import (CompressionPolicy, marshal_batch_request, unmarshal_batch_request, marshal_batch_response,
+                                unmarshal_batch_response, marshal_chunked_header, unmarshal_chunked_header,
+                                iter_chunks, iter_chunked_return, reassemble_chunks, reassemble_chunked_return,
+                                SharedMemoryRing, SHM_INLINE, WatermarkQueue, QueueClosedError, marshal_frame,
+                                unmarshal_frame, iter_coalesced_frames, iter_split_frames, GReaderWriterStream)
+from pydcomm.rpc.gen.buga_rpc_pb2 import GResponse
+
+
+_CANCELLED = object()
+
+
+class FakeResponses(object):
+    """
+    Responses of a streaming call, received from a queue until None.
+    Like gRPC, a read blocked while cancelling raises an RpcError.
+    """
+    def __init__(self, values=(), error=None):
+        self.queue = Queue()
+        for value in values:
+            self.queue.put(value)
+        self.error = error
+        self.cancelled = False
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        value = self.queue.get()
+        if value is _CANCELLED:
+            raise grpc.RpcError()
+        if value is None:
+            self.queue.put(None)  # Like gRPC, keep ending
+            if self.error is not None:
+                raise self.error
+            raise StopIteration
+        return GResponse(buf=value)
+
+    def cancel(self):
+        self.cancelled = True
+        self.queue.put(_CANCELLED)
+
+
+class UnitTestRpcCommon(unittest.TestCase):
+
+    # region Batch framing unit tests
+
+    def test_batch_request_roundtrip(self):
+        calls = [("set_gain", "3"), ("", ""), ("get_data", "\x00\xff" * 100), ("no_params", None)]
+        self.assertEqual(unmarshal_batch_request(marshal_batch_request(calls)),
+                         [("set_gain", "3"), ("", ""), ("get_data", "\x00\xff" * 100), ("no_params", "")])
+
+    def test_batch_response_roundtrip(self):
+        results = [(True, "OK"), (False, "ValueError: bad gain"), (True, "")]
+        self.assertEqual(unmarshal_batch_response(marshal_batch_response(results)), results)
+
+    def test_batch_request_truncated(self):
+        buf = marshal_batch_request([("set_gain", "3")])
+        self.assertRaises(ValueError, unmarshal_batch_request, buf[:-1])
+
+    # endregion
+
+    # region Chunked call framing unit tests
+
+    def test_chunked_header_roundtrip(self):
+        header = marshal_chunked_header("get_recorded_data", 100 * 2 ** 20, 2 ** 20)
+        self.assertEqual(unmarshal_chunked_header(header), ("get_recorded_data", 100 * 2 ** 20, 2 ** 20))
+
+    def test_iter_chunks(self):
+        self.assertEqual(list(iter_chunks("abcdefg", 3)), ["abc", "def", "g"])
+        self.assertEqual(list(iter_chunks("", 3)), [])
+
+    def test_chunked_return_roundtrip(self):
+        buf = "0123456789" * 1000
+        self.assertEqual(reassemble_chunked_return(iter_chunked_return(buf, 333)), buf)
+        self.assertEqual(reassemble_chunked_return(iter_chunked_return("", 333)), "")
+
+    def test_reassemble_wrong_size(self):
+        self.assertRaises(ValueError, reassemble_chunks, 4, ["ab", "c"])
+        self.assertRaises(ValueError, reassemble_chunks, 4, ["ab", "cde"])
+
+    # endregion
+
+    # region CompressionPolicy unit tests
+
+    def test_compression_small_message_not_compressed(self):
+        self.assertEqual(CompressionPolicy(threshold=100).choose("\0" * 99), grpc.Compression.NoCompression)
+        self.assertEqual(CompressionPolicy(threshold=100).choose(None), grpc.Compression.NoCompression)
+
+    def test_compression_by_ratio(self):
+        policy = CompressionPolicy(threshold=100)
+        self.assertEqual(policy.choose("\0" * 1000), grpc.Compression.Gzip)
+        self.assertLess(policy.last_ratio, 0.1)
+        self.assertEqual(policy.choose(os.urandom(1000)), grpc.Compression.NoCompression)
+        self.assertGreater(policy.last_ratio, 0.9)
+
+    # endregion
+
+    # region SharedMemoryRing unit tests
+
+    def test_shared_memory_ring_shared_between_mappings(self):
+        writer = SharedMemoryRing.create(1024)
+        self.addCleanup(writer.close)
+        reader = SharedMemoryRing.open(writer.path)
+        self.addCleanup(reader.close)
+        writer.unlink()
+        offset = writer.write(bytearray("\x00\xffpayload"))
+        self.assertEqual(reader.read(offset, 9), "\x00\xffpayload")
+
+    def test_shared_memory_ring_wraps(self):
+        ring = SharedMemoryRing.create(100)
+        self.addCleanup(ring.close)
+        ring.unlink()
+        self.assertEqual(ring.write("a" * 60), 0)
+        self.assertEqual(ring.write("b" * 30), 60)
+        self.assertEqual(ring.write("c" * 30), 0)
+        self.assertEqual(ring.read(0, 30), "c" * 30)
+        self.assertEqual(ring.write("d" * 101), SHM_INLINE)
+
+    # endregion
+
+    # region WatermarkQueue unit tests
+
+    def test_watermark_queue_full_until_low_watermark(self):
+        queue = WatermarkQueue(high_watermark=10, low_watermark=4)
+        for _ in range(5):
+            queue.put("ab", block=False)
+        with self.assertRaises(Full):
+            queue.put("ab", block=False)
+        queue.get()
+        queue.get()
+        with self.assertRaises(Full):
+            queue.put("ab", timeout=0.01)
+        queue.get()
+        queue.put("ab", block=False)
+        self.assertEqual(queue.stats(), {"queue_depth": 3, "queued_bytes": 6, "max_queued_bytes": 10,
+                                         "blocked_writes": 1})
+
+    def test_watermark_queue_accepts_large_value_when_empty(self):
+        queue = WatermarkQueue(high_watermark=10)
+        queue.put("x" * 100, block=False)
+        with self.assertRaises(Full):
+            queue.put("x", block=False)
+        sentinel = object()
+        queue.put(sentinel, force=True)
+        self.assertEqual(queue.get(), "x" * 100)
+        self.assertIs(queue.get(), sentinel)
+
+    def test_watermark_queue_close_wakes_blocked_put(self):
+        queue = WatermarkQueue(high_watermark=10)
+        queue.put("x" * 10)
+        errors = []
+
+        def put():
+            try:
+                queue.put("x")
+            except QueueClosedError as ex:
+                errors.append(ex)
+        writer = Thread(target=put)
+        writer.start()
+        queue.close()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual(len(errors), 1)
+        with self.assertRaises(QueueClosedError):
+            queue.put("x", block=False)
+        sentinel = object()
+        queue.put(sentinel, force=True)
+        self.assertEqual(queue.get(), "x" * 10)
+        self.assertIs(queue.get(), sentinel)
+
+    # endregion
+
+    # region Coalesced streaming framing unit tests
+
+    def test_coalesced_frames_preserve_boundaries(self):
+        values = ["a" * 3, "", "b" * 5, bytearray("c" * 4), "d"]
+        queue = WatermarkQueue(high_watermark=1024)
+        end = object()
+        for value in values:
+            queue.put(value)
+        queue.put(end, force=True)
+        frames = list(iter_coalesced_frames(queue, end, max_frame_size=8, max_delay=0))
+        self.assertEqual([len(unmarshal_frame(frame)) for frame in frames], [3, 2])
+        self.assertEqual(list(iter_split_frames(frames)), [str(value) for value in values])
+
+    def test_frame_truncated(self):
+        for buf in (marshal_frame(["abc"])[:-1], marshal_frame(["abc"])[:2]):
+            with self.assertRaisesRegexp(ValueError, "Truncated coalesced frame"):
+                unmarshal_frame(buf)
+
+    # endregion
+
+    # region GReaderWriterStream unit tests
+
+    def _create_stream(self, responses, read_ahead, high_watermark=1024):
+        return GReaderWriterStream(responses, WatermarkQueue(high_watermark=high_watermark), object(),
+                                   read_ahead=read_ahead)
+
+    @staticmethod
+    def _start_thread(target, errors):
+        def run():
+            try:
+                target()
+            except Exception as ex:
+                errors.append(ex)
+        thread = Thread(target=run)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def test_stream_iterates_with_read_ahead(self):
+        for read_ahead in (0, 2):
+            stream = self._create_stream(FakeResponses(["a", "b", "c", None]), read_ahead)
+            self.assertEqual(list(stream), ["a", "b", "c"])
+            with self.assertRaises(StopIteration):
+                stream.read()
+
+    def test_stream_read_ahead_raises_error_at_end(self):
+        stream = self._create_stream(FakeResponses(["a", None], error=ValueError("broken")), read_ahead=2)
+        self.assertEqual(stream.read(), "a")
+        with self.assertRaises(ValueError):
+            stream.read()
+
+    def test_stream_end_closes_write_queue(self):
+        for read_ahead in (0, 2):
+            stream = self._create_stream(FakeResponses([None], error=grpc.RpcError()), read_ahead)
+            with self.assertRaises(grpc.RpcError):
+                stream.read()
+            with self.assertRaises(QueueClosedError):
+                stream.write("a")
+
+    def test_stream_dropped_with_read_ahead_ends_writing(self):
+        queue = WatermarkQueue(high_watermark=1024)
+        end = object()
+        stream = GReaderWriterStream(FakeResponses(["a", "b", "c"]), queue, end, read_ahead=1)
+        stream_ref = weakref.ref(stream)
+        del stream
+        gc.collect()
+
+        self.assertIsNone(stream_ref())
+        self.assertIs(queue.get(timeout=5), end)
+
+    def test_stream_cancel_stops_blocked_read(self):
+        responses = FakeResponses(["a"])
+        with self._create_stream(responses, read_ahead=2) as stream:
+            self.assertEqual(stream.read(), "a")
+            reader = Thread(target=lambda: list(stream))
+            reader.start()
+        reader.join(5)
+        self.assertFalse(reader.is_alive())
+        self.assertTrue(responses.cancelled)
+        responses.queue.put(None)
+
+    def test_stream_cancel_from_another_thread_stops_blocked_read(self):
+        for read_ahead in (0, 2):
+            stream = self._create_stream(FakeResponses(), read_ahead)
+            errors = []
+            reader = self._start_thread(lambda: self.assertEqual(list(stream), []), errors)
+            reader.join(0.1)
+            stream.cancel()
+            reader.join(5)
+            self.assertFalse(reader.is_alive())
+            self.assertEqual(errors, [])
+
+    def test_stream_cancel_from_another_thread_releases_blocked_write(self):
+        stream = self._create_stream(FakeResponses(), read_ahead=0, high_watermark=4)
+        stream.write("abcd")
+        errors = []
+        writer = self._start_thread(lambda: stream.write("e"), errors)
+        writer.join(0.1)
+        self.assertTrue(writer.is_alive())
+        stream.cancel()
+        writer.join(5)
+        self.assertFalse(writer.is_alive())
+        self.assertEqual([type(ex) for ex in errors], [QueueClosedError])
+
+    # endregion
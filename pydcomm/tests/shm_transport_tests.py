@@ -0,0 +1,50 @@
+import unittest
+
+from pydcomm.public.bugarpc import RpcError
+from pydcomm.rpc.buga_grpc_server import BugaEchoExecutor
+from pydcomm.rpc.shm_client import SharedMemoryRemoteProcedureClient
+from pydcomm.rpc.shm_server import SharedMemoryRemoteProcedureServer
+
+
+class FailingEchoExecutor(BugaEchoExecutor):
+    def execute_procedure(self, procedure_name, params):
+        if procedure_name == "fail":
+            raise ValueError("bad params")
+        if procedure_name == "none":
+            return None
+        return params
+
+
+class UnitTestSharedMemoryTransport(unittest.TestCase):
+    RPC_ID = 29991
+
+    def setUp(self):
+        """
+        Executed in the beginning of each test
+        """
+        self.server = SharedMemoryRemoteProcedureServer()
+        self.server.listen(FailingEchoExecutor(), self.RPC_ID, False)
+        self.addCleanup(self.server.stop)
+        self.client = SharedMemoryRemoteProcedureClient(self.RPC_ID, ring_size=1024)
+        self.addCleanup(self.client.close)
+
+    def test_call_through_ring(self):
+        self.assertEqual(self.client.call("echo", "\x00\xff" * 100), "\x00\xff" * 100)
+        self.assertEqual(self.client.get_executor_version(), "1.0")
+
+    def test_call_larger_than_ring(self):
+        self.assertEqual(self.client.call("echo", "x" * 5000), "x" * 5000)
+
+    def test_executor_error(self):
+        with self.assertRaises(RpcError):
+            self.client.call("fail", "")
+        self.assertEqual(self.client.call_batch([("echo", "a"), ("fail", "")])[0], "a")
+
+    def test_executor_returns_non_buffer(self):
+        with self.assertRaises(RpcError):
+            self.client.call("none", "")
+        self.assertEqual(self.client.call("echo", "a"), "a")
+
+    def test_no_server(self):
+        with self.assertRaises(RpcError):
+            SharedMemoryRemoteProcedureClient(self.RPC_ID + 1)